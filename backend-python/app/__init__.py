@@ -1,14 +1,21 @@
 """
 Flask App Factory
 """
-from flask import Flask, jsonify
+import time
+from threading import Thread
+from flask import Flask, jsonify, request, g, Response
 from flask_cors import CORS
 from pymongo import MongoClient
 import logging
 from app.config.config import get_config
-from app.models.database import Database
+from app.models.database import Database, mongo_client_options, SCHEMA_VERSION
 from app.services.mqtt_service import MQTTService
+from app.services.tariff_engine import tariff_cache
+from app.services.response_cache import response_cache
+from app.services.bill_cache import bill_cache
 from app.routes import api_blueprint
+from app.serving import should_ingest
+from app.services import metrics
 
 # Setup logging
 logging.basicConfig(
@@ -27,33 +34,61 @@ def create_app():
     CORS(app, resources={r'/api/*': {'origins': config.CORS_ORIGINS}})
     
     # MongoDB connection
+    app.startup = {'state': 'starting', 'schema_version': None, 'error': None}
     try:
-        mongo_client = MongoClient(config.MONGO_URI, serverSelectionTimeoutMS=5000)
-        mongo_client.server_info()  # Test connection
-        app.db = Database(mongo_client, config.DB_NAME)
-        logger.info(f'Connected to MongoDB: {config.DB_NAME}')
+        mongo_client = MongoClient(config.MONGO_URI, **mongo_client_options(config))
+        if config.FAST_START:
+            # MongoClient connects lazily; collections/indexes come from `manage.py migrate`
+            app.db = Database(mongo_client, config.DB_NAME, config, init=False)
+        else:
+            mongo_client.server_info()  # Test connection
+            app.db = Database(mongo_client, config.DB_NAME, config)
+            logger.info(f'Connected to MongoDB: {config.DB_NAME}')
     except Exception as e:
         logger.error(f'MongoDB connection failed: {e}')
         raise
     
+    tariff_cache.ttl = config.TARIFF_CACHE_TTL
+    bill_cache.max_entries = config.BILL_CACHE_SIZE
+    response_cache.max_entries = config.RESPONSE_CACHE_SIZE
+    response_cache.max_bytes = config.RESPONSE_CACHE_MAX_MB * 1024 * 1024
+    
     # MQTT Service
     try:
-        app.mqtt = MQTTService(config, app.db.db)
-        app.mqtt.connect()
+        # create_app runs in each gunicorn worker (no preload), so clients and
+        # threads are created after fork; only one process persists telemetry
+        app.mqtt = MQTTService(config, app.db.db, ingest=should_ingest(config))
     except Exception as e:
         logger.error(f'MQTT service initialization failed: {e}')
     
+    if config.FAST_START:
+        # Schema check, state warm-up and MQTT connect happen off the serving path
+        Thread(target=finish_startup, args=(app,), name='startup', daemon=True).start()
+    else:
+        finish_startup(app)
+    
     # Register blueprints
     app.register_blueprint(api_blueprint.bp)
     
+    if config.METRICS_ENABLED:
+        init_metrics(app)
+    
     # Health check endpoint
     @app.route('/health', methods=['GET'])
     def health_check():
         return jsonify({
-            'status': 'ok',
+            'status': 'ok' if app.startup['state'] == 'ready' else app.startup['state'],
+            'startup': app.startup,
             'mqtt_connected': app.mqtt.connected if hasattr(app, 'mqtt') else False,
-            'db_connected': True
-        }), 200
+            'db_connected': app.startup['schema_version'] is not None,
+            'ingest': {
+                'queue': app.mqtt.pipeline.snapshot(),
+                'buffer': app.mqtt.buffer.snapshot(),
+                'spool': app.mqtt.spool.snapshot() if app.mqtt.spool else None
+            } if hasattr(app, 'mqtt') else None,
+            'live': app.mqtt.live_snapshot() if hasattr(app, 'mqtt') else None,
+            'response_cache': response_cache.snapshot()
+        }), 200 if app.startup['state'] == 'ready' else 503
     
     @app.teardown_appcontext
     def shutdown_session(exception=None):
@@ -62,6 +97,101 @@ def create_app():
     
     return app
 
+def finish_startup(app, max_backoff=30.0):
+    """
+    Check the stored schema version, connect MQTT and warm live state.
+    The schema check is retried with backoff until MongoDB answers with a
+    current schema, so a worker booted during an outage (or before
+    `manage.py migrate`) becomes ready on its own. Live state is warmed
+    after the worker is ready.
+    """
+    ok = check_schema(app)
+    
+    if hasattr(app, 'mqtt'):
+        try:
+            app.mqtt.connect()
+        except Exception as e:
+            logger.error(f'MQTT service initialization failed: {e}')
+    
+    delay = 1.0
+    while not ok:
+        time.sleep(delay)
+        delay = min(delay * 2, max_backoff)
+        ok = check_schema(app)
+    app.startup['state'] = 'ready'
+    app.startup['error'] = None
+    
+    if hasattr(app, 'mqtt'):
+        app.mqtt.state.warm(app.db.db)
+
+def check_schema(app):
+    """Record the stored schema version; False (state degraded) if MongoDB is unreachable or behind"""
+    try:
+        version = app.db.schema_version()
+    except Exception as e:
+        app.startup['state'] = 'degraded'
+        app.startup['error'] = str(e)
+        logger.error(f'MongoDB connection failed: {e}')
+        return False
+    
+    app.startup['schema_version'] = version
+    if version < SCHEMA_VERSION:
+        app.startup['state'] = 'degraded'
+        app.startup['error'] = f'schema version {version} < {SCHEMA_VERSION}, run `python manage.py migrate`'
+        logger.error(f'Database {app.startup["error"]}')
+        return False
+    
+    logger.info(f'Connected to MongoDB: {app.db.db.name} (schema v{version})')
+    return True
+
+def init_metrics(app):
+    """Per-route latency histograms, ingest collectors and the /metrics endpoint"""
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.http_request_seconds.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+        return response
+    
+    if hasattr(app, 'mqtt'):
+        metrics.stats_collector(
+            'smartmeter_mqtt_messages', app.mqtt.pipeline.snapshot,
+            counters=('enqueued', 'processed', 'failed', 'dropped'),
+            gauges=('depth', 'high_watermark')
+        )
+        metrics.stats_collector(
+            'smartmeter_ingest_readings', app.mqtt.buffer.snapshot,
+            counters=('received', 'persisted', 'dropped', 'duplicates', 'write_errors', 'flushes', 'flush_failures', 'rollup_failures', 'spooled'),
+            gauges=('depth', 'high_watermark', 'last_flush_ms')
+        )
+        if app.mqtt.spool:
+            metrics.stats_collector(
+                'smartmeter_ingest_spool', app.mqtt.spool.snapshot,
+                counters=('spooled', 'replayed', 'rejected', 'corrupt'),
+                gauges=('bytes', 'segments', 'lag_seconds')
+            )
+        metrics.stats_collector(
+            'smartmeter_live', app.mqtt.hub.snapshot,
+            counters=('published', 'delivered', 'coalesced', 'rejected'),
+            gauges=('clients',)
+        )
+    
+    if metrics.multiprocess_dir():
+        # A scrape reaches one worker: keep every worker's stats in the shared files
+        app.metrics_syncer = metrics.StatsSyncer(app.config['METRICS_SYNC_INTERVAL'])
+        app.metrics_syncer.start()
+    
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app = create_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
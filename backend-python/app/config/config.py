@@ -11,9 +11,28 @@ class Config:
     # Flask
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-prod')
     
+    # Startup: skip collection/index setup and connect in the background (needs `manage.py migrate`)
+    FAST_START = os.getenv('FAST_START', 'false').lower() == 'true'
+    
     # MongoDB
     MONGO_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/smartmeter')
     DB_NAME = os.getenv('MONGODB_DB_NAME', 'smartmeter')
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))  # per process; >= WEB_THREADS + ingest workers
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 4))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))  # fail fast when the pool is exhausted
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000))
+    
+    # Raw readings storage
+    READINGS_TIMESERIES = os.getenv('READINGS_TIMESERIES', 'false').lower() == 'true'
+    READINGS_TIMESERIES_GRANULARITY = os.getenv('READINGS_TIMESERIES_GRANULARITY', 'seconds')
+    READINGS_TTL_DAYS = float(os.getenv('READINGS_TTL_DAYS', 0))  # 0 keeps readings forever
+    
+    # Parquet archive for closed months (empty ARCHIVE_DIR disables it)
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')
+    ARCHIVE_AFTER_MONTHS = int(os.getenv('ARCHIVE_AFTER_MONTHS', 3))
+    ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'zstd')
+    ARCHIVE_DELETE_BATCH = int(os.getenv('ARCHIVE_DELETE_BATCH', 5000))
+    ARCHIVE_DELETE_PAUSE = float(os.getenv('ARCHIVE_DELETE_PAUSE', 0.1))  # seconds between delete batches
     
     # MQTT
     MQTT_HOST = os.getenv('MQTT_HOST', 'localhost')
@@ -22,6 +41,62 @@ class Config:
     MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', '')
     MQTT_CLIENT_ID = os.getenv('MQTT_CLIENT_ID', 'backend-service')
     MQTT_TOPIC_SUB = os.getenv('MQTT_TOPIC_SUBSCRIBE', 'smartmeter/+/telemetry')
+    MQTT_CLIENT_ID_UNIQUE = os.getenv('MQTT_CLIENT_ID_UNIQUE', 'true').lower() == 'true'  # append host/pid
+    MQTT_SHARED_GROUP = os.getenv('MQTT_SHARED_GROUP', '')  # e.g. 'ingest' -> $share/ingest/<topic>
+    MQTT_PROTOCOL = os.getenv('MQTT_PROTOCOL', '3.1.1')  # 3.1.1 or 5
+    
+    # Which web processes ingest MQTT telemetry: all, single (one gunicorn worker), off (use ingest.py)
+    WEB_INGEST = os.getenv('WEB_INGEST', 'all')
+    INGEST_LOCK_FILE = os.getenv('INGEST_LOCK_FILE', '/tmp/smartmeter-ingest.lock')
+    
+    # Ingest buffering
+    INGEST_BUFFER_SIZE = int(os.getenv('INGEST_BUFFER_SIZE', 20000))
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 500))
+    INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 1.0))
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 4))
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 10000))
+    INGEST_QUEUE_POLICY = os.getenv('INGEST_QUEUE_POLICY', 'block')  # block, drop, drop_oldest
+    INGEST_QUEUE_BLOCK_TIMEOUT = float(os.getenv('INGEST_QUEUE_BLOCK_TIMEOUT', 0.5))
+    ASYNC_INGEST_MAX_IN_FLIGHT = int(os.getenv('ASYNC_INGEST_MAX_IN_FLIGHT', 8))  # ingest.py only
+    
+    # Disk spool for readings MongoDB cannot take (empty INGEST_SPOOL_DIR disables it)
+    INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', '')
+    INGEST_SPOOL_SEGMENT_MB = int(os.getenv('INGEST_SPOOL_SEGMENT_MB', 16))
+    INGEST_SPOOL_MAX_MB = int(os.getenv('INGEST_SPOOL_MAX_MB', 1024))
+    INGEST_SPOOL_FSYNC_INTERVAL = float(os.getenv('INGEST_SPOOL_FSYNC_INTERVAL', 1.0))  # seconds between fsyncs
+    INGEST_SPOOL_REPLAY_BATCH = int(os.getenv('INGEST_SPOOL_REPLAY_BATCH', 5000))
+    
+    # Rollups (hourly/daily summaries maintained at ingest)
+    ROLLUPS_ENABLED = os.getenv('ROLLUPS_ENABLED', 'true').lower() == 'true'
+    ROLLUP_READS = os.getenv('ROLLUP_READS', 'false').lower() == 'true'  # enable after backfill
+    ROLLUP_TIMEZONE = os.getenv('ROLLUP_TIMEZONE', 'UTC')
+    
+    # Readings API
+    READINGS_MAX_PAGE_SIZE = int(os.getenv('READINGS_MAX_PAGE_SIZE', 50000))
+    READINGS_MAX_POINTS = int(os.getenv('READINGS_MAX_POINTS', 5000))  # upper bound for ?max_points=
+    READINGS_CLOSED_AFTER = int(os.getenv('READINGS_CLOSED_AFTER', 3600))  # seconds before a range is immutable
+    READINGS_CLOSED_MAX_AGE = int(os.getenv('READINGS_CLOSED_MAX_AGE', 86400))  # browser cache for closed ranges
+    
+    # Response cache (ETag'd bodies for readings, invoices and tariffs)
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+    RESPONSE_CACHE_MAX_MB = int(os.getenv('RESPONSE_CACHE_MAX_MB', 64))
+    
+    # Production serving (gunicorn.conf.py)
+    WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:5000')
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', 0))  # 0 = 2 x CPUs + 1
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+    WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', '')  # empty = gevent with LIVE_ENABLED, else gthread
+    WEB_CONNECTIONS = int(os.getenv('WEB_CONNECTIONS', 1000))  # gevent: concurrent API requests per worker besides SSE
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 60))
+    WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', 5))
+    
+    # Live push (Server-Sent Events)
+    LIVE_ENABLED = os.getenv('LIVE_ENABLED', 'true').lower() == 'true'
+    LIVE_MAX_CLIENTS = int(os.getenv('LIVE_MAX_CLIENTS', 5000))
+    LIVE_RESERVED_THREADS = int(os.getenv('LIVE_RESERVED_THREADS', 4))  # gthread: threads SSE may not take
+    LIVE_STATE_POLL_INTERVAL = float(os.getenv('LIVE_STATE_POLL_INTERVAL', 1.0))  # non-ingesting processes
+    LIVE_MIN_INTERVAL = float(os.getenv('LIVE_MIN_INTERVAL', 1.0))  # seconds between pushes per client
+    LIVE_HEARTBEAT = float(os.getenv('LIVE_HEARTBEAT', 15))
     
     # JWT
     JWT_SECRET = os.getenv('JWT_SECRET', 'jwt-secret-key')
@@ -33,6 +108,9 @@ class Config:
     # Billing
     TIMEZONE = os.getenv('TIMEZONE', 'Asia/Kolkata')
     CURRENCY = os.getenv('DEFAULT_CURRENCY', 'INR')
+    BILLING_WORKERS = int(os.getenv('BILLING_WORKERS', 8))
+    TARIFF_CACHE_TTL = float(os.getenv('TARIFF_CACHE_TTL', 30))  # seconds between version checks
+    BILL_CACHE_SIZE = int(os.getenv('BILL_CACHE_SIZE', 10000))  # closed-month bills kept in memory
     
     # Email
     SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
@@ -41,6 +119,11 @@ class Config:
     SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
     SMTP_FROM = os.getenv('SMTP_FROM', 'noreply@smartmeter.local')
     
+    # Metrics (Prometheus text format on /metrics)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')  # prometheus_client multiprocess mode; empty = per process
+    METRICS_SYNC_INTERVAL = float(os.getenv('METRICS_SYNC_INTERVAL', 5.0))  # seconds between copying ingest/live stats into it
+    
     # Logging
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
@@ -69,3 +152,9 @@ def get_config():
     """Get configuration based on environment"""
     env = os.getenv('FLASK_ENV', 'dev')
     return config_by_name.get(env, DevelopmentConfig)
+
+def get_setting(config, name, default=None):
+    """Read a setting from a Config class or a Flask config mapping"""
+    if isinstance(config, dict):
+        return config.get(name, default)
+    return getattr(config, name, default)
@@ -1,43 +1,147 @@
 """
 Database Models for Smart Energy Meter
 """
+import logging
 from datetime import datetime
 from pymongo import ASCENDING, DESCENDING
 from bson import ObjectId
+from app.config.config import get_setting
+from app.services.metrics import MongoCommandMetrics
+
+logger = logging.getLogger(__name__)
+
+def mongo_client_options(config):
+    """Connection pool settings shared by every MongoClient/Motor client"""
+    options = {
+        'serverSelectionTimeoutMS': 5000,
+        'maxPoolSize': get_setting(config, 'MONGO_MAX_POOL_SIZE', 100),
+        'minPoolSize': get_setting(config, 'MONGO_MIN_POOL_SIZE', 0),
+        'waitQueueTimeoutMS': get_setting(config, 'MONGO_WAIT_QUEUE_TIMEOUT_MS', None),
+        'maxIdleTimeMS': get_setting(config, 'MONGO_MAX_IDLE_TIME_MS', None)
+    }
+    if get_setting(config, 'METRICS_ENABLED', False):
+        options['event_listeners'] = [MongoCommandMetrics()]
+    return options
+
+# Bump when _init_collections changes (new collection or index)
+SCHEMA_VERSION = 3
+
+class SchemaError(RuntimeError):
+    """Existing data blocks a schema change; nothing was modified"""
+
+def find_duplicates(collection, fields, limit=None):
+    """Groups of documents sharing `fields`: [{'_id': {field: value}, 'ids': [...], 'count': n}]"""
+    pipeline = [
+        {'$group': {'_id': {field: f'${field}' for field in fields}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    return list(collection.aggregate(pipeline, allowDiskUse=True))
 
 class Database:
     """MongoDB database wrapper"""
-    def __init__(self, client, db_name):
+    def __init__(self, client, db_name, config=None, init=True):
         self.client = client
         self.db = client[db_name]
+        self.config = config
+        if init:
+            self.migrate(enforce_unique=False)
+    
+    def migrate(self, enforce_unique=True):
+        """
+        Create collections and indexes, then record the schema version.
+        Unique indexes over existing data are only built with enforce_unique
+        (`manage.py migrate`); app startup never scans for duplicates.
+        Raises:
+            SchemaError if enforce_unique and documents already share a key
+        """
+        self.enforce_unique = enforce_unique
         self._init_collections()
+        self.db.migrations.update_one(
+            {'_id': 'schema'},
+            {'$set': {'version': SCHEMA_VERSION, 'applied_at': datetime.utcnow()}},
+            upsert=True
+        )
+        return SCHEMA_VERSION
+    
+    def schema_version(self):
+        """Schema version recorded by the last migrate (0 if never run)"""
+        doc = self.db.migrations.find_one({'_id': 'schema'}, {'version': 1})
+        return doc['version'] if doc else 0
     
     def _init_collections(self):
         """Initialize collections with indexes"""
+        existing = set(self.db.list_collection_names())
+        
         # Meter Readings (Time-Series)
-        if 'meter_readings' not in self.db.list_collection_names():
-            self.db.create_collection('meter_readings')
+        if 'meter_readings' not in existing:
+            create_readings_collection(self.db, self.config)
+        elif get_setting(self.config, 'READINGS_TIMESERIES', False) and not is_timeseries(self.db, 'meter_readings'):
+            logger.warning('meter_readings is a regular collection; run `python manage.py migrate-timeseries`')
+        
+        if is_timeseries(self.db, 'meter_readings'):
+            # Time-series collections cannot enforce unique indexes
+            self.db.meter_readings.create_index([('device_id', ASCENDING), ('timestamp', DESCENDING)])
+        else:
+            # Unique (device_id, timestamp) drops MQTT redeliveries and overlapping
+            # ingest workers' duplicates, keeping storage exactly-once
+            self._ensure_unique_index(
+                self.db.meter_readings, [('device_id', ASCENDING), ('timestamp', DESCENDING)],
+                hint='run `python manage.py dedupe-readings` first', deferrable=True
+            )
+            self.db.meter_readings.create_index([('timestamp', DESCENDING)])
+        apply_readings_ttl(self.db, self.config)
         
-        self.db.meter_readings.create_index([('device_id', ASCENDING), ('timestamp', DESCENDING)])
-        self.db.meter_readings.create_index([('timestamp', DESCENDING)])
+        # Rollups (hourly/daily summaries of meter_readings)
+        for name in ('readings_hourly', 'readings_daily'):
+            if name not in existing:
+                self.db.create_collection(name)
+            self.db[name].create_index([('device_id', ASCENDING), ('bucket', ASCENDING)], unique=True)
         
         # Devices
-        if 'devices' not in self.db.list_collection_names():
+        if 'devices' not in existing:
             self.db.create_collection('devices')
         self.db.devices.create_index([('device_id', ASCENDING)])
+        # Live state followers poll for devices whose `latest` changed
+        self.db.devices.create_index([('state_at', ASCENDING)], sparse=True)
         
         # Users
-        if 'users' not in self.db.list_collection_names():
+        if 'users' not in existing:
             self.db.create_collection('users')
         self.db.users.create_index([('email', ASCENDING)])
         
         # Invoices
-        if 'invoices' not in self.db.list_collection_names():
+        if 'invoices' not in existing:
             self.db.create_collection('invoices')
-        self.db.invoices.create_index([('device_id', ASCENDING), ('month', DESCENDING)])
+        # One invoice per device per month, so billing re-runs never duplicate
+        self._ensure_unique_index(
+            self.db.invoices, [('device_id', ASCENDING), ('month', DESCENDING)],
+            hint='run `python manage.py dedupe-invoices` first', deferrable=True
+        )
+        
+        # Billing run checkpoints
+        if 'billing_checkpoints' not in existing:
+            self.db.create_collection('billing_checkpoints')
+        self.db.billing_checkpoints.create_index([('month', ASCENDING), ('device_id', ASCENDING)], unique=True)
+        
+        # Memoised closed-month bills (one per tariff version) and open-month energy snapshots
+        if 'bill_cache' not in existing:
+            self.db.create_collection('bill_cache')
+        self.db.bill_cache.create_index(
+            [('device_id', ASCENDING), ('month', ASCENDING), ('tariff_key', ASCENDING)], unique=True
+        )
+        if 'bill_snapshots' not in existing:
+            self.db.create_collection('bill_snapshots')
+        
+        # Parquet archive catalog (one entry per archived device-month)
+        if 'archive_catalog' not in existing:
+            self.db.create_collection('archive_catalog')
+        self.db.archive_catalog.create_index([('device_id', ASCENDING), ('month', ASCENDING)], unique=True)
+        self.db.archive_catalog.create_index([('month', ASCENDING)])
         
         # Tariffs
-        if 'tariffs' not in self.db.list_collection_names():
+        if 'tariffs' not in existing:
             self.db.create_collection('tariffs')
             # Insert default tariff
             self.db.tariffs.insert_one({
@@ -50,8 +154,94 @@ class Database:
                 'fixed_charge': 50,
                 'tax_rate': 0.18,
                 'currency': 'INR',
+                'version': 1,
                 'created_at': datetime.utcnow()
             })
+        self.db.tariffs.create_index([('name', ASCENDING)], unique=True)
+
+    def _ensure_unique_index(self, collection, keys, hint='remove the duplicates first', deferrable=False):
+        """
+        Create a unique index, replacing a non-unique one on the same keys.
+        Duplicates are looked for before anything is dropped, so existing
+        indexes stay in place when the unique one cannot be built.
+        A deferrable index on a collection holding data only gets a plain
+        index on the keys without enforce_unique, leaving the duplicate scan
+        to `manage.py migrate`.
+        Raises:
+            SchemaError if documents already share a key
+        """
+        current = {name: info for name, info in collection.index_information().items() if info['key'] == keys}
+        if any(info.get('unique') for info in current.values()):
+            return
+        
+        if deferrable and not self.enforce_unique and collection.find_one({}, {'_id': 1}) is not None:
+            if not current:
+                collection.create_index(keys)
+            logger.warning(f'{collection.name} has no unique index on {[field for field, _ in keys]}; '
+                           f'run `python manage.py migrate`')
+            return
+        
+        fields = [field for field, _ in keys]
+        duplicates = find_duplicates(collection, fields, limit=5)
+        if duplicates:
+            sample = ', '.join(str(d['_id']) for d in duplicates)
+            raise SchemaError(f'{collection.name} has documents sharing {fields} (e.g. {sample}); {hint}')
+        
+        for name in current:
+            collection.drop_index(name)
+        collection.create_index(keys, unique=True)
+
+def readings_ttl_seconds(config):
+    """Raw reading expiry in seconds, or None to keep readings forever"""
+    days = get_setting(config, 'READINGS_TTL_DAYS', 0)
+    return int(days * 86400) if days else None
+
+def is_timeseries(db, name):
+    """True if the collection is a native time-series collection"""
+    info = next(iter(db.list_collections(filter={'name': name})), None)
+    return bool(info and info.get('type') == 'timeseries')
+
+def create_readings_collection(db, config, name='meter_readings', timeseries=None):
+    """Create the raw readings collection, as time-series if configured (or forced)"""
+    if timeseries is None:
+        timeseries = get_setting(config, 'READINGS_TIMESERIES', False)
+    if not timeseries:
+        db.create_collection(name)
+        return
+    
+    options = {
+        'timeseries': {
+            'timeField': 'timestamp',
+            'metaField': 'device_id',
+            # Devices publish every 10 s, so 'seconds' keeps buckets tight
+            'granularity': get_setting(config, 'READINGS_TIMESERIES_GRANULARITY', 'seconds')
+        }
+    }
+    ttl = readings_ttl_seconds(config)
+    if ttl:
+        options['expireAfterSeconds'] = ttl
+    db.create_collection(name, **options)
+    logger.info(f'Created time-series collection {name}')
+
+def apply_readings_ttl(db, config):
+    """Bring the raw readings expiry in line with READINGS_TTL_DAYS"""
+    ttl = readings_ttl_seconds(config)
+    if is_timeseries(db, 'meter_readings'):
+        db.command('collMod', 'meter_readings', expireAfterSeconds=ttl if ttl else 'off')
+    elif ttl:
+        # Regular collection: TTL on the existing timestamp index
+        db.command('collMod', 'meter_readings', index={
+            'keyPattern': {'timestamp': DESCENDING},
+            'expireAfterSeconds': ttl
+        })
+    else:
+        # collMod cannot remove expireAfterSeconds, so rebuild the index without it
+        keys = [('timestamp', DESCENDING)]
+        for name, info in db.meter_readings.index_information().items():
+            if info['key'] == keys and 'expireAfterSeconds' in info:
+                db.meter_readings.drop_index(name)
+                db.meter_readings.create_index(keys)
+                logger.info('Removed the meter_readings TTL')
 
 # Device Schema
 DEVICE_SCHEMA = {
@@ -63,6 +253,7 @@ DEVICE_SCHEMA = {
     'status': str,  # online, offline, error
     'last_seen': datetime,
     'firmware_version': str,
+    'tariff': str,  # tariff name, 'default' if unset
     'created_at': datetime,
     'updated_at': datetime
 }
@@ -81,6 +272,22 @@ METER_READING_SCHEMA = {
     'created_at': datetime
 }
 
+# Reading Rollup Schema (readings_hourly / readings_daily)
+READING_ROLLUP_SCHEMA = {
+    '_id': ObjectId,
+    'device_id': str,
+    'bucket': datetime,  # bucket start (UTC)
+    'samples': int,
+    'energy_kwh_min': float,  # first register value in bucket
+    'energy_kwh_max': float,  # last register value in bucket
+    'ts_min': datetime,
+    'ts_max': datetime,
+    'voltage_sum': float, 'voltage_min': float, 'voltage_max': float,
+    'current_sum': float, 'current_min': float, 'current_max': float,
+    'power_w_sum': float, 'power_w_min': float, 'power_w_max': float,
+    'updated_at': datetime
+}
+
 # Invoice Schema
 INVOICE_SCHEMA = {
     '_id': ObjectId,
@@ -96,10 +303,55 @@ INVOICE_SCHEMA = {
     'pdf_url': str,
     'email_sent': bool,
     'created_at': datetime,
+    'updated_at': datetime,  # set by anything changing status, paid_date or email_sent
     'due_date': datetime,
     'paid_date': datetime
 }
 
+# Billing Checkpoint Schema (one per invoiced device per month)
+BILLING_CHECKPOINT_SCHEMA = {
+    '_id': ObjectId,
+    'month': str,  # YYYY-MM being billed
+    'device_id': str,
+    'invoice_id': str,
+    'updated_at': datetime
+}
+
+# Bill Cache Schema (closed months only)
+BILL_CACHE_SCHEMA = {
+    '_id': ObjectId,
+    'device_id': str,
+    'month': str,  # YYYY-MM
+    'tariff_key': str,  # name:version:updated_at of the tariff used
+    'readings_version': int,  # device's cache_versions stamp the bill was priced at
+    'bill': dict,  # compute_bill() result
+    'updated_at': datetime
+}
+
+# Bill Snapshot Schema (open month energy, _id is '<device_id>:<YYYY-MM>')
+BILL_SNAPSHOT_SCHEMA = {
+    '_id': str,
+    'first_kwh': float,
+    'first_ts': datetime,  # timestamp of the reading first_kwh came from
+    'last_kwh': float,
+    'through': datetime,  # timestamp of the reading last_kwh came from
+    'updated_at': datetime
+}
+
+# Archive Catalog Schema (files under ARCHIVE_DIR)
+ARCHIVE_CATALOG_SCHEMA = {
+    '_id': ObjectId,
+    'device_id': str,
+    'month': str,  # YYYY-MM (UTC)
+    'rows': int,
+    'bytes': int,
+    'first_ts': datetime,
+    'first_kwh': float,
+    'last_ts': datetime,
+    'last_kwh': float,
+    'archived_at': datetime
+}
+
 # User Schema
 USER_SCHEMA = {
     '_id': ObjectId,
@@ -121,6 +373,7 @@ TARIFF_SCHEMA = {
     'fixed_charge': float,
     'tax_rate': float,
     'currency': str,
+    'version': int,  # bumped on every update; invalidates cached tariffs
     'created_at': datetime,
     'updated_at': datetime
 }
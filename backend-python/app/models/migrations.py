@@ -0,0 +1,207 @@
+"""
+Data migrations run from manage.py
+"""
+import logging
+import time
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from app.models.database import create_readings_collection, is_timeseries, find_duplicates, SchemaError
+
+logger = logging.getLogger(__name__)
+
+LEGACY_READINGS = 'meter_readings_legacy'
+TIMESERIES_READINGS = 'meter_readings_timeseries'  # built under this name, then swapped in
+SWAP_ATTEMPTS = 5
+
+def migrate_readings_to_timeseries(db, config, batch_size=10000, pause=0.0, drop_legacy=False):
+    """
+    Move meter_readings into a native time-series collection.
+    The time-series collection is built as meter_readings_timeseries, then
+    swapped in: the regular collection is renamed to meter_readings_legacy
+    and the new one to meter_readings, so live ingest lands in it straight
+    away. Legacy data is then copied over in _id order, with progress saved
+    after every batch. An interrupted run resumes after the last saved
+    batch and only inserts the readings of the batch in flight that are
+    not in meter_readings yet (time-series collections have no unique index).
+    Returns:
+        Number of readings copied by this run
+    """
+    if not is_timeseries(db, 'meter_readings'):
+        _swap_in_timeseries(db, config)
+    sources = _legacy_collections(db)
+    if not sources:
+        logger.info('meter_readings is already a time-series collection')
+        return 0
+
+    state = db.migrations.find_one({'_id': 'readings_timeseries'}) or {}
+    progress = state.get('sources', {})
+    if 'last_id' in state and LEGACY_READINGS not in progress:
+        progress[LEGACY_READINGS] = state['last_id']  # saved before per-collection progress
+
+    copied = 0
+    for source in sources:
+        copied += _copy_readings(db, source, progress.get(source), batch_size, pause)
+
+    state = db.migrations.find_one_and_update(
+        {'_id': 'readings_timeseries'},
+        {'$set': {'completed_at': datetime.utcnow()}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    if drop_legacy:
+        if state.get('failed'):
+            logger.warning(f'{state["failed"]} readings were rejected; keeping {", ".join(sources)}')
+        else:
+            for source in sources:
+                db[source].drop()
+                logger.info(f'Dropped {source}')
+    return copied
+
+def _swap_in_timeseries(db, config):
+    """Rename the time-series collection over meter_readings, setting the regular one aside"""
+    if TIMESERIES_READINGS not in db.list_collection_names():
+        create_readings_collection(db, config, name=TIMESERIES_READINGS, timeseries=True)
+        db[TIMESERIES_READINGS].create_index([('device_id', ASCENDING), ('timestamp', DESCENDING)])
+
+    for _ in range(SWAP_ATTEMPTS):
+        if 'meter_readings' in db.list_collection_names():
+            legacy = _next_legacy_name(db)
+            db.meter_readings.rename(legacy)
+            logger.info(f'Renamed meter_readings to {legacy}')
+        try:
+            db[TIMESERIES_READINGS].rename('meter_readings')
+            logger.info(f'Renamed {TIMESERIES_READINGS} to meter_readings')
+            return
+        except OperationFailure as e:
+            # A live insert between the two renames recreated a regular meter_readings;
+            # the next attempt sets it aside with the other legacy readings
+            logger.warning(f'meter_readings was recreated during the swap ({e}), retrying')
+    raise SchemaError(f'Could not swap in {TIMESERIES_READINGS}; pause ingest and re-run')
+
+def _legacy_collections(db):
+    """meter_readings_legacy, then any meter_readings_legacy_<n> set aside during a swap"""
+    names = set(db.list_collection_names())
+    strays = sorted(
+        (name for name in names if name.startswith(f'{LEGACY_READINGS}_') and name.rsplit('_', 1)[1].isdigit()),
+        key=lambda name: int(name.rsplit('_', 1)[1])
+    )
+    return ([LEGACY_READINGS] if LEGACY_READINGS in names else []) + strays
+
+def _next_legacy_name(db):
+    names = set(db.list_collection_names())
+    if LEGACY_READINGS not in names:
+        return LEGACY_READINGS
+    n = 1
+    while f'{LEGACY_READINGS}_{n}' in names:
+        n += 1
+    return f'{LEGACY_READINGS}_{n}'
+
+def _copy_readings(db, source, last_id, batch_size, pause):
+    """Copy one legacy collection after `last_id`; returns the number of readings inserted"""
+    copied = 0
+    resumed = True  # the first batch may have been partly inserted by an interrupted run
+    while True:
+        query = {'_id': {'$gt': last_id}} if last_id else {}
+        batch = list(db[source].find(query).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+
+        # Time-series collections need a timestamp on every document
+        docs = [doc for doc in batch if isinstance(doc.get('timestamp'), datetime)]
+        if resumed and docs:
+            docs = _not_copied(db, docs)
+        resumed = False
+
+        inserted, rejected = len(docs), 0
+        if docs:
+            try:
+                db.meter_readings.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                write_errors = e.details.get('writeErrors', [])
+                rejected = len(write_errors)
+                inserted = e.details.get('nInserted', len(docs) - rejected)
+                logger.warning(f'{rejected} readings from {source} rejected: {write_errors[0].get("errmsg")}')
+        copied += inserted
+        last_id = batch[-1]['_id']
+
+        db.migrations.update_one(
+            {'_id': 'readings_timeseries'},
+            {
+                '$set': {f'sources.{source}': last_id, 'updated_at': datetime.utcnow()},
+                '$inc': {'copied': inserted, 'failed': rejected}
+            },
+            upsert=True
+        )
+        logger.info(f'Copied {copied} readings from {source} (last _id {last_id})')
+        if pause:
+            time.sleep(pause)
+    return copied
+
+def _not_copied(db, docs):
+    """The documents of a batch not in meter_readings yet (time range bounds the lookup)"""
+    stamps = [doc['timestamp'] for doc in docs]
+    present = {doc['_id'] for doc in db.meter_readings.find(
+        {'timestamp': {'$gte': min(stamps), '$lte': max(stamps)}, '_id': {'$in': [doc['_id'] for doc in docs]}},
+        {'_id': 1}
+    )}
+    if present:
+        logger.info(f'Skipping {len(present)} readings already copied by the interrupted run')
+    return [doc for doc in docs if doc['_id'] not in present]
+
+READING_DUPLICATES = 'meter_readings_duplicates'
+INVOICE_DUPLICATES = 'invoices_duplicates'
+
+def dedupe_readings(db, dry_run=False, batch_size=1000):
+    """
+    Keep one reading per (device_id, timestamp) so the unique index can be
+    built. Duplicates are redeliveries of the same message, so the first
+    stored (lowest _id) is kept; the others are moved to
+    meter_readings_duplicates, not deleted.
+    Returns:
+        Number of readings moved
+    """
+    moved = 0
+    extra = []
+    for group in find_duplicates(db.meter_readings, ['device_id', 'timestamp']):
+        extra.extend(sorted(group['ids'])[1:])
+        if len(extra) >= batch_size:
+            moved += _move_readings(db, extra, dry_run)
+            extra = []
+    return moved + _move_readings(db, extra, dry_run)
+
+def _move_readings(db, ids, dry_run):
+    if not ids:
+        return 0
+    if not dry_run:
+        docs = list(db.meter_readings.find({'_id': {'$in': ids}}))
+        try:
+            db[READING_DUPLICATES].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Moved by an interrupted run that had not deleted them yet
+            if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                raise
+        db.meter_readings.delete_many({'_id': {'$in': ids}})
+    logger.info(f'{"Would move" if dry_run else "Moved"} {len(ids)} duplicate readings')
+    return len(ids)
+
+
+def dedupe_invoices(db, dry_run=False):
+    """
+    Keep one invoice per (device_id, month) so the unique index can be built.
+    The kept invoice is a paid one if any, else the first issued (the one
+    generate_invoice has been returning); the others are moved to
+    invoices_duplicates, not deleted.
+    Returns:
+        Number of invoices moved
+    """
+    moved = 0
+    for group in find_duplicates(db.invoices, ['device_id', 'month']):
+        invoices = list(db.invoices.find({'_id': {'$in': group['ids']}}))
+        invoices.sort(key=lambda inv: (inv.get('status') != 'paid', inv.get('created_at') or datetime.max, inv['_id']))
+        keep, extra = invoices[0], invoices[1:]
+        logger.info(f'{group["_id"]}: keeping invoice {keep["_id"]}, moving {[inv["_id"] for inv in extra]}')
+        if not dry_run:
+            db[INVOICE_DUPLICATES].insert_many(extra)
+            db.invoices.delete_many({'_id': {'$in': [inv['_id'] for inv in extra]}})
+        moved += len(extra)
+    return moved
@@ -1,14 +1,26 @@
 """
 API Routes
 """
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, make_response
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import pytz
 from app.services.billing_service import BillingService
+from app.services.readings_service import (
+    ReadingsService, AGG_UNITS, encode_cursor, decode_cursor,
+    serialize_reading, iter_ndjson, iter_csv, columns_to_readings
+)
+from app.services.tariff_engine import tariff_cache, DEFAULT_TARIFF
+from app.services.columnar import (
+    COLUMNAR_MIMETYPE, ARROW_MIMETYPE, arrow_available, encode_columnar, encode_arrow
+)
+from app.services.response_cache import response_cache, make_etag, cache_version, invoices_key, readings_key
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Invoice fields that change after issue; together they version a download
+INVOICE_VERSION_FIELDS = ['device_id', 'updated_at', 'status', 'paid_date', 'email_sent']
+
 # Helper functions
 def get_db():
     """Get database from Flask app context"""
@@ -18,6 +30,58 @@ def get_billing_service():
     """Get billing service"""
     return BillingService(get_db(), current_app.config)
 
+def get_readings_service():
+    """Get readings service"""
+    return ReadingsService(get_db(), current_app.config)
+
+def get_device_state():
+    """Get the in-memory latest-reading cache (None without MQTT)"""
+    mqtt_service = getattr(current_app, 'mqtt', None)
+    return mqtt_service.state if mqtt_service else None
+
+def negotiate_readings_format():
+    """Pick the readings format from ?format= or the Accept header"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    best = request.accept_mimetypes.best_match(['application/json', COLUMNAR_MIMETYPE, ARROW_MIMETYPE])
+    return {COLUMNAR_MIMETYPE: 'columnar', ARROW_MIMETYPE: 'arrow'}.get(best, 'json')
+
+def conditional_response(key, etag, build, tags=(), max_age=None, last_modified=None):
+    """
+    Answer with 304, a cached body, or a freshly built response - all carrying `etag`
+    Args:
+        key: Response cache key
+        etag: Current ETag of the resource
+        build: Callable returning the full response (only called on a miss)
+        tags: Invalidation tags for the cached body
+        max_age: Cache-Control max-age for immutable resources (revalidate if None)
+    """
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        cached = response_cache.get(key, etag)
+        if cached:
+            resp = Response(cached[0], mimetype=cached[1])
+        else:
+            resp = make_response(build())
+            if resp.status_code != 200:
+                return resp
+            response_cache.put(key, etag, resp.get_data(), resp.mimetype, tags)
+    
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}' if max_age else 'no-cache'
+    return resp.make_conditional(request) if resp.status_code == 200 else resp
+
+def is_closed_range(to_dt):
+    """True if no more readings are expected up to `to_dt`"""
+    if to_dt.tzinfo is not None:
+        to_dt = to_dt.astimezone(pytz.UTC).replace(tzinfo=None)
+    closed_after = timedelta(seconds=current_app.config['READINGS_CLOSED_AFTER'])
+    return to_dt <= datetime.utcnow() - closed_after
+
 # DEVICES endpoints
 @bp.route('/devices', methods=['GET'])
 def list_devices():
@@ -52,6 +116,55 @@ def get_device(device_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/devices/latest', methods=['GET'])
+def get_fleet_latest():
+    """Latest reading of every device, served from memory"""
+    state = get_device_state()
+    if state is None:
+        return jsonify({'error': 'Live state unavailable'}), 503
+    
+    devices = state.snapshot()
+    return jsonify({'devices': devices, 'count': len(devices)}), 200
+
+@bp.route('/devices/<device_id>/latest', methods=['GET'])
+def get_device_latest(device_id):
+    """Latest reading of one device, served from memory"""
+    state = get_device_state()
+    if state is None:
+        return jsonify({'error': 'Live state unavailable'}), 503
+    
+    latest = state.get(device_id)
+    if not latest:
+        return jsonify({'error': 'No readings for device'}), 404
+    
+    return jsonify(latest), 200
+
+@bp.route('/live', methods=['GET'])
+def live_stream():
+    """Server-Sent Events stream of latest readings (?devices=a,b, all devices if omitted)"""
+    if not current_app.config['LIVE_ENABLED']:
+        return jsonify({'error': 'Live push disabled'}), 404
+    mqtt_service = getattr(current_app, 'mqtt', None)
+    if mqtt_service is None:
+        return jsonify({'error': 'Live state unavailable'}), 503
+    
+    device_ids = [d for d in request.args.get('devices', '').split(',') if d]
+    sub = mqtt_service.hub.subscribe(device_ids)
+    if sub is None:
+        return jsonify({'error': 'Too many live clients'}), 503
+    
+    # Current state first, then changes as they arrive
+    if device_ids:
+        initial = [s for s in (mqtt_service.state.get(d) for d in device_ids) if s]
+    else:
+        initial = mqtt_service.state.snapshot()
+    
+    return Response(
+        stream_with_context(sub.events(initial)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @bp.route('/devices', methods=['POST'])
 def create_device():
     """Create new device"""
@@ -63,6 +176,7 @@ def create_device():
             'device_id': data.get('device_id'),
             'name': data.get('name', 'Meter'),
             'location': data.get('location', ''),
+            'tariff': data.get('tariff', DEFAULT_TARIFF),
             'status': 'offline',
             'last_seen': None,
             'firmware_version': '1.0.0',
@@ -82,8 +196,6 @@ def create_device():
 def get_readings(device_id):
     """Get device readings with optional aggregation"""
     try:
-        db = get_db()
-        
         # Query parameters
         from_date = request.args.get('from')
         to_date = request.args.get('to')
@@ -100,29 +212,142 @@ def get_readings(device_id):
         else:
             from_dt = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
         
-        # Query readings
-        query = {
-            'device_id': device_id,
-            'timestamp': {'$gte': from_dt, '$lte': to_dt}
-        }
+        fmt = negotiate_readings_format()  # json, ndjson, csv, columnar, arrow
+        if to_date and fmt not in ('ndjson', 'csv') and is_closed_range(to_dt):
+            # Closed historical range: only late readings (replays, catch-up batches) change it,
+            # and those bump the device's readings version
+            key = ('readings', device_id, fmt, tuple(sorted(request.args.items(multi=True))))
+            version = cache_version(get_db(), readings_key(device_id))
+            resp = conditional_response(
+                key, make_etag(*key, version),
+                lambda: _readings_response(device_id, from_dt, to_dt, agg, fmt),
+                tags=(readings_key(device_id),),
+                max_age=current_app.config['READINGS_CLOSED_MAX_AGE']
+            )
+        else:
+            resp = make_response(_readings_response(device_id, from_dt, to_dt, agg, fmt))
         
-        readings = list(db.meter_readings.find(query).sort('timestamp', 1))
+        # The format may come from Accept, so shared caches must key on it
+        resp.vary.add('Accept')
+        return resp
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _readings_response(device_id, from_dt, to_dt, agg, fmt):
+    """Build the readings response for a parsed request"""
+    if agg != 'raw':
+        if agg not in AGG_UNITS:
+            return jsonify({'error': f'Invalid agg: {agg}'}), 400
         
-        # Convert ObjectId to string and datetime to ISO format
-        for reading in readings:
-            reading['_id'] = str(reading['_id'])
-            if isinstance(reading.get('timestamp'), datetime):
-                reading['timestamp'] = reading['timestamp'].isoformat()
+        buckets = get_readings_service().aggregate(device_id, from_dt, to_dt, agg)
+        return jsonify({
+            'device_id': device_id,
+            'from': from_dt.isoformat(),
+            'to': to_dt.isoformat(),
+            'agg': agg,
+            'count': len(buckets),
+            'readings': buckets
+        }), 200
+    
+    # Raw readings: keyset pagination on (timestamp, _id)
+    readings_svc = get_readings_service()
+    limit = request.args.get('limit', type=int)
+    token = request.args.get('cursor')
+    try:
+        after = decode_cursor(token) if token else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Chart queries: LTTB-downsample the whole range to about max_points readings
+    max_points = request.args.get('max_points', type=int)
+    if max_points is not None:
+        if fmt in ('ndjson', 'csv'):
+            return jsonify({'error': 'max_points is not supported for exports'}), 400
+        if max_points < 3:
+            return jsonify({'error': 'max_points must be at least 3'}), 400
+        max_points = min(max_points, current_app.config['READINGS_MAX_POINTS'])
+    
+    if fmt in ('ndjson', 'csv'):
+        # Stream straight from the cursor so memory stays flat for any range
+        cursor = readings_svc.find_raw(device_id, from_dt, to_dt, after=after, limit=limit)
+        if fmt == 'csv':
+            body, mimetype = iter_csv(cursor), 'text/csv'
+        else:
+            body, mimetype = iter_ndjson(cursor), 'application/x-ndjson'
+        return Response(stream_with_context(body), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename={device_id}-readings.{fmt}'
+        })
+    
+    if fmt in ('columnar', 'arrow'):
+        if fmt == 'arrow' and not arrow_available():
+            return jsonify({'error': 'Arrow format requires pyarrow'}), 406
         
+        next_cursor = None
+        if max_points:
+            columns, total = readings_svc.downsample(device_id, from_dt, to_dt, max_points)
+        elif limit or after:
+            # Keyset page, like JSON; without limit/cursor the whole range is returned
+            max_page = current_app.config['READINGS_MAX_PAGE_SIZE']
+            page_size = min(limit, max_page) if limit and limit > 0 else max_page
+            columns, last = readings_svc.fetch_columns_page(device_id, from_dt, to_dt, after=after, limit=page_size)
+            if last:
+                next_cursor = encode_cursor({'timestamp': last[0], '_id': last[1]})
+            total = None
+        else:
+            columns = readings_svc.fetch_columns(device_id, from_dt, to_dt)
+            total = len(columns['timestamp'])
+        meta = {
+            'device_id': device_id,
+            'from': from_dt.isoformat(),
+            'to': to_dt.isoformat(),
+            'count': len(columns['timestamp']),
+            'total': total,
+            'next': next_cursor
+        }
+        if fmt == 'arrow':
+            return Response(encode_arrow(columns, meta), mimetype=ARROW_MIMETYPE)
+        return Response(encode_columnar(columns, meta), mimetype=COLUMNAR_MIMETYPE)
+    
+    if fmt != 'json':
+        return jsonify({'error': f'Invalid format: {fmt}'}), 400
+    
+    if max_points:
+        columns, total = readings_svc.downsample(device_id, from_dt, to_dt, max_points)
+        readings = columns_to_readings(columns)
         return jsonify({
             'device_id': device_id,
             'from': from_dt.isoformat(),
             'to': to_dt.isoformat(),
+            'agg': 'raw',
             'count': len(readings),
-            'readings': readings
+            'total': total,
+            'max_points': max_points,
+            'readings': readings,
+            'next': None
         }), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    
+    max_page = current_app.config['READINGS_MAX_PAGE_SIZE']
+    page_size = min(limit, max_page) if limit and limit > 0 else max_page
+    
+    # Fetch one extra reading to know whether there is a next page
+    readings = list(readings_svc.find_raw(device_id, from_dt, to_dt, after=after, limit=page_size + 1))
+    next_cursor = None
+    if len(readings) > page_size:
+        readings = readings[:page_size]
+        next_cursor = encode_cursor(readings[-1])
+    
+    for reading in readings:
+        serialize_reading(reading)
+    
+    return jsonify({
+        'device_id': device_id,
+        'from': from_dt.isoformat(),
+        'to': to_dt.isoformat(),
+        'agg': 'raw',
+        'count': len(readings),
+        'readings': readings,
+        'next': next_cursor
+    }), 200
 
 # BILLING endpoints
 @bp.route('/billing/<device_id>', methods=['GET'])
@@ -151,19 +376,25 @@ def get_invoices(device_id):
         db = get_db()
         limit = request.args.get('limit', 12, type=int)
         
-        invoices = list(db.invoices.find(
-            {'device_id': device_id}
-        ).sort('month', -1).limit(limit))
+        def build():
+            invoices = list(db.invoices.find(
+                {'device_id': device_id}
+            ).sort('month', -1).limit(limit))
+            
+            # Convert ObjectId to string
+            for inv in invoices:
+                inv['_id'] = str(inv['_id'])
+                if isinstance(inv.get('created_at'), datetime):
+                    inv['created_at'] = inv['created_at'].isoformat()
+                if isinstance(inv.get('due_date'), datetime):
+                    inv['due_date'] = inv['due_date'].isoformat()
+            
+            return jsonify({'invoices': invoices}), 200
         
-        # Convert ObjectId to string
-        for inv in invoices:
-            inv['_id'] = str(inv['_id'])
-            if isinstance(inv.get('created_at'), datetime):
-                inv['created_at'] = inv['created_at'].isoformat()
-            if isinstance(inv.get('due_date'), datetime):
-                inv['due_date'] = inv['due_date'].isoformat()
-        
-        return jsonify({'invoices': invoices}), 200
+        # generate_invoice bumps the version, so one _id lookup validates the list
+        version = cache_version(db, invoices_key(device_id))
+        key = ('invoices', device_id, limit)
+        return conditional_response(key, make_etag(*key, version), build, tags=(invoices_key(device_id),))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -174,13 +405,23 @@ def download_invoice(invoice_id):
         db = get_db()
         from bson import ObjectId
         
-        invoice = db.invoices.find_one({'_id': ObjectId(invoice_id)})
-        if not invoice:
+        # Status, payment and email delivery change after issue: validate on the mutable fields
+        stamp = db.invoices.find_one({'_id': ObjectId(invoice_id)}, INVOICE_VERSION_FIELDS)
+        if not stamp:
             return jsonify({'error': 'Invoice not found'}), 404
         
-        # Return JSON representation for now (PDF generation in frontend)
-        invoice['_id'] = str(invoice['_id'])
-        return jsonify(invoice), 200
+        def build():
+            invoice = db.invoices.find_one({'_id': ObjectId(invoice_id)})
+            if not invoice:
+                return jsonify({'error': 'Invoice not found'}), 404
+            
+            # Return JSON representation for now (PDF generation in frontend)
+            invoice['_id'] = str(invoice['_id'])
+            return jsonify(invoice), 200
+        
+        key = ('invoice', invoice_id)
+        etag = make_etag(*key, *(stamp.get(field) for field in INVOICE_VERSION_FIELDS))
+        return conditional_response(key, etag, build, tags=(invoices_key(stamp['device_id']),))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -189,13 +430,19 @@ def download_invoice(invoice_id):
 def get_tariffs():
     """Get tariff configuration"""
     try:
-        db = get_db()
-        tariff = db.tariffs.find_one({'name': 'default'}, {'_id': 0})
+        name = request.args.get('name', DEFAULT_TARIFF)
+        tariff = tariff_cache.get_document(get_db(), name)
         
         if not tariff:
             return jsonify({'error': 'Tariff not found'}), 404
         
-        return jsonify(tariff), 200
+        version = tariff.get('version', 0)
+        modified = tariff.get('updated_at') or tariff.get('created_at')
+        key = ('tariffs', name)
+        return conditional_response(
+            key, make_etag(*key, version, modified), lambda: (jsonify(tariff), 200),
+            tags=('tariffs',), last_modified=modified
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -205,6 +452,7 @@ def update_tariffs():
     try:
         data = request.get_json()
         db = get_db()
+        name = data.get('name', DEFAULT_TARIFF)
         
         updated_tariff = {
             'slabs': data.get('slabs', []),
@@ -214,11 +462,14 @@ def update_tariffs():
             'updated_at': datetime.utcnow()
         }
         
+        # Version stamp lets other processes notice the change
         db.tariffs.update_one(
-            {'name': 'default'},
-            {'$set': updated_tariff},
+            {'name': name},
+            {'$set': updated_tariff, '$inc': {'version': 1}},
             upsert=True
         )
+        tariff_cache.invalidate(db, name)
+        response_cache.invalidate('tariffs')
         
         return jsonify({'message': 'Tariff updated', 'tariff': updated_tariff}), 200
     except Exception as e:
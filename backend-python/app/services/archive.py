@@ -0,0 +1,319 @@
+"""
+Readings Archive - Parquet cold storage for closed months of meter_readings
+"""
+import os
+import time
+import logging
+from datetime import datetime, timezone
+from urllib.parse import quote
+from bson import ObjectId
+from app.config.config import get_setting
+from app.services.response_cache import bump_cache_version, readings_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, archive disabled without it
+    pa = pc = pq = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ('voltage', 'current', 'power_w', 'energy_kwh', 'power_factor', 'rssi')
+
+def month_key(dt):
+    """'YYYY-MM' of a datetime"""
+    return dt.strftime('%Y-%m')
+
+def month_bounds(month):
+    """Naive UTC [start, end) of a 'YYYY-MM' month"""
+    year, mon = map(int, month.split('-'))
+    start = datetime(year, mon, 1)
+    end = datetime(year + 1, 1, 1) if mon == 12 else datetime(year, mon + 1, 1)
+    return start, end
+
+def _naive_utc(dt):
+    # meter_readings stores naive UTC; request datetimes may be aware
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _schema():
+    return pa.schema([
+        ('_id', pa.string()),
+        ('timestamp', pa.timestamp('ms')),
+        ('voltage', pa.float64()),
+        ('current', pa.float64()),
+        ('power_w', pa.float64()),
+        ('energy_kwh', pa.float64()),
+        ('power_factor', pa.float64()),
+        ('rssi', pa.int32()),
+    ])
+
+class ReadingsArchive:
+    """
+    Closed months of raw readings as one Parquet file per device and month
+    (ARCHIVE_DIR/device_id=<id>/month=YYYY-MM.parquet, zstd, columnar).
+    The archive_catalog collection lists archived months with their first
+    and last energy registers, so callers find the files for a device and
+    range with one indexed query and billing never opens a file.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.root = get_setting(config, 'ARCHIVE_DIR', '')
+        self.compression = get_setting(config, 'ARCHIVE_COMPRESSION', 'zstd')
+
+    @property
+    def enabled(self):
+        return bool(self.root) and pq is not None
+
+    def path(self, device_id, month):
+        return os.path.join(self.root, f'device_id={quote(device_id, safe="")}', f'month={month}.parquet')
+
+    # Reads
+
+    def months(self, device_id, from_dt, to_dt):
+        """Catalog entries for a device's archived months overlapping [from_dt, to_dt]"""
+        if not self.enabled:
+            return []
+        return list(self.db.archive_catalog.find({
+            'device_id': device_id,
+            'month': {'$gte': month_key(_naive_utc(from_dt)), '$lte': month_key(_naive_utc(to_dt))}
+        }).sort('month', 1))
+
+    def read_table(self, device_id, from_dt, to_dt, columns=None, entries=None, after=None):
+        """
+        Archived readings in [from_dt, to_dt] as one table sorted by (timestamp, _id)
+        Args:
+            after: (timestamp, ObjectId) keyset position; only later rows are read
+        """
+        if entries is None:
+            entries = self.months(device_id, from_dt, to_dt)
+        if not entries:
+            return None
+
+        # Month files are pruned by the catalog, rows by Parquet row-group statistics
+        filters = [('timestamp', '>=', _naive_utc(from_dt)), ('timestamp', '<=', _naive_utc(to_dt))]
+        if after:
+            # Keyset as (ts > t) OR (ts == t AND _id > id); ObjectId hex sorts like the ObjectId
+            ts, oid = _naive_utc(after[0]), str(after[1])
+            filters = [filters + [('timestamp', '>', ts)], filters + [('timestamp', '=', ts), ('_id', '>', oid)]]
+        tables = []
+        for entry in entries:
+            path = self.path(device_id, entry['month'])
+            if not os.path.exists(path):
+                logger.error(f'Archive file missing: {path}')
+                continue
+            tables.append(pq.read_table(path, columns=columns, filters=filters))
+        if not tables:
+            return None
+
+        table = pa.concat_tables(tables)
+        sort_keys = [('timestamp', 'ascending')] + ([('_id', 'ascending')] if '_id' in table.column_names else [])
+        return table.sort_by(sort_keys)
+
+    def iter_readings(self, device_id, from_dt, to_dt, after=None, entries=None, chunk_size=1000):
+        """Yield archived readings as dicts shaped like meter_readings documents"""
+        if entries is None:
+            entries = self.months(device_id, from_dt, to_dt)
+        for entry in entries:
+            # One month at a time keeps memory bounded for long ranges; rows before the
+            # keyset position are never read, and rows become dicts only as a page consumes them
+            table = self.read_table(device_id, from_dt, to_dt, entries=[entry], after=after)
+            if table is None:
+                continue
+            for batch in table.to_batches(max_chunksize=chunk_size):
+                for row in batch.to_pylist():
+                    row['_id'] = ObjectId(row['_id'])
+                    reading = {k: v for k, v in row.items() if v is not None}
+                    reading['device_id'] = device_id
+                    yield reading
+
+    def columns(self, device_id, from_dt, to_dt, fields, entries=None, with_ids=False, after=None, limit=None):
+        """
+        Archived columns as NumPy arrays
+        Args:
+            after, limit: Keyset position and row limit, as for read_table()
+        Returns:
+            {'timestamp': int64 epoch ms, <field>: float64 (NaN for missing)} or None,
+            plus '_id' (ObjectId hex strings) with `with_ids`
+        """
+        names = ['timestamp', *fields] + (['_id'] if with_ids else [])
+        table = self.read_table(device_id, from_dt, to_dt, columns=names, entries=entries, after=after)
+        if table is None or table.num_rows == 0:
+            return None
+        if limit:
+            table = table.slice(0, limit)
+        columns = {'timestamp': table['timestamp'].cast(pa.int64()).to_numpy()}
+        if with_ids:
+            columns['_id'] = table['_id'].to_numpy(zero_copy_only=False)
+        for field in fields:
+            columns[field] = table[field].cast(pa.float64()).fill_null(float('nan')).to_numpy()
+        return columns
+
+    def aggregate(self, device_id, from_dt, to_dt, unit, tz_name='UTC', entries=None):
+        """
+        Bucket archived readings like ReadingsService.aggregate's pipeline
+        Returns:
+            Raw buckets (_id = naive UTC bucket start) with ts_first/ts_last
+        """
+        table = self.read_table(
+            device_id, from_dt, to_dt,
+            columns=['timestamp', 'voltage', 'current', 'power_w', 'energy_kwh'],
+            entries=entries
+        )
+        if table is None or table.num_rows == 0:
+            return []
+
+        # Truncate in the chart timezone, like $dateTrunc with 'timezone'
+        local = table['timestamp'].cast(pa.timestamp('ms', tz='UTC')).cast(pa.timestamp('ms', tz=tz_name))
+        bucket = pc.floor_temporal(local, unit=unit, week_starts_monday=True)
+        table = table.append_column('bucket', bucket)
+
+        # Rows are sorted by timestamp and grouped single-threaded, so first/last follow time
+        grouped = table.group_by('bucket', use_threads=False).aggregate([
+            ('timestamp', 'count'),
+            ('timestamp', 'first'),
+            ('timestamp', 'last'),
+            ('power_w', 'mean'), ('power_w', 'min'), ('power_w', 'max'),
+            ('voltage', 'mean'), ('voltage', 'min'), ('voltage', 'max'),
+            ('current', 'mean'), ('current', 'max'),
+            ('energy_kwh', 'first'), ('energy_kwh', 'last'),
+        ]).sort_by('bucket')
+
+        buckets = []
+        starts = grouped['bucket'].cast(pa.timestamp('ms', tz='UTC')).to_pylist()
+        for start, row in zip(starts, grouped.to_pylist()):
+            buckets.append({
+                '_id': start.replace(tzinfo=None),
+                'samples': row['timestamp_count'],
+                'ts_first': row['timestamp_first'],
+                'ts_last': row['timestamp_last'],
+                'power_w': row['power_w_mean'],
+                'power_w_min': row['power_w_min'],
+                'power_w_max': row['power_w_max'],
+                'voltage': row['voltage_mean'],
+                'voltage_min': row['voltage_min'],
+                'voltage_max': row['voltage_max'],
+                'current': row['current_mean'],
+                'current_max': row['current_max'],
+                'energy_first': row['energy_kwh_first'],
+                'energy_last': row['energy_kwh_last'],
+            })
+        return buckets
+
+    def month_energy(self, device_id, month):
+        """(first_ts, first_kwh, last_ts, last_kwh) of an archived month, or None"""
+        if not self.enabled:
+            return None
+        entry = self.db.archive_catalog.find_one({'device_id': device_id, 'month': month})
+        if not entry or entry.get('rows', 0) == 0:
+            return None
+        return entry['first_ts'], entry['first_kwh'], entry['last_ts'], entry['last_kwh']
+
+    def fleet_month_energy(self, month, device_ids=None):
+        """{device_id: (first_ts, first_kwh, last_ts, last_kwh)} for an archived month"""
+        if not self.enabled:
+            return {}
+        query = {'month': month, 'rows': {'$gt': 0}}
+        if device_ids is not None:
+            query['device_id'] = {'$in': list(device_ids)}
+        return {
+            entry['device_id']: (entry['first_ts'], entry['first_kwh'], entry['last_ts'], entry['last_kwh'])
+            for entry in self.db.archive_catalog.find(query)
+        }
+
+    # Archival
+
+    def archive(self, older_than_months=3, device_id=None, batch_size=5000, pause=0.1):
+        """
+        Move closed months older than `older_than_months` to Parquet
+        Returns:
+            Number of readings archived
+        """
+        if not self.enabled:
+            raise RuntimeError('Archive needs ARCHIVE_DIR and pyarrow')
+
+        now = datetime.utcnow()
+        months_back = now.year * 12 + now.month - 1 - max(older_than_months, 1)
+        cutoff = datetime(months_back // 12, months_back % 12 + 1, 1)
+
+        device_ids = [device_id] if device_id else self.db.meter_readings.distinct('device_id')
+        total = 0
+        for dev in device_ids:
+            oldest = self.db.meter_readings.find_one(
+                {'device_id': dev, 'timestamp': {'$lt': cutoff}},
+                {'_id': 0, 'timestamp': 1},
+                sort=[('timestamp', 1)]
+            )
+            if not oldest:
+                continue
+            month = month_key(oldest['timestamp'])
+            while month_bounds(month)[0] < cutoff:
+                total += self.archive_month(dev, month, batch_size=batch_size, pause=pause)
+                month = month_key(month_bounds(month)[1])
+        logger.info(f'Archive run complete: {total} readings moved to {self.root}')
+        return total
+
+    def archive_month(self, device_id, month, batch_size=5000, pause=0.1):
+        """
+        Write one device-month to Parquet, then delete it from MongoDB in batches.
+        Safe to re-run: rows already in the file are skipped, and readings that
+        arrived late for the month are merged into it.
+        """
+        start, end = month_bounds(month)
+        docs = list(self.db.meter_readings.find(
+            {'device_id': device_id, 'timestamp': {'$gte': start, '$lt': end}},
+            {'_id': 1, 'timestamp': 1, **{field: 1 for field in ARCHIVE_FIELDS}}
+        ).sort([('timestamp', 1), ('_id', 1)]))
+        if not docs:
+            return 0
+
+        schema = _schema()
+        new = pa.Table.from_pydict({
+            '_id': [str(doc['_id']) for doc in docs],
+            'timestamp': [doc['timestamp'] for doc in docs],
+            **{field: [doc.get(field) for doc in docs] for field in ARCHIVE_FIELDS}
+        }, schema=schema)
+
+        path = self.path(device_id, month)
+        if os.path.exists(path):
+            existing = pq.read_table(path).cast(schema)
+            new = new.filter(pc.invert(pc.is_in(new['_id'], value_set=existing['_id'])))
+            table = pa.concat_tables([existing, new])
+        else:
+            table = new
+        table = table.sort_by([('timestamp', 'ascending'), ('_id', 'ascending')])
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path, compression=self.compression, row_group_size=50000)
+        os.replace(tmp_path, path)
+
+        # Catalog before deleting, so readers never miss a row
+        first, last = table.slice(0, 1).to_pylist()[0], table.slice(table.num_rows - 1, 1).to_pylist()[0]
+        self.db.archive_catalog.update_one(
+            {'device_id': device_id, 'month': month},
+            {'$set': {
+                'rows': table.num_rows,
+                'bytes': os.path.getsize(path),
+                'first_ts': first['timestamp'],
+                'first_kwh': first['energy_kwh'],
+                'last_ts': last['timestamp'],
+                'last_kwh': last['energy_kwh'],
+                'archived_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+
+        ids = [doc['_id'] for doc in docs]
+        for i in range(0, len(ids), batch_size):
+            self.db.meter_readings.delete_many({'_id': {'$in': ids[i:i + batch_size]}})
+            if pause:
+                time.sleep(pause)
+        # Ranges cached while the month was in both stores revalidate
+        bump_cache_version(self.db, readings_key(device_id))
+
+        logger.info(f'Archived {len(docs)} readings for {device_id} {month} ({table.num_rows} in file)')
+        return len(docs)
@@ -0,0 +1,286 @@
+"""
+Async Ingest Service - standalone asyncio MQTT ingestion with Motor
+"""
+import asyncio
+import logging
+import signal
+from datetime import datetime
+import paho.mqtt.client as mqtt
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.services.mqtt_service import create_client, subscription_topic
+from app.services.telemetry_decoder import decode_readings, DecodeError
+from app.services.rollup_service import RollupService
+from app.services.ingest_buffer import DUPLICATE_KEY
+from app.services.ingest_spool import IngestSpool, SpoolReplayer
+from app.services.device_state import latest_state_updates
+from app.services.response_cache import version_bump, late_readings_keys
+from app.models.database import mongo_client_options
+
+logger = logging.getLogger(__name__)
+
+class _AsyncioMQTT:
+    """Drives a paho client from the asyncio event loop instead of a thread"""
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.sock = None
+        self.paused = False
+        self._misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.sock = sock
+        if not self.paused:
+            self.loop.add_reader(sock, client.loop_read)
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self.sock = None
+        if self._misc:
+            self._misc.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def pause_reading(self):
+        """Stop reading from the broker (TCP backpressure)"""
+        if not self.paused and self.sock:
+            self.loop.remove_reader(self.sock)
+        self.paused = True
+
+    def resume_reading(self):
+        if self.paused and self.sock:
+            self.loop.add_reader(self.sock, self.client.loop_read)
+        self.paused = False
+
+    async def _misc_loop(self):
+        # Keepalive pings and retries
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+class AsyncIngestService:
+    """Subscribes to telemetry and writes batches with many writes in flight"""
+
+    def __init__(self, config):
+        self.config = config
+        self.batch_size = config.INGEST_BATCH_SIZE
+        self.flush_interval = config.INGEST_FLUSH_INTERVAL
+        self.max_queue = config.INGEST_QUEUE_SIZE
+        self.max_in_flight = config.ASYNC_INGEST_MAX_IN_FLIGHT
+
+        self.mongo = AsyncIOMotorClient(config.MONGO_URI, **mongo_client_options(config))
+        self.db = self.mongo[config.DB_NAME]
+        self.rollups = RollupService(self.db, config) if config.ROLLUPS_ENABLED else None
+        self.spool = IngestSpool.open(config)
+        self.replayer = None
+
+        self.queue = None
+        self.client = None
+        self.mqtt = None
+        self.connected = False
+        self._stopping = None
+        self._in_flight = set()
+        self._slots = None
+
+        self.stats = {
+            'received': 0,
+            'persisted': 0,
+            'invalid': 0,
+            'duplicates': 0,
+            'write_errors': 0,
+            'batches': 0,
+            'paused': 0
+        }
+
+    async def run(self):
+        """Run until SIGINT/SIGTERM, then drain and exit"""
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        self.client = create_client(self.config, role='ingest')
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        if self.config.MQTT_USERNAME:
+            self.client.username_pw_set(self.config.MQTT_USERNAME, self.config.MQTT_PASSWORD)
+        self.mqtt = _AsyncioMQTT(loop, self.client)
+
+        self.client.connect(self.config.MQTT_HOST, self.config.MQTT_PORT, keepalive=60)
+        logger.info(f'Async ingest connecting to {self.config.MQTT_HOST}:{self.config.MQTT_PORT}')
+
+        if self.spool:
+            # Replay runs in a thread and hands each batch to the event loop
+            self.replayer = SpoolReplayer(
+                self.spool,
+                lambda readings: asyncio.run_coroutine_threadsafe(self._persist(readings), loop).result(),
+                batch_size=self.config.INGEST_SPOOL_REPLAY_BATCH
+            )
+            self.replayer.start()
+
+        batcher = loop.create_task(self._batcher())
+        reconnect = loop.create_task(self._reconnect_loop())
+        await self._stopping.wait()
+
+        logger.info('Async ingest stopping, draining queue')
+        reconnect.cancel()
+        self.client.disconnect()
+        await batcher
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self.replayer:
+            # Off the loop: the replay thread may be waiting on a write scheduled on it
+            await loop.run_in_executor(None, self.replayer.stop)
+            self.spool.close()
+        self.mongo.close()
+        logger.info(f'Async ingest stopped: {self.stats}')
+
+    def stop(self):
+        if self._stopping:
+            self._stopping.set()
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            self.connected = True
+            topic = subscription_topic(self.config)
+            client.subscribe(topic, qos=1)
+            logger.info(f'Subscribed to {topic}')
+        else:
+            logger.error(f'MQTT connection failed with code {rc}')
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+        if rc != 0:
+            logger.warning(f'Unexpected MQTT disconnection with code {rc}')
+
+    def on_message(self, client, userdata, msg):
+        """Runs on the event loop; only enqueues"""
+        self.stats['received'] += 1
+        self.queue.put_nowait((msg.topic, msg.payload))
+        if self.queue.qsize() >= self.max_queue and not self.mqtt.paused:
+            self.stats['paused'] += 1
+            self.mqtt.pause_reading()
+
+    async def _reconnect_loop(self):
+        delay = 1
+        while True:
+            await asyncio.sleep(delay)
+            if self.connected or self.mqtt.sock is not None:
+                delay = 1
+                continue
+            try:
+                self.client.reconnect()
+                delay = 1
+            except Exception as e:
+                logger.warning(f'MQTT reconnect failed: {e}')
+                delay = min(delay * 2, 30)
+
+    async def _batcher(self):
+        """Cut batches by size or time and hand them to writer tasks"""
+        loop = asyncio.get_running_loop()
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = []
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            if self.mqtt.paused and self.queue.qsize() < self.max_queue // 2:
+                self.mqtt.resume_reading()
+            if not batch:
+                continue
+
+            # Bounded concurrency: wait for a free slot before starting another write
+            await self._slots.acquire()
+            task = loop.create_task(self._write(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._write_done)
+
+    def _write_done(self, task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def _write(self, raw_batch):
+        readings = []
+        for topic, raw in raw_batch:
+            try:
+                readings.extend(decode_readings(topic, raw))
+            except DecodeError:
+                self.stats['invalid'] += 1
+        if not readings:
+            return
+
+        if self.spool and self.spool.pending and self.spool.append(readings):
+            # Nothing may overtake readings already spooled
+            return
+        try:
+            await self._persist(readings)
+        except Exception as e:
+            logger.error(f'Error writing {len(readings)} readings: {e}')
+            if self.spool and self.spool.append(readings):
+                return
+            self.stats['write_errors'] += len(readings)
+
+    async def _persist(self, readings):
+        """insert_many plus device/rollup updates; raises while MongoDB is unavailable"""
+        written = readings
+        try:
+            await self.db.meter_readings.insert_many(readings, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            failed = {err['index'] for err in write_errors}
+            written = [r for i, r in enumerate(readings) if i not in failed]
+            duplicates = sum(1 for err in write_errors if err.get('code') == DUPLICATE_KEY)
+            self.stats['duplicates'] += duplicates
+            self.stats['write_errors'] += len(write_errors) - duplicates
+
+        last_seen = {}
+        now = datetime.utcnow()
+        for r in written:
+            last_seen[r['device_id']] = now
+        try:
+            await self.db.devices.bulk_write([
+                UpdateOne({'device_id': d}, {'$set': {'last_seen': seen, 'status': 'online'}}, upsert=True)
+                for d, seen in last_seen.items()
+            ] + latest_state_updates(written, now), ordered=True)
+            if self.rollups and written:
+                for collection, ops in self.rollups.build_updates(written).items():
+                    if ops:
+                        await self.db[collection].bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.error(f'Error updating devices/rollups: {e}')
+
+        # Late readings: API processes revalidate closed ranges and bills on the next request
+        late = sorted(late_readings_keys(written, self.config.READINGS_CLOSED_AFTER, now))
+        if late:
+            try:
+                await self.db.cache_versions.bulk_write([version_bump(key) for key in late], ordered=False)
+            except Exception as e:
+                logger.error(f'Error bumping readings versions: {e}')
+
+        self.stats['persisted'] += len(written)
+        self.stats['batches'] += 1
@@ -0,0 +1,73 @@
+"""
+Bill Cache - memoised closed-month bills and current-month energy snapshots
+"""
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+def tariff_key(tariff):
+    """'<name>:<version>:<updated_at>' for a CompiledTariff"""
+    version, stamp = tariff.version
+    return f'{tariff.name}:{version}:{stamp.isoformat() if isinstance(stamp, datetime) else ""}'
+
+class BillCache:
+    """
+    Closed-month bills keyed by (device_id, month, tariff version).
+    Backed by the bill_cache collection so every process and the billing
+    job share results; an LRU in front saves the round trip for hot bills.
+    Each bill also records the device's readings version it was priced at:
+    a tariff change gives a new key and a late reading (spool replay,
+    batched catch-up, archiving) a new version, so stale bills are simply
+    never read.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lru = OrderedDict()  # (db name, device_id, month, tariff key, readings version) -> bill
+        self._lock = Lock()
+
+    def get(self, db, device_id, month, tariff, readings_version=0):
+        key = (db.name, device_id, month, tariff_key(tariff), readings_version)
+        with self._lock:
+            bill = self._lru.get(key)
+            if bill is not None:
+                self._lru.move_to_end(key)
+                return dict(bill)
+
+        doc = db.bill_cache.find_one(
+            {'device_id': device_id, 'month': month, 'tariff_key': key[3], 'readings_version': readings_version},
+            {'_id': 0, 'bill': 1}
+        )
+        if not doc:
+            return None
+        self._remember(key, doc['bill'])
+        return dict(doc['bill'])
+
+    def put(self, db, bill, tariff, readings_version=0):
+        key = (db.name, bill['device_id'], bill['month'], tariff_key(tariff), readings_version)
+        try:
+            # Replaces a bill priced at an older readings version
+            db.bill_cache.update_one(
+                {'device_id': key[1], 'month': key[2], 'tariff_key': key[3]},
+                {'$set': {'bill': bill, 'readings_version': readings_version, 'updated_at': datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f'Error caching bill for {key[1]} {key[2]}: {e}')
+        self._remember(key, bill)
+
+    def _remember(self, key, bill):
+        with self._lock:
+            self._lru[key] = dict(bill)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+bill_cache = BillCache()
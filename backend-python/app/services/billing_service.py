@@ -5,19 +5,195 @@ import logging
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import pytz
+import numpy as np
+from app.services.rollup_service import RollupService
+from app.services.tariff_engine import tariff_cache, DEFAULT_TARIFF
+from app.services.response_cache import bump_cache_version, cache_version, invoices_key, readings_key
+from app.services.bill_cache import bill_cache
+from app.services.archive import ReadingsArchive, month_key
+from app.config.config import get_setting
 
 logger = logging.getLogger(__name__)
 
+def month_range(year_month):
+    """UTC [start, end) datetimes for a 'YYYY-MM' month"""
+    year, month = year_month.split('-')
+    year, month = int(year), int(month)
+    
+    start_date = datetime(year, month, 1, tzinfo=pytz.UTC)
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1, tzinfo=pytz.UTC)
+    else:
+        end_date = datetime(year, month + 1, 1, tzinfo=pytz.UTC)
+    return start_date, end_date
+
+def _combine_edges(archived, live):
+    """
+    First/last energy register across the archive and Mongo
+    Args:
+        archived: (first_ts, first_kwh, last_ts, last_kwh) from the catalog
+        live: (first, last) reading docs with timestamp/energy_kwh, or Nones
+    """
+    first_ts, first_kwh, last_ts, last_kwh = archived
+    first, last = live
+    if first and first['timestamp'] < first_ts:
+        first_kwh = first.get('energy_kwh', 0)
+    if last and last['timestamp'] > last_ts:
+        last_kwh = last.get('energy_kwh', 0)
+    return first_kwh or 0, last_kwh or 0
+
 class BillingService:
     """Handles billing calculations and invoice generation"""
     
     def __init__(self, db, config):
         self.db = db
         self.config = config
+        self.rollups = RollupService(db, config)
+        self.archive = ReadingsArchive(db, config)
+    
+    def _month_energy(self, device_id, start_date, end_date):
+        """First and last energy register of the month, or None without readings"""
+        # Daily rollups line up with billing months only when bucketed in UTC
+        if self.rollups.reads_enabled() and self.rollups.tz_name == 'UTC':
+            return self.rollups.energy_between(device_id, start_date, end_date)
+        
+        query = {
+            'device_id': device_id,
+            'timestamp': {'$gte': start_date, '$lt': end_date}
+        }
+        projection = {'_id': 0, 'energy_kwh': 1, 'timestamp': 1}
+        first = self.db.meter_readings.find_one(query, projection, sort=[('timestamp', 1)])
+        last = self.db.meter_readings.find_one(query, projection, sort=[('timestamp', -1)]) if first else None
+        
+        # Archived months keep their first/last registers in the catalog
+        archived = self.archive.month_energy(device_id, month_key(start_date))
+        if archived:
+            return _combine_edges(archived, (first, last))
+        if not first:
+            return None
+        return first.get('energy_kwh', 0), last.get('energy_kwh', 0)
+    
+    def _fleet_energy(self, start_date, end_date, device_ids=None):
+        """
+        First and last energy register per device for the month
+        Returns:
+            {device_id: (first_kwh, last_kwh)}
+        """
+        if self.rollups.reads_enabled() and self.rollups.tz_name == 'UTC':
+            return self.rollups.energy_by_device(start_date, end_date, device_ids)
+        
+        match = {'timestamp': {'$gte': start_date, '$lt': end_date}}
+        if device_ids is not None:
+            match['device_id'] = {'$in': list(device_ids)}
+        
+        # $sort + $group with only $first walks the (device_id, timestamp) index
+        # once per device (DISTINCT_SCAN) instead of reading every reading
+        def edge(direction):
+            return {
+                doc['_id']: doc
+                for doc in self.db.meter_readings.aggregate([
+                    {'$match': match},
+                    {'$sort': {'device_id': direction, 'timestamp': -direction}},
+                    {'$group': {
+                        '_id': '$device_id',
+                        'energy_kwh': {'$first': '$energy_kwh'},
+                        'timestamp': {'$first': '$timestamp'}
+                    }}
+                ], allowDiskUse=True)
+            }
+        
+        last = edge(1)
+        first = edge(-1)
+        energy = {
+            device_id: ((first.get(device_id) or {}).get('energy_kwh') or 0, doc.get('energy_kwh') or 0)
+            for device_id, doc in last.items()
+        }
+        
+        archived = self.archive.fleet_month_energy(month_key(start_date), device_ids)
+        for device_id, edges in archived.items():
+            energy[device_id] = _combine_edges(edges, (first.get(device_id), last.get(device_id)))
+        return energy
+    
+    def _get_tariff(self, name=DEFAULT_TARIFF):
+        """Load a compiled tariff (cached in-process)"""
+        tariff = tariff_cache.get(self.db, name)
+        if not tariff:
+            logger.error(f'Tariff not found: {name}')
+        return tariff
+    
+    def _device_tariffs(self, device_ids):
+        """Tariff name per device ('default' unless the device names one)"""
+        names = {device_id: DEFAULT_TARIFF for device_id in device_ids}
+        for device in self.db.devices.find(
+            {'device_id': {'$in': list(device_ids)}, 'tariff': {'$exists': True}},
+            {'_id': 0, 'device_id': 1, 'tariff': 1}
+        ):
+            names[device['device_id']] = device['tariff'] or DEFAULT_TARIFF
+        return names
+    
+    def _is_closed(self, end_date):
+        """True once a month has ended and late readings are no longer expected"""
+        closed_after = timedelta(seconds=get_setting(self.config, 'READINGS_CLOSED_AFTER', 3600))
+        return end_date + closed_after <= datetime.now(pytz.UTC)
+    
+    def _current_energy(self, device_id, year_month, start_date, end_date):
+        """
+        First and last energy register of an open month, kept incrementally:
+        the snapshot holds the month's first register and the last one seen,
+        so each call only looks at readings newer than the snapshot, plus one
+        indexed lookup for late readings older than the snapshot's first.
+        """
+        snapshot_id = f'{device_id}:{year_month}'
+        snapshot = self.db.bill_snapshots.find_one({'_id': snapshot_id})
+        since = snapshot['through'] if snapshot else start_date
+        projection = {'_id': 0, 'energy_kwh': 1, 'timestamp': 1}
+        
+        # Late or replayed readings can land before the snapshot's first register
+        first_before = (snapshot.get('first_ts') or end_date) if snapshot else end_date
+        first = self.db.meter_readings.find_one(
+            {'device_id': device_id, 'timestamp': {'$gte': start_date, '$lt': first_before}},
+            projection,
+            sort=[('timestamp', 1)]
+        )
+        latest = self.db.meter_readings.find_one(
+            {'device_id': device_id, 'timestamp': {'$gt': since, '$lt': end_date}},
+            projection,
+            sort=[('timestamp', -1)]
+        )
+        if snapshot and not latest and not first:
+            return snapshot['first_kwh'], snapshot['last_kwh']
+        
+        if snapshot and not first:
+            first_kwh, first_ts = snapshot['first_kwh'], snapshot.get('first_ts')
+        elif first:
+            first_kwh, first_ts = first.get('energy_kwh', 0), first['timestamp']
+        else:
+            return None
+        if latest:
+            last_kwh, through = latest.get('energy_kwh', 0), latest['timestamp']
+        elif snapshot:
+            last_kwh, through = snapshot['last_kwh'], snapshot['through']
+        else:
+            return None
+        
+        self.db.bill_snapshots.update_one(
+            {'_id': snapshot_id},
+            {'$set': {
+                'first_kwh': first_kwh,
+                'first_ts': first_ts,
+                'last_kwh': last_kwh,
+                'through': through,
+                'updated_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+        return first_kwh, last_kwh
     
     def compute_bill(self, device_id, year_month):
         """
         Compute monthly bill for a device
+        Closed months are memoised per tariff and readings version; the
+        current month is priced from an incrementally maintained energy snapshot.
         Args:
             device_id: Meter device ID
             year_month: String in format 'YYYY-MM'
@@ -25,104 +201,105 @@ class BillingService:
             Bill dictionary with charges breakdown
         """
         try:
-            # Parse month
-            year, month = year_month.split('-')
-            year, month = int(year), int(month)
-            
-            # Get date range for the month
-            start_date = datetime(year, month, 1, tzinfo=pytz.UTC)
-            if month == 12:
-                end_date = datetime(year + 1, 1, 1, tzinfo=pytz.UTC)
-            else:
-                end_date = datetime(year, month + 1, 1, tzinfo=pytz.UTC)
-            
-            # Query energy readings for the month
-            readings = list(self.db.meter_readings.find({
-                'device_id': device_id,
-                'timestamp': {'$gte': start_date, '$lt': end_date}
-            }).sort('timestamp', 1))
-            
-            if not readings:
-                logger.warning(f'No readings found for {device_id} in {year_month}')
-                return None
-            
-            # Calculate total energy (use last reading's accumulated kWh)
-            total_energy = readings[-1].get('energy_kwh', 0) - readings[0].get('energy_kwh', 0)
-            total_energy = max(total_energy, 0)  # Avoid negative values
+            start_date, end_date = month_range(year_month)
             
             # Get tariff config
-            tariff = self.db.tariffs.find_one({'name': 'default'})
+            tariff = self._get_tariff(self._device_tariffs([device_id])[device_id])
             if not tariff:
-                logger.error('Default tariff not found')
                 return None
             
-            # Calculate charges by slab
-            slabs_breakdown = []
-            remaining_units = total_energy
-            subtotal = 0
-            
-            for slab in tariff['slabs']:
-                slab_range = slab['range']
-                rate = slab['rate']
-                
-                # Parse slab range
-                if '+' in slab_range:
-                    slab_start = int(slab_range.replace('+', ''))
-                    slab_end = float('inf')
-                else:
-                    slab_start, slab_end = map(int, slab_range.split('-'))
-                
-                # Calculate units in this slab
-                if remaining_units > 0:
-                    slab_size = slab_end - slab_start if slab_end != float('inf') else remaining_units
-                    units_in_slab = min(remaining_units, slab_size)
-                    charge = units_in_slab * rate
-                    
-                    slabs_breakdown.append({
-                        'slab': slab_range,
-                        'units': round(units_in_slab, 2),
-                        'rate': rate,
-                        'charge': round(charge, 2)
-                    })
-                    
-                    subtotal += charge
-                    remaining_units -= units_in_slab
-            
-            # Apply fixed charge and tax
-            fixed_charge = tariff.get('fixed_charge', 0)
-            tax_rate = tariff.get('tax_rate', 0)
-            
-            total_before_tax = subtotal + fixed_charge
-            tax_amount = total_before_tax * tax_rate
-            total_bill = total_before_tax + tax_amount
-            
-            # Ensure minimum bill
-            minimum_bill = tariff.get('minimum_bill', fixed_charge)
-            total_bill = max(total_bill, minimum_bill)
+            closed = self._is_closed(end_date)
+            if closed:
+                # Bumped by ingest when late readings land in a closed range
+                version = cache_version(self.db, readings_key(device_id))
+                cached = bill_cache.get(self.db, device_id, year_month, tariff, version)
+                if cached:
+                    return cached
+                # First and last energy register for the month
+                energy = self._month_energy(device_id, start_date, end_date)
+            elif start_date <= datetime.now(pytz.UTC):
+                energy = self._current_energy(device_id, year_month, start_date, end_date)
+            else:
+                energy = None
             
-            bill = {
-                'device_id': device_id,
-                'month': year_month,
-                'energy_kwh': round(total_energy, 2),
-                'slabs': slabs_breakdown,
-                'subtotal': round(subtotal, 2),
-                'fixed_charge': round(fixed_charge, 2),
-                'tax': round(tax_amount, 2),
-                'total': round(total_bill, 2),
-                'currency': tariff.get('currency', 'INR'),
-                'status': 'issued',
-                'created_at': datetime.utcnow()
-            }
+            if not energy:
+                logger.warning(f'No readings found for {device_id} in {year_month}')
+                return None
             
+            bill = self._build_bills(year_month, {device_id: energy}, tariff)[device_id]
+            if closed:
+                bill_cache.put(self.db, bill, tariff, version)
             return bill
         
         except Exception as e:
             logger.error(f'Error computing bill: {e}')
             return None
     
+    def compute_bills(self, year_month, device_ids=None):
+        """
+        Compute monthly bills for many devices at once
+        One aggregation yields every device's first/last energy and each
+        tariff prices all of its devices in one vectorised pass, so cost
+        grows with devices, not readings.
+        Args:
+            year_month: String in format 'YYYY-MM'
+            device_ids: Devices to bill (default: every device with readings)
+        Returns:
+            {device_id: bill} for devices with readings in the month
+        Raises:
+            Database errors, so a failed run is not mistaken for devices without readings
+        """
+        start_date, end_date = month_range(year_month)
+        energy = self._fleet_energy(start_date, end_date, device_ids)
+        
+        # Group devices by tariff so each tariff is priced once
+        by_tariff = {}
+        for device_id, name in self._device_tariffs(energy.keys()).items():
+            by_tariff.setdefault(name, {})[device_id] = energy[device_id]
+        
+        bills = {}
+        for name, group in by_tariff.items():
+            tariff = self._get_tariff(name)
+            if tariff:
+                bills.update(self._build_bills(year_month, group, tariff))
+        return bills
+    
+    def _build_bills(self, year_month, energy, tariff):
+        """
+        Price a month's energy for many devices against one compiled tariff
+        Args:
+            energy: {device_id: (first_kwh, last_kwh)}
+        Returns:
+            {device_id: bill}
+        """
+        device_ids = list(energy)
+        # Calculate total energy (use last reading's accumulated kWh); avoid negative values
+        totals = np.maximum(np.array([energy[d][1] - energy[d][0] for d in device_ids], dtype=np.float64), 0)
+        units, subtotal, tax, total = tariff.price(totals)
+        
+        created_at = datetime.utcnow()
+        return {
+            device_id: {
+                'device_id': device_id,
+                'month': year_month,
+                'energy_kwh': round(float(totals[i]), 2),
+                'slabs': tariff.breakdown(units[i]),
+                'subtotal': round(float(subtotal[i]), 2),
+                'fixed_charge': round(tariff.fixed_charge, 2),
+                'tax': round(float(tax[i]), 2),
+                'total': round(float(total[i]), 2),
+                'currency': tariff.currency,
+                'tariff': tariff.name,
+                'status': 'issued',
+                'created_at': created_at
+            }
+            for i, device_id in enumerate(device_ids)
+        }
+    
     def generate_invoice(self, bill_data, user_info):
         """
         Generate and save invoice to database
+        Idempotent: an existing invoice for the same (device_id, month) is kept.
         Args:
             bill_data: Bill dictionary from compute_bill()
             user_info: User details (email, name, etc.)
@@ -143,13 +320,25 @@ class BillingService:
                 'status': 'issued',
                 'email_sent': False,
                 'created_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow(),
                 'due_date': datetime.utcnow() + timedelta(days=15),
                 'paid_date': None
             }
             
-            result = self.db.invoices.insert_one(invoice)
-            logger.info(f'Invoice created: {result.inserted_id}')
-            return str(result.inserted_id)
+            key = {'device_id': invoice['device_id'], 'month': invoice['month']}
+            result = self.db.invoices.update_one(key, {'$setOnInsert': invoice}, upsert=True)
+            
+            if result.upserted_id is None:
+                existing = self.db.invoices.find_one(key, {'_id': 1})
+                logger.info(f'Invoice already exists: {existing["_id"]}')
+                return str(existing['_id'])
+            
+            try:
+                bump_cache_version(self.db, invoices_key(invoice['device_id']))
+            except Exception as e:
+                logger.error(f'Error bumping invoice cache version: {e}')
+            logger.info(f'Invoice created: {result.upserted_id}')
+            return str(result.upserted_id)
         
         except Exception as e:
             logger.error(f'Error generating invoice: {e}')
@@ -0,0 +1,69 @@
+"""
+Columnar encoders for readings - compact typed arrays and Apache Arrow IPC
+"""
+import json
+import struct
+import sys
+from array import array
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional dependency
+    pa = None
+
+COLUMNAR_MIMETYPE = 'application/x-smartmeter-columnar'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+COLUMNAR_MAGIC = b'SMCOL1\x00\x00'
+
+def arrow_available():
+    """True if pyarrow is installed"""
+    return pa is not None
+
+def encode_columnar(columns, meta=None):
+    """
+    Pack columns into a compact little-endian typed-array layout:
+
+        8 bytes   magic 'SMCOL1\\0\\0'
+        4 bytes   uint32 header length
+        N bytes   JSON header, space-padded to a multiple of 8
+        ...       each column's raw values in header order
+
+    The header lists {name, type, length} per column (type is 'int64'
+    for timestamps in epoch ms, 'float64' otherwise, NaN for missing).
+    Padding keeps every column 8-byte aligned for Float64Array/BigInt64Array.
+    """
+    header = dict(meta or {})
+    header['columns'] = [
+        {'name': name, 'type': 'int64' if values.typecode == 'q' else 'float64', 'length': len(values)}
+        for name, values in columns.items()
+    ]
+    header_bytes = json.dumps(header).encode()
+    pad = (-(len(COLUMNAR_MAGIC) + 4 + len(header_bytes))) % 8
+    header_bytes += b' ' * pad
+
+    parts = [COLUMNAR_MAGIC, struct.pack('<I', len(header_bytes)), header_bytes]
+    for values in columns.values():
+        if sys.byteorder != 'little':
+            values = array(values.typecode, values)
+            values.byteswap()
+        parts.append(values.tobytes())
+    return b''.join(parts)
+
+def encode_arrow(columns, meta=None):
+    """Encode columns as an Arrow IPC stream (requires pyarrow)"""
+    if pa is None:
+        raise RuntimeError('pyarrow is not installed')
+
+    fields, arrays = [], []
+    for name, values in columns.items():
+        arrow_type = pa.timestamp('ms', tz='UTC') if values.typecode == 'q' else pa.float64()
+        # Wrap the typed array's buffer directly, no per-value conversion
+        arrays.append(pa.Array.from_buffers(arrow_type, len(values), [None, pa.py_buffer(values)]))
+        fields.append(pa.field(name, arrow_type))
+
+    schema = pa.schema(fields, metadata={k: str(v) for k, v in (meta or {}).items() if v is not None})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+    return sink.getvalue().to_pybytes()
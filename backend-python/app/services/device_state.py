@@ -0,0 +1,193 @@
+"""
+Device State - in-memory latest reading per device for dashboards
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from threading import Thread, Lock, Event
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+STATE_FIELDS = ('timestamp', 'voltage', 'current', 'power_w', 'energy_kwh', 'power_factor', 'rssi')
+
+def _utc_naive(ts):
+    # Decoded readings are aware, stored ones naive UTC
+    if ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+def latest_state_updates(readings, now=None):
+    """
+    Device updates storing each device's newest reading as `latest`, for
+    processes that follow state instead of subscribing to the whole fleet.
+    The filter keeps an older (late or replayed) reading from replacing a newer one.
+    """
+    latest = {}
+    for reading in readings:
+        ts = reading.get('timestamp')
+        if not isinstance(ts, datetime):
+            continue
+        ts = _utc_naive(ts)
+        current = latest.get(reading['device_id'])
+        if current is None or ts > current[0]:
+            latest[reading['device_id']] = (ts, reading)
+
+    now = now or datetime.utcnow()
+    updates = []
+    for device_id, (ts, reading) in latest.items():
+        state = {field: reading.get(field) for field in STATE_FIELDS}
+        state['timestamp'] = ts
+        updates.append(UpdateOne(
+            {'device_id': device_id, '$or': [{'latest.timestamp': {'$lt': ts}}, {'latest': {'$exists': False}}]},
+            {'$set': {'latest': state, 'state_at': now}}
+        ))
+    return updates
+
+class DeviceStateCache:
+    """
+    Latest reading per device, kept by the MQTT ingest path (or by a
+    DeviceStateFollower in processes that don't ingest).
+    Lookups are dict reads under a lock and never touch MongoDB;
+    warm() seeds the cache once at startup.
+    """
+
+    def __init__(self):
+        self._states = {}  # device_id -> state dict (JSON-safe)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def update(self, reading, status='online', last_seen=None):
+        """Record a reading if it is newer than the cached one"""
+        ts = reading.get('timestamp')
+        if not isinstance(ts, datetime):
+            return False
+        ts = _utc_naive(ts)
+        last_seen = last_seen or datetime.utcnow()
+        state = {field: reading.get(field) for field in STATE_FIELDS}
+        state['timestamp'] = ts.isoformat()
+        state['device_id'] = reading['device_id']
+        state['status'] = status
+        state['last_seen'] = last_seen.isoformat() if isinstance(last_seen, datetime) else None
+
+        with self._lock:
+            current = self._states.get(reading['device_id'])
+            # Redelivered or out-of-order readings don't overwrite newer state
+            if current and current['_ts'] >= ts:
+                return False
+            state['_ts'] = ts
+            self._states[reading['device_id']] = state
+        return True
+
+    def get(self, device_id):
+        """Latest state for one device, or None"""
+        with self._lock:
+            state = self._states.get(device_id)
+        return _public(state) if state else None
+
+    def snapshot(self):
+        """Latest state for every known device, ordered by device_id"""
+        with self._lock:
+            states = list(self._states.values())
+        return sorted((_public(s) for s in states), key=lambda s: s['device_id'])
+
+    def warm(self, db):
+        """
+        Seed from the `latest` state stored on each device document (startup
+        only); devices not heard from since it was introduced fall back to
+        their newest stored reading, one indexed lookup each
+        """
+        try:
+            count = 0
+            for device in db.devices.find({}, DEVICE_STATE_PROJECTION):
+                latest = device.get('latest')
+                if latest is None:
+                    latest = db.meter_readings.find_one(
+                        {'device_id': device['device_id']}, sort=[('timestamp', -1)]
+                    )
+                    if latest is None:
+                        continue
+                if self.apply(device, latest):
+                    count += 1
+            logger.info(f'Device state cache warmed with {count} devices')
+        except Exception as e:
+            logger.error(f'Error warming device state cache: {e}')
+
+    def apply(self, device, latest):
+        """Record a device document's stored state (status and last_seen included)"""
+        return self.update(
+            dict(latest, device_id=device['device_id']),
+            status=device.get('status', 'offline'),
+            last_seen=device.get('last_seen')
+        )
+
+DEVICE_STATE_PROJECTION = {'_id': 0, 'device_id': 1, 'status': 1, 'last_seen': 1, 'latest': 1, 'state_at': 1}
+
+class DeviceStateFollower:
+    """
+    Keeps a DeviceStateCache current in processes that don't see the whole
+    telemetry stream (web workers that don't ingest, shared subscriptions).
+    The ingest path stores each device's newest reading on its document
+    (latest_state_updates); this polls for documents changed since the
+    last poll - one indexed query per interval, whatever the fleet size -
+    instead of every process decoding every MQTT message.
+    """
+
+    def __init__(self, db, state, on_update=None, interval=1.0):
+        self.db = db
+        self.state = state
+        self.on_update = on_update
+        self.interval = interval
+        self.connected = False
+        self._since = None
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='state-follow', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+                self.connected = True
+            except Exception as e:
+                if self.connected:
+                    logger.error(f'Error following device state: {e}')
+                self.connected = False
+            if self._stop.wait(self.interval):
+                return
+
+    def poll(self):
+        """
+        Apply devices whose state changed since the last poll
+        Returns:
+            Number of devices updated
+        """
+        if self._since is None:
+            # First poll: start from now, warm() has loaded what came before
+            self._since = datetime.utcnow() - timedelta(seconds=self.interval)
+        # $gte: another write may share the last poll's millisecond; repeats are
+        # ignored by the cache because their timestamp is not newer
+        changed = 0
+        for device in self.db.devices.find({'state_at': {'$gte': self._since}}, DEVICE_STATE_PROJECTION):
+            self._since = max(self._since, device['state_at'])
+            if device.get('latest') and self.state.apply(device, device['latest']):
+                changed += 1
+                if self.on_update:
+                    self.on_update(device['device_id'])
+        return changed
+
+def _public(state):
+    return {k: v for k, v in state.items() if k != '_ts'}
@@ -0,0 +1,312 @@
+"""
+Ingest Buffer - batches telemetry writes to MongoDB
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from threading import Thread, Lock, Event
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.services.metrics import ingest_lag_seconds
+from app.services.device_state import latest_state_updates
+from app.services.response_cache import bump_cache_versions, late_readings_keys
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000  # redelivered reading rejected by the (device_id, timestamp) unique index
+
+class IngestBuffer:
+    """
+    Bounded in-memory buffer flushed by size or time.
+    With a spool, batches MongoDB cannot take (write failure or a full
+    buffer) go to disk instead of being dropped, and while anything is
+    spooled new batches queue behind it, so each device's readings reach
+    MongoDB in arrival order.
+    With `closed_after`, readings older than that many seconds bump their
+    device's readings version, so cached closed ranges and bills revalidate.
+    """
+
+    def __init__(self, db, max_size=20000, batch_size=500, flush_interval=1.0, rollups=None, spool=None,
+                 closed_after=None):
+        self.db = db
+        self.rollups = rollups
+        self.spool = spool
+        self.closed_after = closed_after
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._readings = []
+        self._last_seen = {}  # device_id -> datetime, coalesced per flush
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self._rollup_backlog = []  # persisted readings whose rollup update failed
+
+        self.stats = {
+            'received': 0,
+            'persisted': 0,
+            'dropped': 0,
+            'duplicates': 0,
+            'write_errors': 0,
+            'flushes': 0,
+            'flush_failures': 0,
+            'rollup_failures': 0,
+            'spooled': 0,
+            'last_flush_ms': 0.0,
+            'high_watermark': 0
+        }
+
+    @property
+    def depth(self):
+        """Number of readings waiting to be flushed"""
+        return len(self._readings)
+
+    def start(self):
+        """Start the periodic flush thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='ingest-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and flush whatever is left"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def add(self, reading):
+        """
+        Queue a reading for the next flush
+        Returns:
+            False if the buffer is full and the reading was dropped
+        """
+        with self._lock:
+            self.stats['received'] += 1
+            if len(self._readings) >= self.max_size:
+                if self._spill([reading]):
+                    return True
+                self.stats['dropped'] += 1
+                return False
+
+            self._readings.append(reading)
+            self._last_seen[reading['device_id']] = datetime.utcnow()
+            depth = len(self._readings)
+            if depth > self.stats['high_watermark']:
+                self.stats['high_watermark'] = depth
+
+        if depth >= self.batch_size:
+            self.flush()
+        return True
+
+    def add_many(self, readings):
+        """
+        Queue a batch of readings so they reach the same bulk write
+        Returns:
+            Number of readings accepted (the rest were dropped, buffer full)
+        """
+        with self._lock:
+            self.stats['received'] += len(readings)
+            accepted = readings[:max(self.max_size - len(self._readings), 0)]
+            if len(accepted) < len(readings) and self._spill(readings):
+                return len(readings)
+            self.stats['dropped'] += len(readings) - len(accepted)
+
+            self._readings.extend(accepted)
+            now = datetime.utcnow()
+            for reading in accepted:
+                self._last_seen[reading['device_id']] = now
+            depth = len(self._readings)
+            if depth > self.stats['high_watermark']:
+                self.stats['high_watermark'] = depth
+
+        if depth >= self.batch_size:
+            self.flush()
+        return len(accepted)
+
+    def _spill(self, readings):
+        """
+        Buffer full: move everything buffered plus `readings` to the spool,
+        oldest first (caller holds _lock)
+        Returns:
+            False without a spool or when the spool is full
+        """
+        if self.spool is None:
+            return False
+        spilled = self._readings + readings
+        if not self.spool.append(spilled):
+            return False
+        self._readings = []
+        self.stats['spooled'] += len(spilled)
+        return True
+
+    def flush(self):
+        """Write buffered readings and device updates in bulk"""
+        with self._flush_lock:
+            with self._lock:
+                readings, self._readings = self._readings, []
+                last_seen, self._last_seen = self._last_seen, {}
+
+            if not readings:
+                return 0
+
+            if self.spool is not None and self.spool.pending:
+                # Nothing may overtake readings already spooled
+                if self._to_spool(readings):
+                    return 0
+
+            try:
+                return self._write(readings, last_seen)
+            except Exception as e:
+                with self._lock:
+                    self.stats['flush_failures'] += 1
+                logger.error(f'Error flushing {len(readings)} readings: {e}')
+                if not self._to_spool(readings):
+                    self._requeue(readings, last_seen)
+                return 0
+
+    def _to_spool(self, readings):
+        if self.spool is None or not self.spool.append(readings):
+            return False
+        with self._lock:
+            self.stats['spooled'] += len(readings)
+        return True
+
+    def write_spooled(self, readings):
+        """
+        Replay a spooled batch (SpoolReplayer's write); raises while MongoDB
+        is unavailable so the batch stays in the spool
+        """
+        last_seen = {}
+        for reading in readings:
+            seen = reading.get('created_at') or datetime.utcnow()
+            last_seen[reading['device_id']] = max(last_seen.get(reading['device_id'], seen), seen)
+        with self._flush_lock:
+            return self._write(readings, last_seen)
+
+    def _write(self, readings, last_seen):
+        """
+        insert_many plus device/rollup updates
+        Returns:
+            Number of readings persisted
+        Raises:
+            Errors other than per-document write errors (MongoDB unavailable)
+        """
+        started = time.monotonic()
+        duplicates = write_errors = 0
+        written = readings
+        try:
+            self.db.meter_readings.insert_many(readings, ordered=False)
+        except BulkWriteError as e:
+            # Unordered insert: everything except the failed documents was written
+            errors = e.details.get('writeErrors', [])
+            failed = {err['index'] for err in errors}
+            rejected = [readings[err['index']] for err in errors if err.get('code') == DUPLICATE_KEY]
+            # A retried batch collides with its own rows from the failed attempt
+            ours = self._inserted_earlier(rejected)
+            written = [r for i, r in enumerate(readings) if i not in failed or r.get('_id') in ours]
+            duplicates = len(rejected) - len(ours)
+            write_errors = len(errors) - len(rejected)
+            if write_errors:
+                logger.warning(f'Bulk insert partially failed: {write_errors} readings rejected')
+
+        try:
+            # Ordered: a new device's upsert must land before its latest-state update
+            self.db.devices.bulk_write([
+                UpdateOne(
+                    {'device_id': device_id},
+                    {'$set': {'last_seen': seen, 'status': 'online'}},
+                    upsert=True
+                )
+                for device_id, seen in last_seen.items()
+            ] + latest_state_updates(written), ordered=True)
+        except Exception as e:
+            logger.error(f'Error updating device last_seen: {e}')
+
+        self._observe_lag(written)
+
+        if self.rollups:
+            self._apply_rollups(written)
+
+        if self.closed_after is not None:
+            try:
+                bump_cache_versions(self.db, late_readings_keys(written, self.closed_after))
+            except Exception as e:
+                logger.error(f'Error bumping readings versions: {e}')
+
+        persisted = len(written)
+        with self._lock:
+            self.stats['persisted'] += persisted
+            self.stats['duplicates'] += duplicates
+            self.stats['write_errors'] += write_errors
+            self.stats['flushes'] += 1
+            self.stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 2)
+
+        logger.debug(f'Flushed {persisted} readings for {len(last_seen)} devices')
+        return persisted
+
+    def _inserted_earlier(self, rejected):
+        """
+        _ids of duplicate-key readings that are this batch's own rows: an
+        earlier attempt inserted them (insert_many set their _id) before
+        failing, so they still need their device and rollup updates.
+        A redelivered reading carries a fresh _id and is not found.
+        """
+        ids = [r['_id'] for r in rejected if '_id' in r]
+        if not ids:
+            return set()
+        return {doc['_id'] for doc in self.db.meter_readings.find({'_id': {'$in': ids}}, {'_id': 1})}
+
+    def _apply_rollups(self, written):
+        """
+        Fold written readings into the rollups; a failed update is kept and
+        retried with the next flush (up to max_size readings, past that
+        `manage.py backfill-rollups` has to repair the buckets)
+        """
+        with self._lock:
+            backlog, self._rollup_backlog = self._rollup_backlog, []
+        readings = backlog + written
+        try:
+            self.rollups.apply(readings)
+        except Exception as e:
+            kept = readings[-self.max_size:]
+            with self._lock:
+                self._rollup_backlog = kept + self._rollup_backlog
+                self.stats['rollup_failures'] += 1
+            if len(kept) < len(readings):
+                logger.error(f'Error updating rollups, {len(readings) - len(kept)} readings need backfill-rollups: {e}')
+            else:
+                logger.error(f'Error updating rollups, retrying {len(kept)} readings with the next flush: {e}')
+
+    def _observe_lag(self, readings):
+        """Ingest lag: now minus each persisted reading's own timestamp"""
+        now = time.time()
+        for reading in readings:
+            ts = reading.get('timestamp')
+            if isinstance(ts, datetime):
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                ingest_lag_seconds.observe(max(now - ts.timestamp(), 0.0))
+
+    def _requeue(self, readings, last_seen):
+        """Put a failed batch back in front of the buffer, dropping what no longer fits"""
+        with self._lock:
+            room = max(self.max_size - len(self._readings), 0)
+            kept = readings[:room]
+            self.stats['dropped'] += len(readings) - len(kept)
+            self._readings = kept + self._readings
+            for device_id, seen in last_seen.items():
+                self._last_seen.setdefault(device_id, seen)
+
+    def snapshot(self):
+        """Current buffer depth and counters"""
+        with self._lock:
+            return dict(self.stats, depth=len(self._readings), capacity=self.max_size)
@@ -0,0 +1,129 @@
+"""
+Ingest Pipeline - bounded queue between the MQTT network loop and DB workers
+"""
+import logging
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLICIES = ('block', 'drop', 'drop_oldest')
+
+_STOP = object()
+
+class IngestPipeline:
+    """Worker threads that decode and persist raw MQTT payloads"""
+
+    def __init__(self, handler, workers=4, max_size=10000, policy='block', block_timeout=0.5):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f'Unknown queue policy: {policy}')
+
+        self.handler = handler
+        self.workers = max(int(workers), 1)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = Queue(maxsize=max_size)
+        self.accepting = False
+
+        self._threads = []
+        self._lock = Lock()
+        self.stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'high_watermark': 0
+        }
+
+    def start(self):
+        """Start worker threads"""
+        if self._threads:
+            return
+        self.accepting = True
+        for i in range(self.workers):
+            thread = Thread(target=self._run, name=f'ingest-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f'Ingest pipeline started with {self.workers} workers ({self.policy} policy)')
+
+    def submit(self, topic, payload):
+        """
+        Enqueue a raw payload; called from the MQTT network thread
+        Returns:
+            False if the payload was dropped
+        """
+        if not self.accepting:
+            self._count('dropped')
+            return False
+
+        item = (topic, payload)
+        try:
+            if self.policy == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            elif self.policy == 'drop':
+                self.queue.put_nowait(item)
+            else:
+                self._put_drop_oldest(item)
+        except Full:
+            self._count('dropped')
+            return False
+
+        depth = self.queue.qsize()
+        with self._lock:
+            self.stats['enqueued'] += 1
+            if depth > self.stats['high_watermark']:
+                self.stats['high_watermark'] = depth
+        return True
+
+    def _put_drop_oldest(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self._count('dropped')
+                except Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(*item)
+                self._count('processed')
+            except Exception as e:
+                self._count('failed')
+                logger.error(f'Ingest worker error: {e}')
+            finally:
+                self.queue.task_done()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def stop(self):
+        """Stop accepting payloads, drain the queue and join the workers"""
+        self.accepting = False
+        for _ in self._threads:
+            # Sentinels go after any queued payloads, so workers drain first
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logger.info('Ingest pipeline drained')
+
+    def snapshot(self):
+        """Queue depth gauges and counters"""
+        with self._lock:
+            return dict(
+                self.stats,
+                depth=self.queue.qsize(),
+                capacity=self.queue.maxsize,
+                workers=len(self._threads),
+                policy=self.policy
+            )
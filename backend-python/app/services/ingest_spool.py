@@ -0,0 +1,344 @@
+"""
+Ingest Spool - disk write-ahead log for readings MongoDB could not take
+"""
+import os
+import mmap
+import time
+import zlib
+import struct
+import logging
+from threading import Thread, Lock, Event
+import bson
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, the spool is not shared-safe
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Record: I payload length | I crc32 of payload | d appended at (epoch seconds), then BSON
+RECORD_HEADER = struct.Struct('<IId')
+
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.seg'
+
+# Replay position "<segment seq> <offset>", rewritten after every replayed batch
+CURSOR_FILE = 'cursor'
+
+def _segment_name(seq):
+    return f'{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}'
+
+class IngestSpool:
+    """
+    Append-only, segmented spool of reading batches.
+    Appends go to the newest segment and are fsynced at most every
+    `fsync_interval` seconds (group commit); replay memory-maps sealed
+    segments oldest first and deletes each once MongoDB has taken it.
+    Total size is capped at `max_bytes`; appends beyond it are refused.
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._lock_file = None
+        self._active = None  # file object of the segment being appended to
+        self._active_seq = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self._cursor = 0  # replay offset within the oldest segment, persisted in CURSOR_FILE
+
+        # seq -> size, oldest first; segments left by a previous run are replayed
+        self._segments = {}
+        for name in sorted(os.listdir(directory)):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                self._segments[seq] = os.path.getsize(os.path.join(directory, name))
+        self._bytes = sum(self._segments.values())
+        # Only ever increases, so a new segment never reuses the name of one being replayed
+        self._next_seq = max(self._segments, default=0) + 1
+        self._cursor = self._load_cursor()
+
+        self.stats = {
+            'spooled': 0,
+            'replayed': 0,
+            'rejected': 0,
+            'corrupt': 0
+        }
+        if self._bytes:
+            logger.warning(f'Ingest spool has {self._bytes} bytes in {len(self._segments)} segments to replay')
+
+    def _load_cursor(self):
+        """Resume offset in the oldest segment left by a previous run"""
+        path = os.path.join(self.directory, CURSOR_FILE)
+        try:
+            with open(path) as f:
+                seq, offset = (int(part) for part in f.read().split())
+        except (OSError, ValueError):
+            return 0
+        self._next_seq = max(self._next_seq, seq + 1)
+        if self._segments and seq == min(self._segments) and offset <= self._segments[seq]:
+            return offset
+        # Points at a segment already replayed and deleted
+        os.remove(path)
+        return 0
+
+    def _save_cursor(self, seq, offset):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(f'{seq} {offset}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _clear_cursor(self):
+        try:
+            os.remove(os.path.join(self.directory, CURSOR_FILE))
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def open(cls, config):
+        """
+        Spool from INGEST_SPOOL_* settings, or None when disabled or when
+        another process already owns the directory
+        """
+        directory = config.INGEST_SPOOL_DIR
+        if not directory:
+            return None
+        spool = cls(
+            directory,
+            segment_bytes=config.INGEST_SPOOL_SEGMENT_MB * 1024 * 1024,
+            max_bytes=config.INGEST_SPOOL_MAX_MB * 1024 * 1024,
+            fsync_interval=config.INGEST_SPOOL_FSYNC_INTERVAL
+        )
+        if not spool._acquire():
+            logger.error(f'Ingest spool {directory} is in use by another process, spooling disabled')
+            return None
+        return spool
+
+    def _acquire(self):
+        if fcntl is None:
+            return True
+        handle = open(os.path.join(self.directory, '.lock'), 'a+')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        return True
+
+    @property
+    def pending(self):
+        """True while anything is waiting to be replayed"""
+        return self._bytes > self._cursor
+
+    def _path(self, seq):
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def append(self, readings):
+        """
+        Durably queue a batch of readings (on disk within fsync_interval)
+        Returns:
+            False if the spool is full and the batch was not written
+        """
+        if not readings:
+            return True
+        # BSON keeps datetimes and ObjectIds, so replayed readings are identical
+        payload = bson.encode({'readings': readings})
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload), time.time()) + payload
+
+        with self._lock:
+            if self._bytes + len(record) > self.max_bytes:
+                self.stats['rejected'] += len(readings)
+                return False
+            if self._active is None or self._segments[self._active_seq] + len(record) > self.segment_bytes:
+                self._roll()
+            self._active.write(record)
+            self._segments[self._active_seq] += len(record)
+            self._bytes += len(record)
+            self._dirty = True
+            self.stats['spooled'] += len(readings)
+            self._sync(force=False)
+        return True
+
+    def _roll(self):
+        """Seal the active segment and start a new one"""
+        self._close_active()
+        self._active_seq = self._next_seq
+        self._next_seq += 1
+        self._segments[self._active_seq] = 0
+        self._active = open(self._path(self._active_seq), 'ab')
+
+    def _close_active(self):
+        if self._active is not None:
+            self._sync(force=True)
+            self._active.close()
+            self._active = None
+
+    def _sync(self, force):
+        if self._dirty and (force or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._dirty = False
+            self._last_sync = time.monotonic()
+
+    def sync(self):
+        """fsync pending appends now (called periodically by the replayer)"""
+        with self._lock:
+            if self._active is not None:
+                self._sync(force=True)
+
+    def replay(self, write, batch_size=5000):
+        """
+        Drain the spool oldest first through `write(readings)`. A batch is
+        committed (and its position fsynced to CURSOR_FILE) only after write
+        returns; if write raises or the process dies, replay resumes from that
+        batch, so the batch in flight may be written twice but none is skipped.
+        Returns:
+            Number of readings replayed
+        """
+        replayed = 0
+        while True:
+            with self._lock:
+                if not self.pending:
+                    return replayed
+                seq = min(self._segments)
+                if seq == self._active_seq and self._active is not None:
+                    # Seal the segment being appended to, new appends go to the next one
+                    self._close_active()
+                cursor = self._cursor
+
+            replayed += self._replay_segment(seq, cursor, write, batch_size)
+            with self._lock:
+                # Under the lock: an append in between must not see the segment or the cursor
+                self._bytes -= self._segments.pop(seq)
+                self._cursor = 0
+                os.remove(self._path(seq))
+                self._clear_cursor()
+
+    def _replay_segment(self, seq, cursor, write, batch_size):
+        path = self._path(seq)
+        size = os.path.getsize(path)
+        if size <= cursor:
+            return 0
+
+        replayed = 0
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = cursor
+            batch = []
+            while offset + RECORD_HEADER.size <= size:
+                length, crc, _ = RECORD_HEADER.unpack_from(mm, offset)
+                end = offset + RECORD_HEADER.size + length
+                if end > size:
+                    # Torn tail from a crash mid-append: nothing after it was acknowledged
+                    self.stats['corrupt'] += 1
+                    logger.error(f'Ingest spool {path}: truncated record at {offset}')
+                    break
+                payload = mm[offset + RECORD_HEADER.size:end]
+                if zlib.crc32(payload) != crc:
+                    self.stats['corrupt'] += 1
+                    logger.error(f'Ingest spool {path}: bad checksum at {offset}, record skipped')
+                    offset = end
+                    continue
+                offset = end
+                batch.extend(bson.decode(payload)['readings'])
+                if len(batch) >= batch_size:
+                    replayed += self._commit(write, batch, seq, offset)
+                    batch = []
+            if batch:
+                replayed += self._commit(write, batch, seq, offset)
+        return replayed
+
+    def _commit(self, write, batch, seq, offset):
+        write(batch)
+        with self._lock:
+            self._cursor = offset
+            self._save_cursor(seq, offset)
+            self.stats['replayed'] += len(batch)
+        return len(batch)
+
+    def lag_seconds(self):
+        """Age of the oldest reading waiting in the spool (0 when empty)"""
+        with self._lock:
+            if not self.pending:
+                return 0.0
+            seq, cursor = min(self._segments), self._cursor
+        try:
+            with open(self._path(seq), 'rb') as f:
+                f.seek(cursor)
+                header = f.read(RECORD_HEADER.size)
+        except OSError:
+            return 0.0
+        if len(header) < RECORD_HEADER.size:
+            return 0.0
+        return max(time.time() - RECORD_HEADER.unpack(header)[2], 0.0)
+
+    def close(self):
+        with self._lock:
+            self._close_active()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def snapshot(self):
+        """Spool size, lag and counters"""
+        lag = self.lag_seconds()
+        with self._lock:
+            return dict(
+                self.stats,
+                bytes=self._bytes - self._cursor,
+                segments=len(self._segments),
+                capacity_bytes=self.max_bytes,
+                lag_seconds=round(lag, 3)
+            )
+
+class SpoolReplayer:
+    """Background thread that drains the spool into MongoDB once it recovers"""
+
+    def __init__(self, spool, write, interval=1.0, batch_size=5000, max_backoff=30.0):
+        self.spool = spool
+        self.write = write
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='spool-replay', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.max_backoff + 5)
+            self._thread = None
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.wait(delay):
+            self.spool.sync()
+            if not self.spool.pending:
+                delay = self.interval
+                continue
+            try:
+                replayed = self.spool.replay(self.write, self.batch_size)
+                logger.info(f'Ingest spool replayed {replayed} readings')
+                delay = self.interval
+            except Exception as e:
+                # MongoDB still unavailable: back off, the spool keeps the readings
+                self.failures += 1
+                delay = min(delay * 2, self.max_backoff)
+                logger.warning(f'Ingest spool replay failed, retrying in {delay:.0f}s: {e}')
@@ -0,0 +1,151 @@
+"""
+Live Hub - fans out latest device state to Server-Sent Events clients
+"""
+import json
+import logging
+import time
+from threading import Lock, Event
+
+logger = logging.getLogger(__name__)
+
+ALL_DEVICES = '*'
+
+class LiveSubscription:
+    """
+    One SSE connection. Updates are coalesced per device (only the newest
+    state is kept while the client is waiting) and sent at most once every
+    `min_interval` seconds, so a slow client never builds a backlog.
+    """
+
+    def __init__(self, hub, device_ids):
+        self.hub = hub
+        self.device_ids = device_ids
+        self._pending = {}  # device_id -> newest state not yet sent
+        self._lock = Lock()
+        self._event = Event()
+        self._closed = False
+
+    def offer(self, device_id, state):
+        with self._lock:
+            coalesced = device_id in self._pending
+            self._pending[device_id] = state
+        self._event.set()
+        if coalesced:
+            self.hub.count('coalesced')
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    def events(self, initial=()):
+        """Yield SSE frames until the client goes away or the hub shuts down"""
+        try:
+            yield f'retry: {int(self.hub.retry_ms)}\n\n'
+            for state in initial:
+                yield _frame(state)
+
+            last_sent = 0.0
+            while not self._closed:
+                if not self._event.wait(self.hub.heartbeat):
+                    # Comment line keeps proxies from timing out and detects dead clients
+                    yield ': ping\n\n'
+                    continue
+
+                wait = last_sent + self.hub.min_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+
+                with self._lock:
+                    pending, self._pending = self._pending, {}
+                    self._event.clear()
+                if self._closed:
+                    break
+
+                last_sent = time.monotonic()
+                for state in pending.values():
+                    yield _frame(state)
+                self.hub.count('delivered', len(pending))
+        finally:
+            self.hub.unsubscribe(self)
+
+class LiveHub:
+    """Device -> subscriptions index; publish() is called from the ingest path"""
+
+    def __init__(self, max_clients=5000, min_interval=1.0, heartbeat=15.0, retry_ms=5000):
+        self.max_clients = max_clients
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+
+        self._subscribers = {}  # device_id or ALL_DEVICES -> set of LiveSubscription
+        self._count = 0
+        self._lock = Lock()
+
+        self.stats = {
+            'published': 0,
+            'delivered': 0,
+            'coalesced': 0,
+            'rejected': 0
+        }
+
+    @property
+    def clients(self):
+        return self._count
+
+    def subscribe(self, device_ids=None):
+        """
+        Register a client for some devices (None for the whole fleet)
+        Returns:
+            LiveSubscription, or None if max_clients is reached
+        """
+        keys = list(device_ids) if device_ids else [ALL_DEVICES]
+        sub = LiveSubscription(self, keys)
+        with self._lock:
+            if self._count >= self.max_clients:
+                self.stats['rejected'] += 1
+                return None
+            for key in keys:
+                self._subscribers.setdefault(key, set()).add(sub)
+            self._count += 1
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            removed = False
+            for key in sub.device_ids:
+                subs = self._subscribers.get(key)
+                if subs and sub in subs:
+                    subs.discard(sub)
+                    removed = True
+                    if not subs:
+                        del self._subscribers[key]
+            if removed:
+                self._count -= 1
+
+    def publish(self, device_id, state):
+        """Hand a device's new state to its subscribers (cheap, never blocks on clients)"""
+        with self._lock:
+            targets = list(self._subscribers.get(device_id, ())) + list(self._subscribers.get(ALL_DEVICES, ()))
+            if targets:
+                self.stats['published'] += 1
+        for sub in targets:
+            sub.offer(device_id, state)
+
+    def count(self, name, n=1):
+        """Bump a stats counter (streams call this from their own threads)"""
+        with self._lock:
+            self.stats[name] += n
+
+    def close(self):
+        """Ask every open stream to finish"""
+        with self._lock:
+            subs = {sub for subs in self._subscribers.values() for sub in subs}
+        for sub in subs:
+            sub.close()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, clients=self._count, capacity=self.max_clients)
+
+def _frame(state):
+    return f'event: reading\ndata: {json.dumps(state)}\n\n'
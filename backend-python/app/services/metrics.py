@@ -0,0 +1,149 @@
+"""
+Metrics - Prometheus metrics for request, MongoDB, ingest and billing timings
+"""
+import logging
+import os
+from threading import Lock, Thread, Event
+from pymongo import monitoring
+# Loads .env first: prometheus_client reads PROMETHEUS_MULTIPROC_DIR when imported
+from app.config import config as _config  # noqa: F401
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+def multiprocess_dir():
+    """prometheus_client multiprocess directory (gunicorn), or None"""
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or None
+
+def render():
+    """Prometheus text exposition of this process, or of every worker in multiprocess mode"""
+    sync_stats()
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener timing every command by name"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_seconds.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        mongo_command_seconds.labels(event.command_name).observe(event.duration_micros / 1e6)
+        mongo_command_failures.labels(event.command_name).inc()
+
+http_request_seconds = Histogram(
+    'smartmeter_http_request_duration_seconds', 'HTTP request latency by route',
+    ('method', 'route', 'status'), buckets=LATENCY_BUCKETS
+)
+mongo_command_seconds = Histogram(
+    'smartmeter_mongodb_command_duration_seconds', 'MongoDB command latency',
+    ('command',), buckets=LATENCY_BUCKETS
+)
+mongo_command_failures = Counter(
+    'smartmeter_mongodb_command_failures', 'Failed MongoDB commands', ('command',)
+)
+ingest_lag_seconds = Histogram(
+    'smartmeter_ingest_lag_seconds', 'Time from reading timestamp to being persisted',
+    buckets=LAG_BUCKETS
+)
+billing_device_seconds = Histogram(
+    'smartmeter_billing_device_duration_seconds', 'BillingJob time per device (invoice and checkpoint)',
+    ('outcome',), buckets=LATENCY_BUCKETS
+)
+billing_stage_seconds = Histogram(
+    'smartmeter_billing_stage_duration_seconds', 'BillingJob stage durations',
+    ('stage',), buckets=LATENCY_BUCKETS + (30.0, 60.0, 300.0, 900.0)
+)
+
+class StatsMetrics:
+    """
+    Mirror a component's stats dict (IngestBuffer/IngestPipeline snapshot)
+    into Prometheus metrics: counters advance by the change since the last
+    sync, gauges are summed over live workers in multiprocess mode.
+    """
+
+    def __init__(self, prefix, stats_fn, counters=(), gauges=()):
+        self.stats_fn = stats_fn
+        self.counters = {key: _stats_metric(Counter, f'{prefix}_{key}', f'{prefix} {key}') for key in counters}
+        self.gauges = {key: _stats_metric(Gauge, f'{prefix}_{key}', f'{prefix} {key}', multiprocess_mode='livesum') for key in gauges}
+        self._synced = {}
+
+    def sync(self):
+        stats = self.stats_fn()
+        for key, counter in self.counters.items():
+            value = stats.get(key, 0)
+            if value > self._synced.get(key, 0):
+                counter.inc(value - self._synced.get(key, 0))
+            self._synced[key] = value
+        for key, gauge in self.gauges.items():
+            gauge.set(stats.get(key, 0))
+
+_stats = {}  # prefix -> StatsMetrics of the current app
+_stats_metrics = {}  # metric name -> Counter/Gauge, registered once per process
+_stats_lock = Lock()
+
+def _stats_metric(cls, name, help_text, **kwargs):
+    with _stats_lock:
+        if name not in _stats_metrics:
+            _stats_metrics[name] = cls(name, help_text, **kwargs)
+        return _stats_metrics[name]
+
+def stats_collector(prefix, stats_fn, counters=(), gauges=()):
+    """
+    Expose a component's stats dict
+    Args:
+        counters: Keys exported as <prefix>_<key>_total counters
+        gauges: Keys exported as <prefix>_<key> gauges
+    """
+    stats = StatsMetrics(prefix, stats_fn, counters, gauges)
+    with _stats_lock:
+        _stats[prefix] = stats
+    return stats
+
+def sync_stats():
+    """Copy every component's current stats into its metrics"""
+    with _stats_lock:
+        stats = list(_stats.values())
+    for component in stats:
+        try:
+            component.sync()
+        except Exception as e:
+            logger.error(f'Metrics stats sync failed: {e}')
+
+class StatsSyncer:
+    """
+    Multiprocess mode: a scrape only reaches one worker, so every worker
+    copies its component stats into the shared metrics every `interval` seconds
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True, name='metrics-stats')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+        sync_stats()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            sync_stats()
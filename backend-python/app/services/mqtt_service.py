@@ -2,51 +2,139 @@
 MQTT Service - handles Mosquitto connection and telemetry ingestion
 """
 import paho.mqtt.client as mqtt
+import os
 import json
+import socket
 import logging
-from datetime import datetime
-from threading import Thread
+from app.services.ingest_buffer import IngestBuffer
+from app.services.ingest_pipeline import IngestPipeline
+from app.services.rollup_service import RollupService
+from app.services.device_state import DeviceStateCache, DeviceStateFollower
+from app.services.live_hub import LiveHub
+from app.serving import live_client_limit
+from app.services.ingest_spool import IngestSpool, SpoolReplayer
+from app.services.telemetry_decoder import decode_readings, coerce_reading, DecodeError
 
 logger = logging.getLogger(__name__)
 
+def prepare_reading(payload):
+    """
+    Validate a decoded telemetry payload and coerce it to the reading schema
+    Returns:
+        The reading, or None if it is invalid
+    """
+    try:
+        return coerce_reading(payload)
+    except DecodeError as e:
+        logger.warning(f'Invalid telemetry payload ({e}): {payload}')
+        return None
+
+def client_id(config, role='backend'):
+    """MQTT client ID, unique per process unless MQTT_CLIENT_ID_UNIQUE is off"""
+    if not config.MQTT_CLIENT_ID_UNIQUE:
+        return config.MQTT_CLIENT_ID
+    return f'{config.MQTT_CLIENT_ID}-{role}-{socket.gethostname()}-{os.getpid()}'
+
+def subscription_topic(config):
+    """Telemetry topic, as a shared subscription when MQTT_SHARED_GROUP is set"""
+    if config.MQTT_SHARED_GROUP:
+        # Broker load-balances each message to one member of the group
+        return f'$share/{config.MQTT_SHARED_GROUP}/{config.MQTT_TOPIC_SUB}'
+    return config.MQTT_TOPIC_SUB
+
+def create_client(config, role='backend'):
+    """paho client for the configured protocol version"""
+    if config.MQTT_PROTOCOL == '5':
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id(config, role), protocol=mqtt.MQTTv5)
+    return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id(config, role))
+
 class MQTTService:
     """MQTT broker connection and message handling"""
     
-    def __init__(self, config, db):
+    def __init__(self, config, db, ingest=True):
         self.config = config
         self.db = db
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, config.MQTT_CLIENT_ID)
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.client.on_disconnect = self.on_disconnect
+        self.ingest = ingest
+        self.topic = subscription_topic(config)
+        # Only the ingesting process talks to the broker; other workers follow device state
+        self.client = None
+        if ingest:
+            self.client = create_client(config)
+            self.client.on_connect = self.on_connect
+            self.client.on_message = self.on_message
+            self.client.on_disconnect = self.on_disconnect
         self.connected = False
+        self.state = DeviceStateCache()
+        self.hub = LiveHub(
+            max_clients=live_client_limit(config),
+            min_interval=config.LIVE_MIN_INTERVAL,
+            heartbeat=config.LIVE_HEARTBEAT
+        )
+        # A shared subscription only delivers this process's share of the fleet
+        # (and non-ingesting processes have none), so live state then follows
+        # what the ingest path stores on device documents instead
+        self.follower = None
+        if config.MQTT_SHARED_GROUP or not ingest:
+            self.follower = DeviceStateFollower(
+                db, self.state, on_update=self.publish_state, interval=config.LIVE_STATE_POLL_INTERVAL
+            )
+        # Disk spool for readings MongoDB cannot take (only the ingesting process owns it)
+        self.spool = IngestSpool.open(config) if ingest else None
+        self.buffer = IngestBuffer(
+            db,
+            max_size=config.INGEST_BUFFER_SIZE,
+            batch_size=config.INGEST_BATCH_SIZE,
+            flush_interval=config.INGEST_FLUSH_INTERVAL,
+            rollups=RollupService(db, config) if config.ROLLUPS_ENABLED else None,
+            spool=self.spool,
+            closed_after=config.READINGS_CLOSED_AFTER
+        )
+        self.replayer = SpoolReplayer(
+            self.spool, self.buffer.write_spooled, batch_size=config.INGEST_SPOOL_REPLAY_BATCH
+        ) if self.spool else None
+        self.pipeline = IngestPipeline(
+            self.handle_payload,
+            workers=config.INGEST_WORKERS,
+            max_size=config.INGEST_QUEUE_SIZE,
+            policy=config.INGEST_QUEUE_POLICY,
+            block_timeout=config.INGEST_QUEUE_BLOCK_TIMEOUT
+        )
     
     def connect(self):
         """Connect to MQTT broker"""
         try:
-            if self.config.MQTT_USERNAME:
-                self.client.username_pw_set(self.config.MQTT_USERNAME, self.config.MQTT_PASSWORD)
-            
-            self.client.connect(self.config.MQTT_HOST, self.config.MQTT_PORT, keepalive=60)
-            self.client.subscribe(self.config.MQTT_TOPIC_SUB)
+            if self.follower:
+                self.follower.start()
             
-            # Start loop in background thread
-            self.client.loop_start()
-            logger.info(f'MQTT client connecting to {self.config.MQTT_HOST}:{self.config.MQTT_PORT}')
+            if self.ingest:
+                if self.config.MQTT_USERNAME:
+                    self.client.username_pw_set(self.config.MQTT_USERNAME, self.config.MQTT_PASSWORD)
+                self.client.connect(self.config.MQTT_HOST, self.config.MQTT_PORT, keepalive=60)
+                self.client.subscribe(self.topic)
+                
+                # Start buffer flusher, ingest workers and network loop in background threads
+                self.buffer.start()
+                self.pipeline.start()
+                if self.replayer:
+                    self.replayer.start()
+                self.client.loop_start()
+                logger.info(f'MQTT client connecting to {self.config.MQTT_HOST}:{self.config.MQTT_PORT}')
+            else:
+                logger.info('MQTT ingest off, following device state from MongoDB')
         except Exception as e:
             logger.error(f'MQTT connection error: {e}')
     
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         """MQTT connection callback"""
         if rc == 0:
             self.connected = True
             logger.info('MQTT broker connected')
-            client.subscribe(self.config.MQTT_TOPIC_SUB)
-            logger.info(f'Subscribed to {self.config.MQTT_TOPIC_SUB}')
+            client.subscribe(self.topic)
+            logger.info(f'Subscribed to {self.topic}')
         else:
             logger.error(f'MQTT connection failed with code {rc}')
     
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, client, userdata, rc, properties=None):
         """MQTT disconnect callback"""
         self.connected = False
         if rc != 0:
@@ -54,55 +142,106 @@ class MQTTService:
         else:
             logger.info('MQTT broker disconnected')
     
+    def observe(self, reading):
+        """Update the latest-reading cache and push changes to live clients"""
+        if self.state.update(reading):
+            self.publish_state(reading['device_id'])
+    
+    def publish_state(self, device_id):
+        """Push a device's cached state to its live clients"""
+        self.hub.publish(device_id, self.state.get(device_id))
+    
     def on_message(self, client, userdata, msg):
-        """MQTT message received callback"""
+        """MQTT message received callback - only enqueues, workers do the rest"""
+        if not self.pipeline.submit(msg.topic, msg.payload):
+            if self.spool and self.spool_payload(msg.topic, msg.payload):
+                return
+            logger.warning(f'Ingest queue full, dropped message on {msg.topic}')
+    
+    def spool_payload(self, topic, raw):
+        """Queue overflow: decode here and write straight to the disk spool"""
+        try:
+            return self.spool.append(decode_readings(topic, raw))
+        except DecodeError as e:
+            logger.error(f'Invalid payload on {topic} ({e}): {raw[:200]}')
+            return True
+        except Exception as e:
+            # Runs on paho's network thread: never let it raise out of on_message
+            logger.error(f'Error spooling message on {topic}: {e}')
+            return False
+    
+    def handle_payload(self, topic, raw):
+        """Decode a raw payload (one reading or a batch) and persist it (runs on an ingest worker)"""
         try:
-            payload = json.loads(msg.payload.decode())
-            self.process_telemetry(payload)
-        except json.JSONDecodeError:
-            logger.error(f'Invalid JSON payload: {msg.payload}')
+            self.store_readings(decode_readings(topic, raw))
+        except DecodeError as e:
+            logger.error(f'Invalid payload on {topic} ({e}): {raw[:200]}')
         except Exception as e:
             logger.error(f'Error processing MQTT message: {e}')
     
     def process_telemetry(self, payload):
         """Process incoming telemetry and save to DB"""
         try:
-            # Validate required fields
-            required_fields = ['device_id', 'timestamp', 'voltage', 'current', 'power_w', 'energy_kwh']
-            if not all(field in payload for field in required_fields):
-                logger.warning(f'Missing required fields in payload: {payload}')
-                return
-            
-            # Ensure timestamp is datetime
-            if isinstance(payload['timestamp'], str):
-                payload['timestamp'] = datetime.fromisoformat(payload['timestamp'].replace('Z', '+00:00'))
-            
-            payload['created_at'] = datetime.utcnow()
-            
-            # Save to MongoDB
-            self.db.meter_readings.insert_one(payload)
-            
-            # Update device last_seen
-            self.db.devices.update_one(
-                {'device_id': payload['device_id']},
-                {'$set': {'last_seen': datetime.utcnow(), 'status': 'online'}},
-                upsert=True
-            )
-            
-            logger.debug(f'Telemetry saved: {payload["device_id"]} @ {payload["timestamp"]}')
-        
+            reading = prepare_reading(payload)
+            if reading is not None:
+                self.store_reading(reading)
         except Exception as e:
             logger.error(f'Error processing telemetry: {e}')
     
+    def store_reading(self, reading):
+        """Buffer a decoded reading for bulk write (device last_seen is coalesced per flush)"""
+        # Latest state is updated before the flush so dashboards see it immediately
+        if not self.follower:
+            self.observe(reading)
+        if not self.buffer.add(reading):
+            logger.warning(f'Ingest buffer full, dropped reading from {reading["device_id"]}')
+            return
+        
+        logger.debug(f'Telemetry buffered: {reading["device_id"]} @ {reading["timestamp"]}')
+    
+    def store_readings(self, readings):
+        """Buffer a decoded batch so it is persisted by one bulk write"""
+        if not readings:
+            return
+        if not self.follower:
+            for reading in readings:
+                self.observe(reading)
+        accepted = self.buffer.add_many(readings)
+        if accepted < len(readings):
+            logger.warning(f'Ingest buffer full, dropped {len(readings) - accepted} readings from {readings[0]["device_id"]}')
+            return
+        
+        logger.debug(f'Telemetry batch buffered: {len(readings)} readings from {readings[0]["device_id"]}')
+    
+    def live_snapshot(self):
+        """SSE hub counters plus where live state comes from"""
+        snapshot = self.hub.snapshot()
+        snapshot['source'] = 'devices' if self.follower else 'mqtt'
+        snapshot['source_connected'] = self.follower.connected if self.follower else self.connected
+        return snapshot
+    
     def disconnect(self):
         """Disconnect from MQTT broker"""
-        self.client.loop_stop()
-        self.client.disconnect()
+        self.hub.close()
+        if self.follower:
+            self.follower.stop()
+        if self.ingest:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.pipeline.stop()
+            self.buffer.stop()
+            if self.replayer:
+                self.replayer.stop()
+            if self.spool:
+                self.spool.close()
         self.connected = False
         logger.info('MQTT client disconnected')
     
     def publish(self, topic, payload):
         """Publish message to MQTT topic"""
+        if self.client is None:
+            logger.warning(f'Not publishing to {topic}: this process has no MQTT connection')
+            return
         try:
             self.client.publish(topic, json.dumps(payload), qos=1)
             logger.debug(f'Published to {topic}')
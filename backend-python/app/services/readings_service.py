@@ -0,0 +1,526 @@
+"""
+Readings Service - telemetry queries and server-side aggregation
+"""
+import io
+import csv
+import json
+import base64
+import heapq
+import logging
+from array import array
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+import numpy as np
+from app.config.config import get_setting
+from app.services.rollup_service import RollupService, ROLLUP_COLLECTIONS
+from app.services.archive import ReadingsArchive, month_bounds
+
+logger = logging.getLogger(__name__)
+
+AGG_UNITS = ('hour', 'day', 'week', 'month')
+
+COLUMNAR_FIELDS = ('voltage', 'current', 'power_w', 'energy_kwh')
+
+EXPORT_FIELDS = ('timestamp', 'voltage', 'current', 'power_w', 'energy_kwh', 'power_factor', 'rssi')
+
+# Downsample from rollup envelopes once a range holds this many times max_points readings
+ENVELOPE_RATIO = 10
+
+EPOCH = datetime(1970, 1, 1)
+
+class ReadingsService:
+    """Queries meter readings for charts and exports"""
+
+    def __init__(self, db, config):
+        self.db = db
+        self.config = config
+        self.rollups = RollupService(db, config)
+        self.archive = ReadingsArchive(db, config)
+
+    def _use_rollups(self):
+        # Rollup buckets only line up with chart buckets in the same timezone
+        return (self.rollups.reads_enabled()
+                and self.rollups.tz_name == get_setting(self.config, 'TIMEZONE', 'UTC'))
+
+    def find_raw(self, device_id, from_dt, to_dt, after=None, limit=None, batch_size=1000):
+        """
+        Cursor over raw readings in (timestamp, _id) order
+        Args:
+            after: (timestamp, ObjectId) keyset position from decode_cursor()
+            limit: Maximum number of readings
+        """
+        query = {
+            'device_id': device_id,
+            'timestamp': {'$gte': from_dt, '$lte': to_dt}
+        }
+        if after:
+            ts, oid = after
+            query['$or'] = [
+                {'timestamp': {'$gt': ts}},
+                {'timestamp': ts, '_id': {'$gt': oid}}
+            ]
+
+        cursor = self.db.meter_readings.find(query).sort([('timestamp', 1), ('_id', 1)]).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+
+        archived = self.archive.months(device_id, from_dt, to_dt)
+        if not archived:
+            return cursor
+
+        # Archived months and late readings still in Mongo, merged in keyset order
+        merged = _dedupe(heapq.merge(
+            self.archive.iter_readings(device_id, from_dt, to_dt, after=after, entries=archived),
+            cursor,
+            key=_reading_key
+        ))
+        return islice(merged, limit) if limit else merged
+
+    def fetch_columns(self, device_id, from_dt, to_dt, fields=COLUMNAR_FIELDS, after=None, limit=None,
+                      with_ids=False, page_size=50000):
+        """
+        Read readings as typed arrays without building a dict per row.
+        Mongo $push-es each page into one document of column arrays;
+        pages follow the (timestamp, _id) keyset so each stays under 16MB.
+        Args:
+            after: (timestamp, ObjectId) keyset position from decode_cursor()
+            limit: Maximum number of readings
+            with_ids: Also return '_id' (list of ObjectId) for building cursors
+        Returns:
+            {'timestamp': array('q') epoch ms, <field>: array('d'), ...}
+        """
+        columns = {'timestamp': array('q')}
+        for field in fields:
+            columns[field] = array('d')
+
+        group = {
+            '_id': None,
+            'n': {'$sum': 1},
+            'last_ts': {'$last': '$timestamp'},
+            'last_id': {'$last': '$_id'},
+            'timestamp': {'$push': {'$toLong': '$timestamp'}}
+        }
+        for field in fields:
+            group[field] = {'$push': {'$toDouble': {'$ifNull': [f'${field}', float('nan')]}}}
+
+        # Readings of archived months can be in both stores while archiving: keep their ids to dedupe
+        archived_months = self.archive.months(device_id, from_dt, to_dt)
+        live_ids = None
+        if with_ids:
+            group['oid'] = {'$push': '$_id'}
+            live_ids = []
+        elif archived_months:
+            until = month_bounds(archived_months[-1]['month'])[1]
+            group['oid'] = {'$push': {'$cond': [{'$lt': ['$timestamp', until]}, '$_id', None]}}
+            live_ids = []
+
+        position = after
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            match = {'device_id': device_id, 'timestamp': {'$gte': from_dt, '$lte': to_dt}}
+            if position:
+                match['$or'] = [
+                    {'timestamp': {'$gt': position[0]}},
+                    {'timestamp': position[0], '_id': {'$gt': position[1]}}
+                ]
+            pages = list(self.db.meter_readings.aggregate([
+                {'$match': match},
+                {'$sort': {'timestamp': 1, '_id': 1}},
+                {'$limit': size},
+                {'$project': {'_id': 1, 'timestamp': 1, **{field: 1 for field in fields}}},
+                {'$group': group}
+            ], allowDiskUse=True))
+            if not pages:
+                break
+
+            page = pages[0]
+            for name, values in columns.items():
+                values.extend(page[name])
+            if live_ids is not None:
+                live_ids.extend(page['oid'])
+            if remaining is not None:
+                remaining -= page['n']
+            if page['n'] < size:
+                break
+            position = (page['last_ts'], page['last_id'])
+
+        archived = None
+        if archived_months:
+            archived = self.archive.columns(
+                device_id, from_dt, to_dt, fields, entries=archived_months, with_ids=True, after=after, limit=limit
+            )
+        if archived is not None:
+            columns = _merge_columns(archived, columns, live_ids, with_ids=with_ids)
+            if limit:
+                columns = {name: values[:limit] for name, values in columns.items()}
+        elif with_ids:
+            columns['_id'] = live_ids
+        return columns
+
+    def fetch_columns_page(self, device_id, from_dt, to_dt, after=None, limit=1000, fields=COLUMNAR_FIELDS):
+        """
+        One keyset page of fetch_columns
+        Returns:
+            (columns, position of the last row as (timestamp, ObjectId) if more follow, else None)
+        """
+        columns = self.fetch_columns(device_id, from_dt, to_dt, fields, after=after, limit=limit + 1, with_ids=True)
+        ids = columns.pop('_id')
+        if len(ids) <= limit:
+            return columns, None
+        columns = {name: values[:limit] for name, values in columns.items()}
+        last = EPOCH + timedelta(milliseconds=columns['timestamp'][-1])
+        return columns, (last, ids[limit - 1])
+
+    def downsample(self, device_id, from_dt, to_dt, max_points, field='power_w', fields=COLUMNAR_FIELDS):
+        """
+        Columns reduced to at most `max_points` rows for charting.
+        Points are picked by Largest-Triangle-Three-Buckets on `field`,
+        so peaks and dips survive; other fields are taken from the same rows.
+        Ranges holding far more readings than that are drawn from the
+        rollups instead (see rollup_envelope), without reading raw rows.
+        Returns:
+            (columns as from fetch_columns, number of readings in the range)
+        """
+        if self.rollups.reads_enabled():
+            envelope = self.rollup_envelope(device_id, from_dt, to_dt, max_points, fields)
+            if envelope is not None:
+                return envelope
+
+        columns = self.fetch_columns(device_id, from_dt, to_dt, fields)
+        total = len(columns['timestamp'])
+        if total <= max_points:
+            return columns, total
+        return _take(columns, _lttb_keep(columns, field, max_points)), total
+
+    def rollup_envelope(self, device_id, from_dt, to_dt, max_points, fields=COLUMNAR_FIELDS):
+        """
+        Min/max envelope from the hourly (or, for long ranges, daily) rollups.
+        Rollups do not keep when in a bucket its minimum or maximum occurred,
+        so each bucket gives a min row and a max row at one shared position
+        (the middle of its readings): the chart draws a vertical min-max bar
+        per bucket instead of inventing a slope between them. Adjacent buckets
+        are merged (min of minima, max of maxima) to stay within `max_points`.
+        Returns:
+            (columns, number of readings in the range), or None when the range
+            holds under ENVELOPE_RATIO x max_points readings and raw LTTB is cheap
+        """
+        hours = (to_dt - from_dt).total_seconds() / 3600
+        unit = 'hour' if 2 * hours <= ENVELOPE_RATIO * max_points else 'day'
+        buckets = list(self.db[ROLLUP_COLLECTIONS[unit]].find(
+            {'device_id': device_id, 'bucket': {'$gte': self.rollups.truncate(from_dt, unit), '$lte': to_dt}},
+            {'_id': 0, 'samples': 1, 'ts_min': 1, 'ts_max': 1,
+             **{f'{name}_{s}': 1 for name in fields for s in ('min', 'max')}}
+        ).sort('bucket', 1))
+        buckets = [b for b in buckets if b.get('samples') and b.get('ts_min') and b.get('ts_max')]
+        total = sum(b['samples'] for b in buckets)
+        if total <= ENVELOPE_RATIO * max_points:
+            return None
+
+        def column(key, convert=float):
+            return np.array([np.nan if b.get(key) is None else convert(b[key]) for b in buckets], dtype=np.float64)
+
+        def millis(ts):
+            return (ts - EPOCH) // timedelta(milliseconds=1)
+
+        first, last = column('ts_min', millis), column('ts_max', millis)
+        lows = {name: column(f'{name}_min') for name in fields}
+        highs = {name: column(f'{name}_max') for name in fields}
+
+        # Merge runs of adjacent buckets so two rows per group fit max_points
+        groups = max(max_points // 2, 1)
+        if len(buckets) > groups:
+            starts = np.flatnonzero(np.diff(np.arange(len(buckets)) * groups // len(buckets), prepend=-1))
+            ends = np.append(starts[1:], len(buckets)) - 1
+            first, last = first[starts], last[ends]
+            lows = {name: np.fmin.reduceat(values, starts) for name, values in lows.items()}
+            highs = {name: np.fmax.reduceat(values, starts) for name, values in highs.items()}
+
+        start, end = millis(_naive_utc(from_dt)), millis(_naive_utc(to_dt))
+        position = np.clip((first + last) // 2, start, end).astype(np.int64)
+        columns = {'timestamp': array('q', np.repeat(position, 2).tobytes())}
+        for name in fields:
+            # Rows alternate min, max at the same position
+            values = np.column_stack([lows[name], highs[name]]).ravel()
+            columns[name] = array('d', values.tobytes())
+        return columns, total
+
+    def aggregate(self, device_id, from_dt, to_dt, unit):
+        """
+        Bucket readings by time unit
+        Args:
+            device_id: Meter device ID
+            from_dt, to_dt: Inclusive datetime range
+            unit: One of AGG_UNITS
+        Returns:
+            List of buckets sorted by time, with power/voltage/current stats
+            and the energy consumed in each bucket
+        """
+        if unit not in AGG_UNITS:
+            raise ValueError(f'Unsupported aggregation: {unit}')
+
+        if self._use_rollups():
+            return self._finalize(self.rollups.aggregate(device_id, from_dt, to_dt, unit))
+
+        bucket = {'date': '$timestamp', 'unit': unit, 'timezone': get_setting(self.config, 'TIMEZONE', 'UTC')}
+        if unit == 'week':
+            bucket['startOfWeek'] = 'monday'
+
+        pipeline = [
+            {'$match': {
+                'device_id': device_id,
+                'timestamp': {'$gte': from_dt, '$lte': to_dt}
+            }},
+            {'$sort': {'timestamp': 1}},
+            {'$group': {
+                '_id': {'$dateTrunc': bucket},
+                'samples': {'$sum': 1},
+                'power_w': {'$avg': '$power_w'},
+                'power_w_min': {'$min': '$power_w'},
+                'power_w_max': {'$max': '$power_w'},
+                'voltage': {'$avg': '$voltage'},
+                'voltage_min': {'$min': '$voltage'},
+                'voltage_max': {'$max': '$voltage'},
+                'current': {'$avg': '$current'},
+                'current_max': {'$max': '$current'},
+                'energy_first': {'$first': '$energy_kwh'},
+                'energy_last': {'$last': '$energy_kwh'},
+                'ts_first': {'$first': '$timestamp'},
+                'ts_last': {'$last': '$timestamp'}
+            }},
+            {'$sort': {'_id': 1}}
+        ]
+
+        buckets = list(self.db.meter_readings.aggregate(pipeline, allowDiskUse=True))
+
+        archived = self.archive.months(device_id, from_dt, to_dt)
+        if archived:
+            buckets = _merge_buckets(buckets, self.archive.aggregate(
+                device_id, from_dt, to_dt, unit, get_setting(self.config, 'TIMEZONE', 'UTC'), entries=archived
+            ))
+        return self._finalize(buckets)
+
+    def _finalize(self, buckets):
+        """Shape buckets and compute per-bucket energy deltas"""
+        results = []
+        for i, b in enumerate(buckets):
+            # Measure to the start of the next bucket so no energy falls between buckets
+            if i + 1 < len(buckets) and buckets[i + 1].get('energy_first') is not None:
+                end_energy = buckets[i + 1]['energy_first']
+            else:
+                end_energy = b.get('energy_last')
+
+            start_energy = b.get('energy_first')
+            if start_energy is None or end_energy is None:
+                energy = 0
+            else:
+                energy = max(end_energy - start_energy, 0)
+
+            results.append({
+                'timestamp': b['_id'].isoformat(),
+                'samples': b['samples'],
+                'power_w': _round(b.get('power_w')),
+                'power_w_min': _round(b.get('power_w_min')),
+                'power_w_max': _round(b.get('power_w_max')),
+                'voltage': _round(b.get('voltage')),
+                'voltage_min': _round(b.get('voltage_min')),
+                'voltage_max': _round(b.get('voltage_max')),
+                'current': _round(b.get('current'), 3),
+                'current_max': _round(b.get('current_max'), 3),
+                'energy_kwh': round(energy, 3)
+            })
+        return results
+
+def lttb_indices(x, y, threshold):
+    """
+    Row indices kept by Largest-Triangle-Three-Buckets.
+    The first and last points are always kept; the rest are split into
+    threshold - 2 buckets, and each bucket keeps the point forming the
+    largest triangle with the point kept before it and the mean of the
+    next bucket. Bucket means come from cumulative sums and each bucket
+    is scored in one NumPy pass, so the Python loop runs once per output point.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64) - float(x[0])  # epoch ms: keep the areas small
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Mean of the bucket after each one; the last bucket looks at the final point
+    next_starts = np.append(starts[1:], n - 1)
+    next_ends = np.append(ends[1:], n)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    counts = next_ends - next_starts
+    avg_x = (cx[next_ends] - cx[next_starts]) / counts
+    avg_y = (cy[next_ends] - cy[next_starts]) / counts
+
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        s, e = starts[i], ends[i]
+        area = np.abs((x[a] - avg_x[i]) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (avg_y[i] - y[a]))
+        a = s + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+def _lttb_keep(columns, field, max_points):
+    ts = np.frombuffer(columns['timestamp'], dtype=np.int64)
+    return lttb_indices(ts, np.frombuffer(columns[field], dtype=np.float64), max_points)
+
+def _take(columns, keep):
+    """Rows `keep` of typed-array columns"""
+    return {
+        name: array(values.typecode, np.frombuffer(values, dtype=np.int64 if values.typecode == 'q' else np.float64)[keep].tobytes())
+        for name, values in columns.items()
+    }
+
+def columns_to_readings(columns):
+    """Column arrays back to JSON reading dicts (timestamp as ISO, missing values as None)"""
+    names = [name for name in columns if name != 'timestamp']
+    readings = []
+    for i, ms in enumerate(columns['timestamp']):
+        reading = {'timestamp': datetime.utcfromtimestamp(ms / 1000).isoformat()}
+        for name in names:
+            value = columns[name][i]
+            reading[name] = None if value != value else value
+        readings.append(reading)
+    return readings
+
+def _naive_utc(dt):
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _reading_key(reading):
+    return reading['timestamp'], reading['_id']
+
+def _dedupe(readings):
+    # A month being archived is briefly in both stores
+    last = None
+    for reading in readings:
+        key = _reading_key(reading)
+        if key != last:
+            yield reading
+        last = key
+
+def _merge_columns(archived, live, live_ids=None, with_ids=False):
+    """
+    Combine archive (NumPy) and Mongo (typed array) columns in timestamp order.
+    Mongo rows whose (timestamp, _id) is also archived are dropped; `live_ids`
+    holds each live row's ObjectId (None outside archived months). With
+    `with_ids` rows are ordered by (timestamp, _id) and '_id' is returned too.
+    """
+    live_ts = np.array(live['timestamp'], dtype=np.int64)
+    keep = None
+    if live_ids is not None and '_id' in archived:
+        # Only rows sharing a timestamp with the archive can be copies
+        candidates = np.flatnonzero(np.isin(live_ts, archived['timestamp']))
+        if len(candidates):
+            shared = np.isin(archived['timestamp'], live_ts[candidates])
+            archived_keys = set(zip(archived['timestamp'][shared].tolist(), archived['_id'][shared].tolist()))
+            copies = [i for i in candidates if (int(live_ts[i]), str(live_ids[i])) in archived_keys]
+            if copies:
+                keep = np.ones(len(live_ts), dtype=bool)
+                keep[copies] = False
+                live_ts = live_ts[keep]
+
+    ids = None
+    order = None
+    if with_ids:
+        live_hex = [str(oid) for i, oid in enumerate(live_ids) if keep is None or keep[i]]
+        ids = np.concatenate([archived['_id'].astype(str), np.array(live_hex, dtype=str)])
+        order = np.lexsort((ids, np.concatenate([archived['timestamp'], live_ts])))
+    elif len(archived['timestamp']) and len(live_ts) and archived['timestamp'][-1] > live_ts[0]:
+        # Late readings for an archived month interleave with the archive
+        order = np.argsort(np.concatenate([archived['timestamp'], live_ts]), kind='stable')
+
+    merged = {}
+    for name, values in live.items():
+        dtype = np.int64 if values.typecode == 'q' else np.float64
+        column = np.array(values, dtype=dtype)
+        if keep is not None:
+            column = column[keep]
+        combined = np.concatenate([archived[name].astype(dtype), column])
+        if order is not None:
+            combined = combined[order]
+        merged[name] = array(values.typecode, combined.tobytes())
+    if with_ids:
+        merged['_id'] = [ObjectId(oid) for oid in ids[order]]
+    return merged
+
+def _merge_buckets(live, archived):
+    """Combine raw buckets from Mongo and the archive that may share a bucket"""
+    by_start = {b['_id']: b for b in archived}
+    for b in live:
+        other = by_start.get(b['_id'])
+        if other is None:
+            by_start[b['_id']] = b
+            continue
+        n1, n2 = other['samples'], b['samples']
+        merged = {'_id': b['_id'], 'samples': n1 + n2}
+        for field in ('power_w', 'voltage', 'current'):
+            values = [(v, n) for v, n in ((other.get(field), n1), (b.get(field), n2)) if v is not None]
+            merged[field] = sum(v * n for v, n in values) / sum(n for _, n in values) if values else None
+        for field in ('power_w_min', 'voltage_min'):
+            merged[field] = min((v for v in (other.get(field), b.get(field)) if v is not None), default=None)
+        for field in ('power_w_max', 'voltage_max', 'current_max'):
+            merged[field] = max((v for v in (other.get(field), b.get(field)) if v is not None), default=None)
+        earliest = other if other['ts_first'] <= b['ts_first'] else b
+        latest = other if other['ts_last'] >= b['ts_last'] else b
+        merged['ts_first'], merged['energy_first'] = earliest['ts_first'], earliest['energy_first']
+        merged['ts_last'], merged['energy_last'] = latest['ts_last'], latest['energy_last']
+        by_start[b['_id']] = merged
+    return [by_start[k] for k in sorted(by_start)]
+
+def encode_cursor(reading):
+    """Opaque pagination token for the position after `reading`"""
+    raw = f"{reading['timestamp'].isoformat()}|{reading['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(token):
+    """Parse a token from encode_cursor() into (timestamp, ObjectId)"""
+    try:
+        ts, oid = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(ts), ObjectId(oid)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def serialize_reading(reading):
+    """Make a reading JSON-safe (ObjectId and timestamp as strings)"""
+    reading['_id'] = str(reading['_id'])
+    if isinstance(reading.get('timestamp'), datetime):
+        reading['timestamp'] = reading['timestamp'].isoformat()
+    return reading
+
+def iter_ndjson(cursor):
+    """Yield one JSON document per line as the cursor advances"""
+    for reading in cursor:
+        yield json.dumps(serialize_reading(reading), default=_json_default) + '\n'
+
+def iter_csv(cursor):
+    """Yield CSV rows as the cursor advances"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
+    for reading in cursor:
+        serialize_reading(reading)
+        writer.writerow([reading.get(field, '') for field in EXPORT_FIELDS])
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
@@ -0,0 +1,131 @@
+"""
+Response Cache - ETags, version stamps and an LRU of rendered responses
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    LRU of rendered response bodies, bounded by entry count and total bytes.
+    Entries carry their ETag and tags; a hit is only served while the
+    caller's current ETag still matches, and invalidate(tag) drops early.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (etag, body, mimetype, tags)
+        self._bytes = 0
+        self._lock = Lock()
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get(self, key, etag=None):
+        """(body, mimetype) if cached under a matching ETag, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (etag is not None and entry[0] != etag):
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, etag, body, mimetype, tags=()):
+        if len(body) > self.max_bytes // 4:
+            return  # a single huge range would evict everything else
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= len(old[1])
+            self._entries[key] = (etag, body, mimetype, frozenset(tags))
+            self._bytes += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1])
+                self.stats['evictions'] += 1
+
+    def invalidate(self, tag=None):
+        """Drop entries carrying `tag` (all entries if None)"""
+        with self._lock:
+            if tag is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                keys = [k for k, entry in self._entries.items() if tag in entry[3]]
+                for key in keys:
+                    self._bytes -= len(self._entries.pop(key)[1])
+                dropped = len(keys)
+            self.stats['invalidations'] += dropped
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes)
+
+def make_etag(*parts):
+    """Strong ETag value (unquoted) from version parts"""
+    raw = '|'.join(p.isoformat() if isinstance(p, datetime) else str(p) for p in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def cache_version(db, key):
+    """Current version stamp of a cached resource (0 if never bumped)"""
+    doc = db.cache_versions.find_one({'_id': key}, {'version': 1})
+    return doc['version'] if doc else 0
+
+def version_bump(key):
+    """UpdateOne bumping a version stamp, for batching into one bulk_write"""
+    return UpdateOne(
+        {'_id': key},
+        {'$inc': {'version': 1}, '$set': {'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+def bump_cache_version(db, key):
+    """Mark a resource as changed, for every process serving it"""
+    bump_cache_versions(db, [key])
+
+def bump_cache_versions(db, keys):
+    """bump_cache_version for several resources in one round trip"""
+    keys = sorted(keys)
+    if not keys:
+        return
+    db.cache_versions.bulk_write([version_bump(key) for key in keys], ordered=False)
+    for key in keys:
+        response_cache.invalidate(key)
+
+def invoices_key(device_id):
+    return f'invoices:{device_id}'
+
+def readings_key(device_id):
+    return f'readings:{device_id}'
+
+def late_readings_keys(readings, closed_after, now=None):
+    """
+    readings_key of every device with a reading older than `closed_after`
+    seconds - a write into a range already served as closed
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=closed_after)
+    keys = set()
+    for reading in readings:
+        ts = reading.get('timestamp')
+        if not isinstance(ts, datetime):
+            continue
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        if ts <= cutoff:
+            keys.add(readings_key(reading['device_id']))
+    return keys
+
+response_cache = ResponseCache()
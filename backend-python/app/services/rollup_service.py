@@ -0,0 +1,244 @@
+"""
+Rollup Service - hourly/daily reading summaries maintained at ingest time
+"""
+import logging
+from datetime import datetime, timedelta
+import pytz
+from pymongo import UpdateOne
+from app.config.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTIONS = {
+    'hour': 'readings_hourly',
+    'day': 'readings_daily'
+}
+
+# Metrics summarised per bucket as <field>_sum/_min/_max
+ROLLUP_FIELDS = ('voltage', 'current', 'power_w')
+
+class RollupService:
+    """
+    Maintains and queries pre-aggregated reading buckets.
+    energy_kwh is a cumulative register, so the first/last value of a
+    bucket is its $min/$max.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.config = config
+        self.tz_name = get_setting(config, 'ROLLUP_TIMEZONE', 'UTC')
+        self.tz = pytz.timezone(self.tz_name)
+
+    def truncate(self, ts, unit):
+        """Start of the hour/day bucket containing ts, as naive UTC"""
+        local = _as_utc(ts).astimezone(self.tz)
+        if unit == 'hour':
+            local = local.replace(minute=0, second=0, microsecond=0)
+        else:
+            local = self.tz.localize(datetime(local.year, local.month, local.day))
+        return local.astimezone(pytz.UTC).replace(tzinfo=None)
+
+    def build_updates(self, readings):
+        """
+        Coalesce a batch of readings into one upsert per (device, bucket)
+        Returns:
+            {collection_name: [UpdateOne, ...]}
+        """
+        updates = {}
+        for unit, collection in ROLLUP_COLLECTIONS.items():
+            buckets = {}
+            for r in readings:
+                ts = _as_utc(r['timestamp']).replace(tzinfo=None)
+                key = (r['device_id'], self.truncate(ts, unit))
+                b = buckets.get(key)
+                if b is None:
+                    b = buckets[key] = {'inc': {'samples': 0}, 'min': {}, 'max': {}}
+                b['inc']['samples'] += 1
+                _fold(b, 'energy_kwh', r.get('energy_kwh'), sum_=False)
+                _fold(b, 'ts', ts, sum_=False)
+                for field in ROLLUP_FIELDS:
+                    _fold(b, field, r.get(field))
+
+            now = datetime.utcnow()
+            updates[collection] = [
+                UpdateOne(
+                    {'device_id': device_id, 'bucket': bucket},
+                    {
+                        '$inc': b['inc'],
+                        '$min': _rename(b['min'], 'min'),
+                        '$max': _rename(b['max'], 'max'),
+                        '$set': {'updated_at': now}
+                    },
+                    upsert=True
+                )
+                for (device_id, bucket), b in buckets.items()
+            ]
+        return updates
+
+    def apply(self, readings):
+        """Fold a batch of persisted readings into the rollup collections"""
+        if not readings:
+            return
+        for collection, ops in self.build_updates(readings).items():
+            if ops:
+                self.db[collection].bulk_write(ops, ordered=False)
+
+    def backfill(self, device_id=None, from_dt=None, to_dt=None):
+        """
+        Rebuild rollups from raw meter_readings
+        The range is widened to whole days so no bucket is left partial.
+        Returns:
+            Number of devices processed
+        """
+        match = {}
+        if from_dt or to_dt:
+            match['timestamp'] = {}
+            if from_dt:
+                match['timestamp']['$gte'] = self.truncate(from_dt, 'day')
+            if to_dt:
+                match['timestamp']['$lt'] = self.truncate(to_dt, 'day') + timedelta(days=1)
+
+        device_ids = [device_id] if device_id else self.db.meter_readings.distinct('device_id')
+        for dev in device_ids:
+            for unit, collection in ROLLUP_COLLECTIONS.items():
+                self.db.meter_readings.aggregate([
+                    {'$match': dict(match, device_id=dev)},
+                    {'$group': self._group_stage(unit)},
+                    {'$project': {
+                        '_id': 0,
+                        'device_id': '$_id.device_id',
+                        'bucket': '$_id.bucket',
+                        'samples': 1,
+                        'energy_kwh_min': 1, 'energy_kwh_max': 1,
+                        'ts_min': 1, 'ts_max': 1,
+                        **{f'{f}_{s}': 1 for f in ROLLUP_FIELDS for s in ('sum', 'min', 'max')},
+                        'updated_at': '$$NOW'
+                    }},
+                    {'$merge': {
+                        'into': collection,
+                        'on': ['device_id', 'bucket'],
+                        'whenMatched': 'replace',
+                        'whenNotMatched': 'insert'
+                    }}
+                ], allowDiskUse=True)
+            logger.info(f'Rollups rebuilt for {dev}')
+        return len(device_ids)
+
+    def _group_stage(self, unit):
+        group = {
+            '_id': {
+                'device_id': '$device_id',
+                'bucket': {'$dateTrunc': {'date': '$timestamp', 'unit': unit, 'timezone': self.tz_name}}
+            },
+            'samples': {'$sum': 1},
+            'energy_kwh_min': {'$min': '$energy_kwh'},
+            'energy_kwh_max': {'$max': '$energy_kwh'},
+            'ts_min': {'$min': '$timestamp'},
+            'ts_max': {'$max': '$timestamp'}
+        }
+        for field in ROLLUP_FIELDS:
+            group[f'{field}_sum'] = {'$sum': f'${field}'}
+            group[f'{field}_min'] = {'$min': f'${field}'}
+            group[f'{field}_max'] = {'$max': f'${field}'}
+        return group
+
+    def reads_enabled(self):
+        """Rollups are only trusted for reads once they have been backfilled"""
+        return bool(get_setting(self.config, 'ROLLUP_READS', False))
+
+    def aggregate(self, device_id, from_dt, to_dt, unit):
+        """
+        Re-bucket the coarsest rollup that fits `unit` into chart buckets.
+        Returns groups shaped like ReadingsService's raw pipeline output.
+        """
+        source = 'hour' if unit == 'hour' else 'day'
+        bucket = {'date': '$bucket', 'unit': unit, 'timezone': self.tz_name}
+        if unit == 'week':
+            bucket['startOfWeek'] = 'monday'
+
+        group = {
+            '_id': {'$dateTrunc': bucket},
+            'samples': {'$sum': '$samples'},
+            'energy_first': {'$min': '$energy_kwh_min'},
+            'energy_last': {'$max': '$energy_kwh_max'},
+            'voltage_min': {'$min': '$voltage_min'},
+            'voltage_max': {'$max': '$voltage_max'},
+            'current_max': {'$max': '$current_max'},
+            'power_w_min': {'$min': '$power_w_min'},
+            'power_w_max': {'$max': '$power_w_max'}
+        }
+        for field in ROLLUP_FIELDS:
+            group[f'{field}_sum'] = {'$sum': f'${field}_sum'}
+
+        return list(self.db[ROLLUP_COLLECTIONS[source]].aggregate([
+            {'$match': {
+                'device_id': device_id,
+                'bucket': {'$gte': self.truncate(from_dt, source), '$lte': to_dt}
+            }},
+            {'$group': group},
+            {'$addFields': {
+                field: {'$divide': [f'${field}_sum', '$samples']} for field in ROLLUP_FIELDS
+            }},
+            {'$sort': {'_id': 1}}
+        ]))
+
+    def energy_between(self, device_id, start, end):
+        """
+        First and last energy register in [start, end) from daily rollups
+        Returns:
+            (first_kwh, last_kwh) or None if there is no data
+        """
+        result = list(self.db[ROLLUP_COLLECTIONS['day']].aggregate([
+            {'$match': {'device_id': device_id, 'bucket': {'$gte': start, '$lt': end}}},
+            {'$group': {
+                '_id': None,
+                'first': {'$min': '$energy_kwh_min'},
+                'last': {'$max': '$energy_kwh_max'}
+            }}
+        ]))
+        if not result or result[0]['first'] is None:
+            return None
+        return result[0]['first'], result[0]['last']
+
+    def energy_by_device(self, start, end, device_ids=None):
+        """
+        First and last energy register in [start, end) per device
+        Returns:
+            {device_id: (first_kwh, last_kwh)}
+        """
+        match = {'bucket': {'$gte': start, '$lt': end}}
+        if device_ids is not None:
+            match['device_id'] = {'$in': list(device_ids)}
+        return {
+            doc['_id']: (doc['first'], doc['last'])
+            for doc in self.db[ROLLUP_COLLECTIONS['day']].aggregate([
+                {'$match': match},
+                {'$group': {
+                    '_id': '$device_id',
+                    'first': {'$min': '$energy_kwh_min'},
+                    'last': {'$max': '$energy_kwh_max'}
+                }}
+            ], allowDiskUse=True)
+            if doc['first'] is not None
+        }
+
+def _as_utc(ts):
+    if ts.tzinfo is None:
+        return pytz.UTC.localize(ts)
+    return ts.astimezone(pytz.UTC)
+
+def _fold(bucket, field, value, sum_=True):
+    if value is None:
+        return
+    if sum_:
+        bucket['inc'][f'{field}_sum'] = bucket['inc'].get(f'{field}_sum', 0) + value
+    current = bucket['min'].get(field)
+    if current is None or value < current:
+        bucket['min'][field] = value
+    current = bucket['max'].get(field)
+    if current is None or value > current:
+        bucket['max'][field] = value
+
+def _rename(values, suffix):
+    return {f'{field}_{suffix}': value for field, value in values.items()}
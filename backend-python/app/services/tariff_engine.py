@@ -0,0 +1,143 @@
+"""
+Tariff Engine - compiled slab tables and an in-process tariff cache
+"""
+import logging
+import time
+from threading import Lock
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARIFF = 'default'
+
+class CompiledTariff:
+    """
+    A tariff document compiled into numeric slab arrays.
+    Slab widths follow compute_bill's original rule (end - start, the
+    open-ended '+' slab takes the rest), so bills are unchanged.
+    """
+
+    def __init__(self, doc):
+        self.name = doc.get('name', DEFAULT_TARIFF)
+        self.version = tariff_version(doc)
+        self.labels = [slab['range'] for slab in doc.get('slabs', [])]
+        self.rates = np.array([float(slab['rate']) for slab in doc.get('slabs', [])], dtype=np.float64)
+
+        widths = []
+        for label in self.labels:
+            if '+' in label:
+                widths.append(np.inf)
+            else:
+                start, end = map(int, label.split('-'))
+                widths.append(end - start)
+        self.widths = np.array(widths, dtype=np.float64)
+        # Slabs after an open-ended one get an infinite lower bound and stay empty
+        self.lower = np.concatenate(([0.0], np.cumsum(self.widths)[:-1]))
+
+        self.fixed_charge = doc.get('fixed_charge', 0)
+        self.tax_rate = doc.get('tax_rate', 0)
+        self.minimum_bill = doc.get('minimum_bill', self.fixed_charge)
+        self.currency = doc.get('currency', 'INR')
+
+    def slab_units(self, energy):
+        """
+        Units falling in each slab
+        Args:
+            energy: Array of consumption values (kWh), shape (n,)
+        Returns:
+            Array of shape (n, slabs)
+        """
+        energy = np.maximum(np.asarray(energy, dtype=np.float64), 0)
+        return np.clip(energy[:, None] - self.lower[None, :], 0, self.widths[None, :])
+
+    def price(self, energy):
+        """
+        Vectorised charges for many consumption values
+        Returns:
+            (units per slab, subtotal, tax, total) arrays
+        """
+        units = self.slab_units(energy)
+        subtotal = units @ self.rates
+        tax = (subtotal + self.fixed_charge) * self.tax_rate
+        total = np.maximum(subtotal + self.fixed_charge + tax, self.minimum_bill)
+        return units, subtotal, tax, total
+
+    def breakdown(self, units_row):
+        """Slab breakdown for one consumption value"""
+        return [
+            {
+                'slab': label,
+                'units': round(float(units), 2),
+                'rate': rate,
+                'charge': round(float(units) * rate, 2)
+            }
+            for label, units, rate in zip(self.labels, units_row, self.rates.tolist())
+            if units > 0
+        ]
+
+class TariffCache:
+    """
+    Compiled tariffs per (database, name). update_tariffs invalidates
+    this process directly; other processes notice the version stamp
+    changed when they re-check it after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._entries = {}  # (db name, tariff name) -> (checked_at, doc, CompiledTariff)
+        self._lock = Lock()
+
+    def get(self, db, name=DEFAULT_TARIFF):
+        """Compiled tariff, or None if it does not exist"""
+        entry = self._load(db, name)
+        return entry[2] if entry else None
+
+    def get_document(self, db, name=DEFAULT_TARIFF):
+        """Tariff document without _id, or None"""
+        entry = self._load(db, name)
+        return dict(entry[1]) if entry else None
+
+    def invalidate(self, db=None, name=None):
+        """Drop cached tariffs (all, or one database/name)"""
+        with self._lock:
+            if db is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if key[0] == db.name and (name is None or key[1] == name):
+                    del self._entries[key]
+
+    def _load(self, db, name):
+        key = (db.name, name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and now - entry[0] < self.ttl:
+            return entry
+
+        if entry:
+            # Cheap version check before re-reading and recompiling
+            stamp = db.tariffs.find_one({'name': name}, {'_id': 0, 'version': 1, 'updated_at': 1, 'created_at': 1})
+            if stamp and tariff_version(stamp) == entry[2].version:
+                entry = (now, entry[1], entry[2])
+                with self._lock:
+                    self._entries[key] = entry
+                return entry
+
+        doc = db.tariffs.find_one({'name': name}, {'_id': 0})
+        if not doc:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+
+        entry = (now, doc, CompiledTariff(doc))
+        with self._lock:
+            self._entries[key] = entry
+        logger.debug(f'Tariff compiled: {name} v{entry[2].version}')
+        return entry
+
+def tariff_version(doc):
+    """Version stamp of a tariff document"""
+    return (doc.get('version', 0), doc.get('updated_at') or doc.get('created_at'))
+
+tariff_cache = TariffCache()
@@ -0,0 +1,356 @@
+"""
+Telemetry Decoder - payload parsing and schema coercion for meter readings
+"""
+import json
+import math
+import struct
+import logging
+from itertools import accumulate
+from datetime import datetime, timedelta, timezone
+
+try:
+    import orjson
+except ImportError:  # optional dependency, falls back to json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ('device_id', 'timestamp', 'voltage', 'current', 'power_w', 'energy_kwh')
+
+# Compact binary reading (little-endian, 30 bytes), device_id taken from the topic:
+#   B version=1 | I epoch seconds | f voltage | f current | f power_w
+#   d energy_kwh | f power_factor | b rssi
+COMPACT_VERSION = 1
+COMPACT_FORMAT = struct.Struct('<BIfffdfb')
+
+# Compact batch: header, then `count` records (29 bytes each), device_id from the topic:
+#   header: B version=2 | I base epoch seconds | H count
+#   record: I milliseconds after base | f voltage | f current | f power_w
+#           d energy_kwh | f power_factor | b rssi
+COMPACT_BATCH_VERSION = 2
+COMPACT_BATCH_HEADER = struct.Struct('<BIH')
+COMPACT_BATCH_RECORD = struct.Struct('<Ifffdfb')
+
+# Readings accepted in one batch payload (a device catching up after an outage
+# splits its backlog into several payloads)
+MAX_BATCH_READINGS = 5000
+
+# Latest reading in a batch, relative to its base timestamp (the compact
+# batch's uint32 millisecond offsets reach about 49 days)
+MAX_BATCH_SPAN_MS = 2 ** 32 - 1
+
+# Columnar JSON batch: per-field arrays plus a base timestamp and deltas
+BATCH_COLUMNS = ('voltage', 'current', 'power_w', 'energy_kwh', 'power_factor', 'rssi')
+
+class DecodeError(ValueError):
+    """Payload could not be decoded into a reading"""
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, bool):
+        raise TypeError('boolean is not a timestamp')
+    if isinstance(value, (int, float)):
+        # Epoch seconds, or milliseconds from devices that send them
+        if value > 1e11:
+            value = value / 1000
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _number(value):
+    """float() that refuses booleans, NaN and infinities (json and float("nan") accept them)"""
+    if isinstance(value, bool):
+        raise TypeError('boolean is not a number')
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f'{value} is not a finite number')
+    return value
+
+def _integer(value):
+    if isinstance(value, bool):
+        raise TypeError('boolean is not a number')
+    return int(value)
+
+def _optional(cast):
+    def coerce(value):
+        return None if value is None else cast(value)
+    return coerce
+
+# Field -> coercion, derived from METER_READING_SCHEMA (unknown keys are dropped)
+READING_COERCIONS = (
+    ('device_id', str),
+    ('timestamp', _parse_timestamp),
+    ('voltage', _number),
+    ('current', _number),
+    ('power_w', _number),
+    ('energy_kwh', _number),
+    ('power_factor', _optional(_number)),
+    ('rssi', _optional(_integer)),
+)
+
+def coerce_reading(payload):
+    """
+    Coerce a decoded payload to the meter reading schema
+    Returns:
+        New reading dict with only schema fields
+    Raises:
+        DecodeError if a required field is missing or has the wrong type
+    """
+    reading = {}
+    try:
+        for field, cast in READING_COERCIONS:
+            value = payload.get(field)
+            if value is None:
+                if field in REQUIRED_FIELDS:
+                    raise DecodeError(f'missing field {field}')
+                continue
+            reading[field] = cast(value)
+    except DecodeError:
+        raise
+    except (TypeError, ValueError, AttributeError, OverflowError, OSError) as e:
+        # fromtimestamp raises OverflowError/OSError for out-of-range epochs
+        raise DecodeError(f'bad field {field}: {e}')
+
+    reading['created_at'] = datetime.utcnow()
+    return reading
+
+def loads_json(raw):
+    """Parse JSON bytes with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def device_from_topic(topic):
+    """'smartmeter/<device_id>/telemetry' -> device_id"""
+    parts = topic.split('/')
+    return parts[1] if len(parts) >= 3 else None
+
+def decode_json(topic, raw):
+    try:
+        payload = loads_json(raw)
+    except ValueError as e:
+        raise DecodeError(f'invalid JSON: {e}')
+    if not isinstance(payload, dict):
+        raise DecodeError('JSON payload is not an object')
+    return coerce_reading(payload)
+
+def decode_json_readings(topic, raw):
+    """
+    JSON telemetry as a list of readings. Accepts a single reading object,
+    an array of reading objects, {"device_id", "readings": [...]}, or the
+    columnar form {"device_id", "t0", "dt": [...], "voltage": [...], ...}
+    where dt holds milliseconds since the previous sample (the first since t0).
+    """
+    try:
+        payload = loads_json(raw)
+    except ValueError as e:
+        raise DecodeError(f'invalid JSON: {e}')
+
+    if isinstance(payload, dict):
+        if 't0' in payload:
+            return _columnar_readings(topic, payload)
+        if 'readings' not in payload:
+            return [coerce_reading(payload)]
+        items, device_id = payload['readings'], payload.get('device_id')
+    else:
+        items, device_id = payload, None
+    if not isinstance(items, list):
+        raise DecodeError('batch readings must be an array')
+    _check_batch_size(len(items))
+
+    device_id = device_id or device_from_topic(topic)
+    readings = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise DecodeError('batch item is not an object')
+        if device_id and 'device_id' not in item:
+            item['device_id'] = device_id
+        readings.append(coerce_reading(item))
+    return readings
+
+def _columnar_readings(topic, payload):
+    device_id = payload.get('device_id') or device_from_topic(topic)
+    deltas = payload.get('dt')
+    if not device_id:
+        raise DecodeError(f'no device_id in batch or topic {topic}')
+    if not isinstance(deltas, list):
+        raise DecodeError('columnar batch needs a dt array')
+    _check_batch_size(len(deltas))
+
+    columns = {}
+    for field in BATCH_COLUMNS:
+        values = payload.get(field)
+        if values is None:
+            continue
+        if not isinstance(values, list) or len(values) != len(deltas):
+            raise DecodeError(f'column {field} must be an array of {len(deltas)} values')
+        columns[field] = values
+
+    try:
+        ts = _parse_timestamp(payload['t0'])
+        offsets = list(accumulate(_integer(delta) for delta in deltas))
+        if any(offset < 0 or offset > MAX_BATCH_SPAN_MS for offset in offsets):
+            raise DecodeError(f'dt offsets must stay within 0..{MAX_BATCH_SPAN_MS} ms of t0')
+        stamps = [ts + timedelta(milliseconds=offset) for offset in offsets]
+    except DecodeError:
+        raise
+    except (TypeError, ValueError, AttributeError, OverflowError, OSError) as e:
+        raise DecodeError(f'bad t0/dt: {e}')
+
+    readings = []
+    for i, stamp in enumerate(stamps):
+        item = {field: values[i] for field, values in columns.items()}
+        item['device_id'] = device_id
+        item['timestamp'] = stamp
+        readings.append(coerce_reading(item))
+    return readings
+
+def _check_batch_size(count):
+    if count > MAX_BATCH_READINGS:
+        raise DecodeError(f'batch of {count} readings exceeds {MAX_BATCH_READINGS}')
+
+def decode_compact(topic, raw):
+    if len(raw) != COMPACT_FORMAT.size:
+        raise DecodeError(f'compact payload must be {COMPACT_FORMAT.size} bytes')
+    device_id = device_from_topic(topic)
+    if not device_id:
+        raise DecodeError(f'no device_id in topic {topic}')
+
+    _, ts, voltage, current, power_w, energy_kwh, power_factor, rssi = COMPACT_FORMAT.unpack(raw)
+    _check_finite(voltage, current, power_w, energy_kwh, power_factor)
+    return {
+        'device_id': device_id,
+        'timestamp': datetime.fromtimestamp(ts, tz=timezone.utc),
+        'voltage': voltage,
+        'current': current,
+        'power_w': power_w,
+        'energy_kwh': energy_kwh,
+        'power_factor': power_factor,
+        'rssi': rssi,
+        'created_at': datetime.utcnow()
+    }
+
+def _check_finite(*values):
+    # IEEE floats in binary payloads can carry NaN/inf bit patterns
+    if not all(math.isfinite(value) for value in values):
+        raise DecodeError('non-finite value in compact payload')
+
+def encode_compact(reading):
+    """Pack a reading into the compact format (for simulators and tests)"""
+    ts = reading['timestamp']
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        ts = ts.timestamp()
+    return COMPACT_FORMAT.pack(
+        COMPACT_VERSION, int(ts),
+        reading['voltage'], reading['current'], reading['power_w'], reading['energy_kwh'],
+        reading.get('power_factor') or 0.0, reading.get('rssi') or 0
+    )
+
+def decode_compact_batch(topic, raw):
+    if len(raw) < COMPACT_BATCH_HEADER.size:
+        raise DecodeError('compact batch shorter than its header')
+    _, base, count = COMPACT_BATCH_HEADER.unpack_from(raw)
+    if len(raw) != COMPACT_BATCH_HEADER.size + count * COMPACT_BATCH_RECORD.size:
+        raise DecodeError(f'compact batch of {count} must be {COMPACT_BATCH_HEADER.size + count * COMPACT_BATCH_RECORD.size} bytes')
+    _check_batch_size(count)
+    device_id = device_from_topic(topic)
+    if not device_id:
+        raise DecodeError(f'no device_id in topic {topic}')
+
+    records = list(COMPACT_BATCH_RECORD.iter_unpack(raw[COMPACT_BATCH_HEADER.size:]))
+    try:
+        base_ts = datetime.fromtimestamp(base, tz=timezone.utc)
+        stamps = [base_ts + timedelta(milliseconds=record[0]) for record in records]
+    except (OverflowError, OSError) as e:
+        raise DecodeError(f'bad batch timestamps: {e}')
+
+    created_at = datetime.utcnow()
+    readings = []
+    for stamp, (_, voltage, current, power_w, energy_kwh, power_factor, rssi) in zip(stamps, records):
+        _check_finite(voltage, current, power_w, energy_kwh, power_factor)
+        readings.append({
+            'device_id': device_id,
+            'timestamp': stamp,
+            'voltage': voltage,
+            'current': current,
+            'power_w': power_w,
+            'energy_kwh': energy_kwh,
+            'power_factor': power_factor,
+            'rssi': rssi,
+            'created_at': created_at
+        })
+    return readings
+
+def encode_compact_batch(readings):
+    """Pack one device's readings into a compact batch (for simulators and tests)"""
+    def epoch_ms(ts):
+        if isinstance(ts, datetime):
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)
+            return int(ts.timestamp() * 1000)
+        return int(ts * 1000)
+
+    stamps = [epoch_ms(reading['timestamp']) for reading in readings]
+    base = min(stamps) // 1000 if stamps else 0
+    parts = [COMPACT_BATCH_HEADER.pack(COMPACT_BATCH_VERSION, base, len(readings))]
+    for reading, ms in zip(readings, stamps):
+        parts.append(COMPACT_BATCH_RECORD.pack(
+            ms - base * 1000,
+            reading['voltage'], reading['current'], reading['power_w'], reading['energy_kwh'],
+            reading.get('power_factor') or 0.0, reading.get('rssi') or 0
+        ))
+    return b''.join(parts)
+
+# First payload byte -> decoder
+_DECODERS = {
+    ord('{'): decode_json,
+    COMPACT_VERSION: decode_compact,
+}
+
+def register_decoder(marker, decoder):
+    """Plug in a decoder for payloads starting with byte `marker`"""
+    _DECODERS[marker] = decoder
+
+def decode_payload(topic, raw):
+    """
+    Decode a raw MQTT payload into a reading
+    Raises:
+        DecodeError for unknown formats or invalid readings
+    """
+    if not raw:
+        raise DecodeError('empty payload')
+    decoder = _DECODERS.get(raw[0])
+    if decoder is None:
+        # Tolerate leading whitespace before JSON
+        if raw.lstrip()[:1] == b'{':
+            decoder = decode_json
+        else:
+            raise DecodeError(f'unknown payload format (first byte {raw[0]:#x})')
+    return decoder(topic, raw)
+
+# First payload byte -> decoder returning a list of readings
+_BATCH_DECODERS = {
+    ord('{'): decode_json_readings,
+    ord('['): decode_json_readings,
+    COMPACT_BATCH_VERSION: decode_compact_batch,
+}
+
+def decode_readings(topic, raw):
+    """
+    Decode a raw MQTT payload that may hold one reading or a batch
+    Returns:
+        List of readings
+    Raises:
+        DecodeError for unknown formats or invalid readings (a batch is
+        rejected as a whole, so the device can resend it unchanged)
+    """
+    if not raw:
+        raise DecodeError('empty payload')
+    decoder = _BATCH_DECODERS.get(raw[0])
+    if decoder is None and raw.lstrip()[:1] in (b'{', b'['):
+        decoder = decode_json_readings
+    if decoder is None:
+        return [decode_payload(topic, raw)]
+    return decoder(topic, raw)
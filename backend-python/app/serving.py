@@ -0,0 +1,84 @@
+"""
+Serving helpers - decide which web process ingests MQTT telemetry
+"""
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, fall back to every process ingesting
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_lock_file = None  # held open for the life of the ingesting process
+
+# Worker classes where every open request (SSE stream included) holds a thread
+THREADED_WORKERS = ('sync', 'gthread')
+
+def acquire_ingest_lock(path):
+    """
+    Try to become the single ingesting process
+    The lock is released by the OS when the process exits, so the worker
+    gunicorn starts to replace a dead one takes over ingestion.
+    Returns:
+        True if this process holds the lock
+    """
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    if fcntl is None:
+        return True
+
+    handle = open(path, 'a+')
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+
+    handle.seek(0)
+    handle.truncate()
+    handle.write(str(os.getpid()))
+    handle.flush()
+    _lock_file = handle
+    return True
+
+def should_ingest(config):
+    """
+    Whether this process persists MQTT telemetry (WEB_INGEST)
+    all:    every process (development server)
+    single: one process per host, chosen by a file lock (gunicorn)
+    off:    none - run `python ingest.py` instead
+    Processes that don't ingest still keep live device state for the API.
+    """
+    mode = config.WEB_INGEST
+    if mode == 'off':
+        return False
+    if mode == 'single':
+        ingest = acquire_ingest_lock(config.INGEST_LOCK_FILE)
+        logger.info(f'Process {os.getpid()} {"owns" if ingest else "does not own"} MQTT ingest')
+        return ingest
+    return True
+
+def worker_class(config):
+    """
+    Gunicorn worker class: WEB_WORKER_CLASS, else gevent while live push is
+    enabled (an SSE stream is a cheap greenlet, not a pinned thread) and
+    gthread without it
+    """
+    if config.WEB_WORKER_CLASS:
+        return config.WEB_WORKER_CLASS
+    return 'gevent' if config.LIVE_ENABLED else 'gthread'
+
+def live_client_limit(config):
+    """
+    SSE streams one process accepts. With threaded workers each stream pins
+    a thread for its whole life, so LIVE_RESERVED_THREADS stay free for the
+    REST API; async workers (gevent) take LIVE_MAX_CLIENTS as is.
+    """
+    if not config.LIVE_ENABLED:
+        return 0
+    if worker_class(config) in THREADED_WORKERS:
+        return max(min(config.LIVE_MAX_CLIENTS, config.WEB_THREADS - config.LIVE_RESERVED_THREADS), 0)
+    return config.LIVE_MAX_CLIENTS
@@ -0,0 +1 @@
+"""Benchmarks for ingest, readings and billing"""
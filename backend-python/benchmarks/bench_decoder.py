@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Telemetry decoder microbenchmark - messages/sec on one core
+Usage: python -m benchmarks.bench_decoder [--messages 200000]
+"""
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from app.services import telemetry_decoder
+from app.services.telemetry_decoder import decode_payload, encode_compact
+
+TOPIC = 'smartmeter/meter-001/telemetry'
+
+def sample_reading(i):
+    """A reading shaped like the ESP32 firmware's JSON"""
+    return {
+        'device_id': 'meter-001',
+        'timestamp': datetime(2026, 1, 29, 10, 0, tzinfo=timezone.utc).timestamp() + i * 10,
+        'voltage': 230.1,
+        'current': 2.5,
+        'power_w': 575.0,
+        'energy_kwh': 10.5 + i * 0.001,
+        'power_factor': 0.98,
+        'rssi': -60
+    }
+
+def json_payload(i):
+    reading = sample_reading(i)
+    reading['timestamp'] = datetime.fromtimestamp(reading['timestamp'], tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return json.dumps(reading).encode()
+
+def baseline_decode(topic, raw):
+    """The original on_message path: json.loads, all() check, fromisoformat"""
+    payload = json.loads(raw.decode())
+    required = ['device_id', 'timestamp', 'voltage', 'current', 'power_w', 'energy_kwh']
+    if all(field in payload for field in required):
+        payload['timestamp'] = datetime.fromisoformat(payload['timestamp'].replace('Z', '+00:00'))
+        payload['created_at'] = datetime.utcnow()
+    return payload
+
+def measure(name, decode, payloads):
+    started = time.perf_counter()
+    for raw in payloads:
+        decode(TOPIC, raw)
+    elapsed = time.perf_counter() - started
+    rate = len(payloads) / elapsed
+    print(f'{name:<28} {rate:>12,.0f} msgs/sec  ({elapsed * 1e6 / len(payloads):.2f} us/msg)')
+    return rate
+
+def run(messages):
+    json_payloads = [json_payload(i) for i in range(messages)]
+    compact_payloads = [encode_compact(sample_reading(i)) for i in range(messages)]
+    print(f'{messages} messages, JSON {len(json_payloads[0])} bytes, compact {len(compact_payloads[0])} bytes')
+
+    results = {'baseline_json': measure('baseline json.loads', baseline_decode, json_payloads)}
+
+    orjson = telemetry_decoder.orjson
+    if orjson is not None:
+        results['decoder_orjson'] = measure('decoder (orjson)', decode_payload, json_payloads)
+    telemetry_decoder.orjson = None
+    try:
+        results['decoder_json'] = measure('decoder (stdlib json)', decode_payload, json_payloads)
+    finally:
+        telemetry_decoder.orjson = orjson
+
+    results['decoder_compact'] = measure('decoder (compact struct)', decode_payload, compact_payloads)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Telemetry decoder microbenchmark')
+    parser.add_argument('--messages', type=int, default=200000)
+    run(parser.parse_args().messages)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark data generator - months of fleet readings in a separate database
+Usage:
+    python -m benchmarks.datagen --db smartmeter-bench --devices 50 --months 3 --interval 300
+"""
+import time
+import argparse
+import logging
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+from pymongo import MongoClient, UpdateOne
+from app.config.config import get_config
+from app.models.database import Database, mongo_client_options
+from app.services.telemetry_decoder import decode_payload
+from app.services.rollup_service import RollupService
+from benchmarks.fleet import FleetSimulator
+
+logger = logging.getLogger(__name__)
+
+BENCH_DB = 'smartmeter-bench'
+
+def open_database(config, db_name=BENCH_DB, fresh=False):
+    """Benchmark database with the app's collections and indexes"""
+    if db_name == config.DB_NAME:
+        raise ValueError(f'Refusing to use the application database {db_name} for benchmarks')
+    client = MongoClient(config.MONGO_URI, **mongo_client_options(config))
+    if fresh:
+        client.drop_database(db_name)
+    return Database(client, db_name, config).db
+
+def generate(db, devices=50, months=3, interval=300, end=None, batch_size=10000, config=None):
+    """
+    Fill `months` calendar months up to `end` (default: now) with readings
+    decoded from simulated firmware JSON, so documents match real ingest.
+    Returns:
+        Number of readings written
+    """
+    end = end or datetime.now(timezone.utc).replace(microsecond=0)
+    start = (end - relativedelta(months=months)).replace(day=1, hour=0, minute=0, second=0)
+    rounds = int((end - start).total_seconds() // interval)
+    fleet = FleetSimulator(devices, interval, start=start)
+
+    written = 0
+    batch = []
+    started = time.perf_counter()
+    for topic, payload in fleet.messages(rounds * devices):
+        batch.append(decode_payload(topic, payload))
+        if len(batch) >= batch_size:
+            db.meter_readings.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        db.meter_readings.insert_many(batch, ordered=False)
+        written += len(batch)
+
+    last_seen = fleet.start + fleet.interval * (fleet.tick - 1)
+    db.devices.bulk_write([
+        UpdateOne(
+            {'device_id': meter.device_id},
+            {'$set': {'status': 'online', 'last_seen': last_seen.replace(tzinfo=None)},
+             '$setOnInsert': {'name': meter.device_id, 'tariff': 'default', 'created_at': datetime.utcnow()}},
+            upsert=True
+        )
+        for meter in fleet.meters
+    ], ordered=False)
+
+    if config is not None and config.ROLLUPS_ENABLED:
+        RollupService(db, config).backfill(from_dt=start, to_dt=end)
+
+    logger.info(f'Generated {written} readings for {devices} devices from {start:%Y-%m-%d} '
+                f'in {time.perf_counter() - started:.1f}s')
+    return written
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Generate benchmark readings')
+    parser.add_argument('--db', default=BENCH_DB, help='Database to fill (never the application database)')
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--months', type=int, default=3, help='Calendar months of history before now')
+    parser.add_argument('--interval', type=int, default=300, help='Seconds between readings per device')
+    parser.add_argument('--fresh', action='store_true', help='Drop the database first')
+    args = parser.parse_args()
+
+    config = get_config()
+    db = open_database(config, args.db, fresh=args.fresh)
+    generate(db, args.devices, args.months, args.interval, config=config)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Simulated meter fleet - ESP32-format telemetry for N devices
+Usage:
+    python -m benchmarks.fleet --devices 1000 --rate 500 --duration 60   # publish to MQTT_HOST
+    python -m benchmarks.fleet --devices 1000 --rate 20 --batch 30        # batched telemetry
+"""
+import json
+import math
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+from app.services.telemetry_decoder import encode_compact_batch, BATCH_COLUMNS
+
+TOPIC = 'smartmeter/{device_id}/telemetry'
+
+def device_ids(count, prefix='meter'):
+    return [f'{prefix}-{i:05d}' for i in range(1, count + 1)]
+
+class SimulatedMeter:
+    """
+    One PZEM-004T behind an ESP32: a daily load curve with noise, and an
+    energy register that only ever increases, like the real meter.
+    """
+
+    def __init__(self, device_id, seed=None):
+        self.device_id = device_id
+        self.rng = random.Random(seed if seed is not None else device_id)
+        self.base_w = self.rng.uniform(150, 600)
+        self.peak_w = self.rng.uniform(800, 3000)
+        self.energy_kwh = round(self.rng.uniform(0, 5000), 3)
+        self.rssi = self.rng.randint(-85, -45)
+        self.last_ts = None
+
+    def reading(self, ts):
+        """Reading at `ts` (aware UTC) with the firmware's fields"""
+        hour = ts.hour + ts.minute / 60
+        # Morning and evening peaks
+        shape = max(math.sin((hour - 6) / 24 * 2 * math.pi), 0) * 0.4 + max(math.sin((hour - 14) / 12 * math.pi), 0)
+        power = max(self.base_w + self.peak_w * shape * self.rng.uniform(0.7, 1.1), 0)
+        voltage = self.rng.gauss(230, 2.5)
+        pf = self.rng.uniform(0.85, 0.99)
+
+        if self.last_ts is not None:
+            self.energy_kwh += power * (ts - self.last_ts).total_seconds() / 3.6e6
+        self.last_ts = ts
+        return {
+            'device_id': self.device_id,
+            'timestamp': ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'voltage': round(voltage, 1),
+            'current': round(power / (voltage * pf), 3),
+            'power_w': round(power, 1),
+            'energy_kwh': round(self.energy_kwh, 3),
+            'power_factor': round(pf, 2),
+            'rssi': self.rssi + self.rng.randint(-3, 3)
+        }
+
+class FleetSimulator:
+    """
+    Telemetry from `devices` meters reporting every `interval` seconds of
+    simulated time, starting at `start`. Simulated time is independent of
+    wall time, so a benchmark can replay hours of fleet traffic in seconds.
+    """
+
+    def __init__(self, devices=100, interval=10, start=None, seed=0, prefix='meter'):
+        self.meters = [SimulatedMeter(device_id, seed=f'{seed}:{device_id}') for device_id in device_ids(devices, prefix)]
+        self.interval = timedelta(seconds=interval)
+        self.start = start or datetime.now(timezone.utc).replace(microsecond=0)
+        self.tick = 0
+
+    def readings(self, count=None):
+        """Yield reading dicts, one round of the fleet per simulated interval"""
+        sent = 0
+        while count is None or sent < count:
+            ts = self.start + self.interval * self.tick
+            self.tick += 1
+            for meter in self.meters:
+                if count is not None and sent >= count:
+                    return
+                yield meter.reading(ts)
+                sent += 1
+
+    def messages(self, count=None):
+        """Yield (topic, JSON bytes) exactly as the firmware publishes them"""
+        for reading in self.readings(count):
+            yield TOPIC.format(device_id=reading['device_id']), json.dumps(reading).encode()
+
+    def batch_messages(self, count=None, batch=30, fmt='columnar'):
+        """
+        Yield (topic, payload) with `batch` consecutive readings of one device per payload
+        Args:
+            fmt: 'columnar' (JSON t0/dt/arrays), 'json' (array of readings) or 'compact' (binary)
+        """
+        pending = {}
+        for reading in self.readings(count):
+            readings = pending.setdefault(reading['device_id'], [])
+            readings.append(reading)
+            if len(readings) == batch:
+                yield encode_batch(pending.pop(reading['device_id']), fmt)
+        for readings in pending.values():
+            yield encode_batch(readings, fmt)
+
+    def run(self, send, rate=None, duration=None, count=None, batch=None, fmt='columnar'):
+        """
+        Feed messages to `send(topic, payload)`
+        Args:
+            rate: Messages per second across the fleet (None: as fast as possible)
+            batch: Readings per message (see batch_messages), one per message if None
+            duration: Stop after this many wall-clock seconds
+        Returns:
+            Number of messages sent
+        """
+        started = time.perf_counter()
+        sent = 0
+        messages = self.batch_messages(count, batch, fmt) if batch else self.messages(count)
+        for topic, payload in messages:
+            if duration is not None and time.perf_counter() - started >= duration:
+                break
+            if rate:
+                delay = started + sent / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            send(topic, payload)
+            sent += 1
+        return sent
+
+def _parse_ts(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def encode_batch(readings, fmt='columnar'):
+    """(topic, payload) for consecutive readings of one device in a batch format"""
+    device_id = readings[0]['device_id']
+    topic = TOPIC.format(device_id=device_id)
+    if fmt == 'compact':
+        return topic, encode_compact_batch([dict(r, timestamp=_parse_ts(r['timestamp'])) for r in readings])
+    if fmt == 'json':
+        return topic, json.dumps([{k: v for k, v in r.items() if k != 'device_id'} for r in readings]).encode()
+
+    stamps = [_parse_ts(r['timestamp']) for r in readings]
+    payload = {
+        'device_id': device_id,
+        't0': readings[0]['timestamp'],
+        'dt': [0] + [int((b - a).total_seconds() * 1000) for a, b in zip(stamps, stamps[1:])],
+    }
+    for field in BATCH_COLUMNS:
+        payload[field] = [r[field] for r in readings]
+    return topic, json.dumps(payload).encode()
+
+class Message:
+    """The parts of paho's MQTTMessage that MQTTService reads"""
+    __slots__ = ('topic', 'payload', 'qos', 'retain')
+
+    def __init__(self, topic, payload, qos=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = False
+
+class LoopbackBroker:
+    """
+    In-process broker stand-in: delivers publishes straight to an
+    MQTTService's on_message, so the queue, workers, decoder and bulk
+    writer are exercised without a network or Mosquitto.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def start(self):
+        """Start the service's ingest side without connecting to a broker"""
+        self.service.buffer.start()
+        self.service.pipeline.start()
+
+    def publish(self, topic, payload):
+        self.service.on_message(self.service.client, None, Message(topic, payload))
+
+    def drain(self, timeout=120):
+        """Wait until every delivered message has been written to MongoDB"""
+        self.service.pipeline.queue.join()
+        deadline = time.monotonic() + timeout
+        while self.service.buffer.depth and time.monotonic() < deadline:
+            self.service.buffer.flush()
+
+    def stop(self):
+        self.service.pipeline.stop()
+        self.service.buffer.stop()
+
+if __name__ == '__main__':
+    from app.config.config import get_config
+    from app.services.mqtt_service import create_client
+
+    parser = argparse.ArgumentParser(description='Publish simulated fleet telemetry to the MQTT broker')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=10, help='Simulated seconds between readings per device')
+    parser.add_argument('--rate', type=float, help='Messages/sec across the fleet (default: as fast as possible)')
+    parser.add_argument('--duration', type=float, default=60, help='Wall-clock seconds to run')
+    parser.add_argument('--qos', type=int, default=0)
+    parser.add_argument('--batch', type=int, help='Readings per message (batched telemetry)')
+    parser.add_argument('--format', default='columnar', choices=('columnar', 'json', 'compact'), help='Batch payload format')
+    args = parser.parse_args()
+
+    config = get_config()
+    client = create_client(config, role='fleet')
+    if config.MQTT_USERNAME:
+        client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+    client.connect(config.MQTT_HOST, config.MQTT_PORT, keepalive=60)
+    client.loop_start()
+
+    fleet = FleetSimulator(args.devices, args.interval)
+    sent = fleet.run(lambda topic, payload: client.publish(topic, payload, qos=args.qos),
+                     rate=args.rate, duration=args.duration, batch=args.batch, fmt=args.format)
+    client.disconnect()
+    client.loop_stop()
+    print(f'Published {sent} messages from {args.devices} devices to {config.MQTT_HOST}:{config.MQTT_PORT}')
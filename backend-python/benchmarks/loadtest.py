@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+HTTP load test - requests/sec and latency for the API
+Usage:
+    python run.py                                   # dev server
+    python -m benchmarks.loadtest --label dev
+    gunicorn -c gunicorn.conf.py wsgi:app           # production profile
+    python -m benchmarks.loadtest --label gunicorn --compare loadtest-dev.json
+"""
+import json
+import time
+import argparse
+import threading
+import requests
+
+DEFAULT_PATHS = [
+    '/health',
+    '/api/devices',
+    '/api/devices/latest',
+    '/api/tariffs',
+    '/api/devices/{device}/latest',
+    '/api/devices/{device}/readings?agg=hour',
+]
+
+def worker(base_url, paths, deadline, results, lock):
+    session = requests.Session()
+    latencies, errors = [], 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=30)
+            if response.status_code >= 500:
+                errors += 1
+        except requests.RequestException:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    with lock:
+        results['latencies'].extend(latencies)
+        results['errors'] += errors
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+def run(base_url, concurrency, duration, paths, label):
+    results = {'latencies': [], 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(base_url, paths, deadline, results, lock), daemon=True)
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(results['latencies'])
+    return {
+        'label': label,
+        'url': base_url,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': results['errors'],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def report(result, baseline=None):
+    print(f'{result["label"]}: {result["rps"]:,.1f} req/s over {result["requests"]} requests '
+          f'({result["errors"]} errors), p50 {result["p50_ms"]} ms, p95 {result["p95_ms"]} ms, p99 {result["p99_ms"]} ms')
+    if baseline:
+        speedup = result['rps'] / baseline['rps'] if baseline['rps'] else float('inf')
+        print(f'vs {baseline["label"]}: {baseline["rps"]:,.1f} req/s -> {result["rps"]:,.1f} req/s ({speedup:.2f}x)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP load test for the Smart Meter API')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--device', default='meter-001')
+    parser.add_argument('--path', action='append', dest='paths', help='Path to request (repeatable)')
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--output', help='Write results JSON here (default loadtest-<label>.json)')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    paths = [p.format(device=args.device) for p in (args.paths or DEFAULT_PATHS)]
+    result = run(args.url.rstrip('/'), args.concurrency, args.duration, paths, args.label)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+
+    with open(args.output or f'loadtest-{args.label}.json', 'w') as f:
+        json.dump(result, f, indent=2)
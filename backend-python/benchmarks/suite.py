@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks - ingest, readings latency and billing against MongoDB
+Runs on a separate database filled by benchmarks.datagen; needs MongoDB only
+(MQTT goes through an in-process broker stand-in).
+Usage:
+    python -m benchmarks.suite --label baseline --generate --fresh
+    python -m benchmarks.suite --label change --compare bench-baseline.json
+    python -m benchmarks.suite --only ingest,readings
+"""
+import os
+import json
+import time
+import random
+import argparse
+import logging
+import platform
+import importlib.util
+from datetime import datetime, timedelta, timezone
+from dateutil.relativedelta import relativedelta
+from flask import Flask
+from app.config.config import get_config
+from app.models.database import Database
+from app.routes import api_blueprint
+from app.services.mqtt_service import MQTTService
+from app.services.billing_service import BillingService
+from app.services.bill_cache import bill_cache
+from app.services.rollup_service import ROLLUP_COLLECTIONS
+from benchmarks.fleet import FleetSimulator, LoopbackBroker
+from benchmarks.datagen import BENCH_DB, open_database, generate
+from benchmarks.loadtest import percentile
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = ('ingest', 'readings', 'billing')
+
+# (name, window, query) - windows end at a random point inside the generated data
+READINGS_SCENARIOS = [
+    ('raw_24h', timedelta(hours=24), {}),
+    ('hour_7d', timedelta(days=7), {'agg': 'hour'}),
+    ('day_30d', timedelta(days=30), {'agg': 'day'}),
+    ('columnar_7d', timedelta(days=7), {'format': 'columnar'}),
+    ('lttb_30d', timedelta(days=30), {'max_points': 1500}),
+]
+
+def latency_stats(samples):
+    samples = sorted(samples)
+    return {
+        'requests': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 2) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 2),
+        'p95_ms': round(percentile(samples, 95) * 1000, 2),
+        'p99_ms': round(percentile(samples, 99) * 1000, 2),
+    }
+
+def bench_ingest(config, db, messages, devices, batch=30):
+    """Readings/sec from telemetry to MongoDB: direct, through the MQTT path, and batched"""
+    results = {}
+    for mode in ('direct', 'mqtt', 'mqtt_batch'):
+        prefix = f'bench-{mode.replace("_", "-")}'
+        service = MQTTService(config, db, ingest=True)
+        fleet = FleetSimulator(devices, interval=10, prefix=prefix)
+        if mode == 'direct':
+            # process_telemetry takes the parsed JSON dict, as the original on_message did
+            payloads = list(fleet.readings(messages))
+            service.buffer.start()
+            started = time.perf_counter()
+            for payload in payloads:
+                service.process_telemetry(payload)
+            service.buffer.flush()
+            elapsed = time.perf_counter() - started
+            service.buffer.stop()
+        else:
+            if mode == 'mqtt':
+                payloads = list(fleet.messages(messages))
+            else:
+                payloads = list(fleet.batch_messages(messages, batch))
+            broker = LoopbackBroker(service)
+            broker.start()
+            started = time.perf_counter()
+            for topic, payload in payloads:
+                broker.publish(topic, payload)
+            broker.drain()
+            elapsed = time.perf_counter() - started
+            broker.stop()
+
+        ids = [meter.device_id for meter in fleet.meters]
+        persisted = db.meter_readings.count_documents({'device_id': {'$in': ids}})
+        for collection in ('meter_readings', 'devices', *ROLLUP_COLLECTIONS.values()):
+            db[collection].delete_many({'device_id': {'$in': ids}})
+
+        stats = service.buffer.snapshot()
+        results[mode] = {
+            'messages': len(payloads),
+            'readings': messages,
+            'persisted': persisted,
+            'seconds': round(elapsed, 3),
+            'msgs_per_sec': round(len(payloads) / elapsed, 1),
+            'readings_per_sec': round(messages / elapsed, 1),
+            'dropped': stats['dropped'] + service.pipeline.snapshot()['dropped'],
+            'duplicates': stats['duplicates'],
+        }
+        logger.info(f'ingest {mode}: {results[mode]["readings_per_sec"]:,.0f} readings/sec ({persisted}/{messages} persisted)')
+    return results
+
+def readings_app(config, db):
+    """The API blueprint on the benchmark database (no MQTT, no background threads)"""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.db = Database(db.client, db.name, config, init=False)
+    app.register_blueprint(api_blueprint.bp)
+    return app
+
+def bench_readings(config, db, requests_per_scenario, seed=0):
+    """get_readings latency per scenario via the Flask test client"""
+    device_ids = db.devices.distinct('device_id')
+    oldest = db.meter_readings.find_one({}, {'timestamp': 1}, sort=[('timestamp', 1)])
+    newest = db.meter_readings.find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+    if not device_ids or not oldest:
+        raise RuntimeError('No benchmark data, run with --generate first')
+
+    rng = random.Random(seed)
+    client = readings_app(config, db).test_client()
+    results = {}
+    for name, window, query in READINGS_SCENARIOS:
+        span = (newest['timestamp'] - oldest['timestamp'] - window).total_seconds()
+        samples, errors = [], 0
+        for _ in range(requests_per_scenario):
+            # Random second-aligned windows, so the response cache does not serve repeats
+            end = newest['timestamp'] - timedelta(seconds=rng.uniform(0, max(span, 0)))
+            params = dict(query, **{'from': f'{end - window:%Y-%m-%dT%H:%M:%SZ}', 'to': f'{end:%Y-%m-%dT%H:%M:%SZ}'})
+            started = time.perf_counter()
+            response = client.get(f'/api/devices/{rng.choice(device_ids)}/readings', query_string=params)
+            response.get_data()
+            samples.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+        results[name] = dict(latency_stats(samples), errors=errors)
+        logger.info(f'readings {name}: p50 {results[name]["p50_ms"]} ms, p99 {results[name]["p99_ms"]} ms')
+    return results
+
+def load_billing_job():
+    """Import BillingJob from billing-python/src/billing_job.py (it shares this process's `app` modules)"""
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'billing-python', 'src', 'billing_job.py')
+    spec = importlib.util.spec_from_file_location('billing_job', os.path.abspath(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.BillingJob
+
+def reset_month(db, month):
+    """Forget bills, invoices and checkpoints of `month` so billing runs cold"""
+    bill_cache.clear()
+    db.bill_cache.delete_many({'month': month})
+    db.bill_snapshots.delete_many({})
+    db.invoices.delete_many({'month': month})
+    db.billing_checkpoints.delete_many({'month': month})
+
+def bench_billing(config, db, sample_devices, workers=None):
+    """compute_bill per device (cold and memoised) and BillingJob.run wall time"""
+    now = datetime.now(timezone.utc)
+    closed_month = (now - relativedelta(months=1)).strftime('%Y-%m')
+    current_month = now.strftime('%Y-%m')
+    device_ids = sorted(db.devices.distinct('device_id'))[:sample_devices]
+    billing = BillingService(db, config)
+
+    results = {'month': closed_month}
+    reset_month(db, closed_month)
+    for name, month in (('compute_bill_cold', closed_month), ('compute_bill_cached', closed_month),
+                        ('compute_bill_current', current_month)):
+        samples = []
+        for device_id in device_ids:
+            started = time.perf_counter()
+            billing.compute_bill(device_id, month)
+            samples.append(time.perf_counter() - started)
+        results[name] = latency_stats(samples)
+        logger.info(f'billing {name}: p50 {results[name]["p50_ms"]} ms, p99 {results[name]["p99_ms"]} ms')
+
+    BillingJob = load_billing_job()
+    job_config = type('BenchConfig', (config,), {'DB_NAME': db.name})
+    job = BillingJob(job_config)
+    reset_month(db, closed_month)
+    started = time.perf_counter()
+    job.run(month=closed_month, workers=workers, resume=False)
+    elapsed = time.perf_counter() - started
+    job.mongo_client.close()
+    results['billing_job'] = {
+        'devices': len(db.devices.distinct('device_id')),
+        'invoices': db.invoices.count_documents({'month': closed_month}),
+        'seconds': round(elapsed, 3),
+    }
+    logger.info(f'billing job: {results["billing_job"]["invoices"]} invoices in {elapsed:.2f}s')
+    return results
+
+def run(args):
+    config = get_config()
+    db = open_database(config, args.db, fresh=args.fresh)
+    if args.generate:
+        generate(db, args.devices, args.months, args.interval, config=config)
+
+    result = {
+        'label': args.label,
+        'started_at': datetime.utcnow().isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'database': args.db,
+        'readings': db.meter_readings.estimated_document_count(),
+        'devices': len(db.devices.distinct('device_id')),
+    }
+    only = args.only.split(',') if args.only else BENCHMARKS
+    if 'ingest' in only:
+        result['ingest'] = bench_ingest(config, db, args.messages, args.ingest_devices, args.batch)
+    if 'readings' in only:
+        result['readings_latency'] = bench_readings(config, db, args.requests)
+    if 'billing' in only:
+        result['billing'] = bench_billing(config, db, args.bill_devices, args.workers)
+    return result
+
+def flatten(result, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1} for numeric leaves"""
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def report(result, baseline=None):
+    current = {k: v for k, v in flatten(result).items() if '.' in k}
+    previous = flatten(baseline) if baseline else {}
+    width = max(len(k) for k in current) if current else 0
+    if baseline:
+        print(f'{result["label"]} vs {baseline["label"]}')
+    for key, value in current.items():
+        line = f'{key:<{width}}  {value:>12,}'
+        before = previous.get(key)
+        if before:
+            line += f'  {before:>12,}  ({value / before:.2f}x)'
+        print(line)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks for ingest, readings and billing')
+    parser.add_argument('--db', default=BENCH_DB, help='Benchmark database (never the application database)')
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--only', help=f'Comma-separated subset of {",".join(BENCHMARKS)}')
+    parser.add_argument('--generate', action='store_true', help='Generate readings before benchmarking')
+    parser.add_argument('--fresh', action='store_true', help='Drop the benchmark database first')
+    parser.add_argument('--devices', type=int, default=50, help='Devices to generate')
+    parser.add_argument('--months', type=int, default=3, help='Months of readings to generate')
+    parser.add_argument('--interval', type=int, default=300, help='Seconds between generated readings')
+    parser.add_argument('--messages', type=int, default=50000, help='Readings per ingest benchmark')
+    parser.add_argument('--batch', type=int, default=30, help='Readings per message in the batched ingest benchmark')
+    parser.add_argument('--ingest-devices', type=int, default=500, help='Simulated devices for ingest')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per readings scenario')
+    parser.add_argument('--bill-devices', type=int, default=50, help='Devices timed with compute_bill')
+    parser.add_argument('--workers', type=int, help='BillingJob workers (default BILLING_WORKERS)')
+    parser.add_argument('--output', help='Write results JSON here (default bench-<label>.json)')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    result = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+
+    with open(args.output or f'bench-{args.label}.json', 'w') as f:
+        json.dump(result, f, indent=2)
@@ -0,0 +1,67 @@
+"""
+Gunicorn configuration (production serving)
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+Sizing comes from the WEB_* settings in .env
+"""
+import os
+import multiprocessing
+
+# Must be set before the config module is imported: workers inherit it after fork
+os.environ.setdefault('FLASK_ENV', 'prod')
+os.environ.setdefault('WEB_INGEST', 'single')
+os.environ.setdefault('FAST_START', 'true')  # run `python manage.py migrate` on deploy
+
+from app.config.config import get_config
+from app.serving import worker_class as web_worker_class, live_client_limit
+from prometheus_client import multiprocess
+
+config = get_config()
+
+bind = config.WEB_BIND
+workers = config.WEB_WORKERS or multiprocessing.cpu_count() * 2 + 1
+worker_class = web_worker_class(config)
+threads = config.WEB_THREADS
+
+# Per-worker sizing, multiplied by `workers`:
+# - gevent (default while LIVE_ENABLED): every request and SSE stream is a greenlet;
+#   up to LIVE_MAX_CLIENTS streams plus WEB_CONNECTIONS concurrent API requests.
+#   `threads` is ignored.
+# - gthread: WEB_THREADS concurrent requests; each SSE stream pins one of them, so
+#   streams are capped at WEB_THREADS - LIVE_RESERVED_THREADS (4 with the defaults).
+worker_connections = config.WEB_CONNECTIONS + live_client_limit(config)
+timeout = config.WEB_TIMEOUT
+keepalive = config.WEB_KEEPALIVE
+graceful_timeout = 30
+
+# Each worker builds its own app: MongoClient and MQTT threads are not fork-safe
+preload_app = False
+
+# Recycle workers now and then to cap slow memory growth
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = '-'
+loglevel = config.LOG_LEVEL.lower()
+
+def on_starting(server):
+    """Start from an empty metrics directory, so old runs' totals are not summed in"""
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        os.makedirs(config.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        for name in os.listdir(config.PROMETHEUS_MULTIPROC_DIR):
+            if name.endswith('.db'):
+                os.remove(os.path.join(config.PROMETHEUS_MULTIPROC_DIR, name))
+
+def worker_exit(server, worker):
+    """Flush buffered readings and close MQTT before the worker goes away"""
+    app = getattr(worker, 'wsgi', None)
+    mqtt_service = getattr(app, 'mqtt', None)
+    if mqtt_service:
+        mqtt_service.disconnect()
+    syncer = getattr(app, 'metrics_syncer', None)
+    if syncer:
+        syncer.stop()
+
+def child_exit(server, worker):
+    """Drop an exited worker's live gauges; its counters stay in the shared files"""
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Async Ingest Entry Point
+Runs MQTT ingestion on its own, separate from the HTTP API (create_app)
+"""
+import os
+import asyncio
+import logging
+from app.config.config import get_config
+from app.services.async_ingest import AsyncIngestService
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+if __name__ == '__main__':
+    os.environ.setdefault('FLASK_ENV', 'dev')
+    
+    config = get_config()
+    print(f'Starting Smart Energy Meter async ingest')
+    print(f'Environment: {os.getenv("FLASK_ENV")}')
+    print(f'Broker: {config.MQTT_HOST}:{config.MQTT_PORT} topic {config.MQTT_TOPIC_SUB}')
+    
+    asyncio.run(AsyncIngestService(config).run())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Management Commands
+Usage: python manage.py <command> [options]
+"""
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime
+from pymongo import MongoClient
+from app.config.config import get_config
+from app.services.rollup_service import RollupService
+from app.models.database import Database, SchemaError, mongo_client_options
+from app.models.migrations import migrate_readings_to_timeseries, dedupe_invoices, dedupe_readings
+from app.services.archive import ReadingsArchive
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('manage')
+
+def parse_datetime(value):
+    """Parse an ISO date/datetime argument"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def get_db(config):
+    """Connect to MongoDB without starting the app"""
+    client = MongoClient(config.MONGO_URI, **mongo_client_options(config))
+    return client[config.DB_NAME]
+
+def migrate(config, args):
+    """Create collections and indexes and record the schema version"""
+    client = MongoClient(config.MONGO_URI, **mongo_client_options(config))
+    try:
+        version = Database(client, config.DB_NAME, config, init=False).migrate()
+    except SchemaError as e:
+        logger.error(f'Migration stopped, nothing was dropped: {e}')
+        sys.exit(1)
+    logger.info(f'Database {config.DB_NAME} is at schema version {version}')
+
+def backfill_rollups(config, args):
+    """Rebuild hourly/daily rollups from raw meter_readings"""
+    db = get_db(config)
+    count = RollupService(db, config).backfill(args.device, args.from_dt, args.to_dt)
+    logger.info(f'Rollup backfill complete: {count} devices')
+
+def migrate_timeseries(config, args):
+    """Move meter_readings into a native time-series collection"""
+    db = get_db(config)
+    try:
+        copied = migrate_readings_to_timeseries(
+            db, config,
+            batch_size=args.batch_size,
+            pause=args.pause,
+            drop_legacy=args.drop_legacy
+        )
+    except SchemaError as e:
+        logger.error(f'Time-series migration stopped: {e}')
+        sys.exit(1)
+    logger.info(f'Time-series migration complete: {copied} readings copied')
+
+def archive_readings(config, args):
+    """Move closed months of raw readings to Parquet files"""
+    db = get_db(config)
+    archived = ReadingsArchive(db, config).archive(
+        older_than_months=args.older_than if args.older_than is not None else config.ARCHIVE_AFTER_MONTHS,
+        device_id=args.device,
+        batch_size=args.batch_size or config.ARCHIVE_DELETE_BATCH,
+        pause=args.pause if args.pause is not None else config.ARCHIVE_DELETE_PAUSE
+    )
+    logger.info(f'Archive complete: {archived} readings moved')
+
+def dedupe_readings_command(config, args):
+    """Resolve duplicate (device_id, timestamp) readings before `migrate`"""
+    db = get_db(config)
+    moved = dedupe_readings(db, dry_run=args.dry_run)
+    logger.info(f'{"Would move" if args.dry_run else "Moved"} {moved} duplicate readings to meter_readings_duplicates')
+
+def dedupe_invoices_command(config, args):
+    """Resolve duplicate (device_id, month) invoices before `migrate`"""
+    db = get_db(config)
+    moved = dedupe_invoices(db, dry_run=args.dry_run)
+    logger.info(f'{"Would move" if args.dry_run else "Moved"} {moved} duplicate invoices to invoices_duplicates')
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Smart Energy Meter management commands')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('migrate', help='Create collections and indexes (run before FAST_START workers)')
+    p.set_defaults(func=migrate)
+
+    p = sub.add_parser('dedupe-readings', help='Keep one reading per device and timestamp (needed by migrate)')
+    p.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+    p.set_defaults(func=dedupe_readings_command)
+
+    p = sub.add_parser('dedupe-invoices', help='Keep one invoice per device and month (needed by migrate)')
+    p.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+    p.set_defaults(func=dedupe_invoices_command)
+
+    p = sub.add_parser('backfill-rollups', help='Rebuild hourly/daily rollups from raw readings')
+    p.add_argument('--device', help='Only this device_id')
+    p.add_argument('--from', dest='from_dt', type=parse_datetime, help='Start (ISO date)')
+    p.add_argument('--to', dest='to_dt', type=parse_datetime, help='End (ISO date)')
+    p.set_defaults(func=backfill_rollups)
+
+    p = sub.add_parser('migrate-timeseries', help='Copy meter_readings into a time-series collection')
+    p.add_argument('--batch-size', type=int, default=10000, help='Readings per batch')
+    p.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+    p.add_argument('--drop-legacy', action='store_true', help='Drop meter_readings_legacy (and _<n>) when done')
+    p.set_defaults(func=migrate_timeseries)
+
+    p = sub.add_parser('archive-readings', help='Move old closed months of readings to Parquet (ARCHIVE_DIR)')
+    p.add_argument('--older-than', type=int, help='Archive months older than this many months (default ARCHIVE_AFTER_MONTHS)')
+    p.add_argument('--device', help='Only this device_id')
+    p.add_argument('--batch-size', type=int, help='Readings deleted from MongoDB per batch (default ARCHIVE_DELETE_BATCH)')
+    p.add_argument('--pause', type=float, help='Seconds to sleep between delete batches (default ARCHIVE_DELETE_PAUSE)')
+    p.set_defaults(func=archive_readings)
+
+    return parser
+
+if __name__ == '__main__':
+    os.environ.setdefault('FLASK_ENV', 'dev')
+    args = build_parser().parse_args()
+    args.func(get_config(), args)
+    sys.exit(0)
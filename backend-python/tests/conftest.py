@@ -0,0 +1,8 @@
+"""
+Unit tests for pure logic; run from backend-python/ with `python -m pytest tests`
+"""
+import os
+import sys
+
+# Tests import the `app` package from backend-python/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
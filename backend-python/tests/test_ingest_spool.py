@@ -0,0 +1,129 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from app.services.ingest_spool import IngestSpool, CURSOR_FILE, SEGMENT_PREFIX
+
+def readings(start, count):
+    return [{'device_id': 'meter-001', 'timestamp': datetime(2026, 1, 1) + timedelta(seconds=i), 'seq': i}
+            for i in range(start, start + count)]
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith(SEGMENT_PREFIX))
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = IngestSpool(str(tmp_path), segment_bytes=4096, fsync_interval=0)
+    yield spool
+    spool.close()
+
+def test_append_and_replay_in_order(spool):
+    assert spool.append(readings(0, 3))
+    assert spool.append(readings(3, 2))
+    assert spool.pending
+
+    written = []
+    assert spool.replay(written.extend) == 5
+    assert [r['seq'] for r in written] == [0, 1, 2, 3, 4]
+    assert written[0]['timestamp'] == datetime(2026, 1, 1)
+    assert not spool.pending
+    assert segments(spool.directory) == []
+
+def test_replay_batches(spool):
+    spool.append(readings(0, 10))
+    spool.append(readings(10, 10))
+    batches = []
+    spool.replay(batches.append, batch_size=10)
+    assert [len(batch) for batch in batches] == [10, 10]
+
+def test_roll_to_new_segments(spool):
+    for i in range(20):
+        spool.append(readings(i * 10, 10))
+    assert len(segments(spool.directory)) > 1
+
+    written = []
+    spool.replay(written.extend)
+    assert [r['seq'] for r in written] == list(range(200))
+    assert segments(spool.directory) == []
+
+def test_segment_numbers_never_reused(spool):
+    spool.append(readings(0, 1))
+    spool.replay(lambda batch: None)
+    spool.append(readings(1, 1))
+    assert segments(spool.directory) == [f'{SEGMENT_PREFIX}000000000002.seg']
+
+def test_full_spool_refuses(tmp_path):
+    spool = IngestSpool(str(tmp_path), max_bytes=200, fsync_interval=0)
+    assert not spool.append(readings(0, 50))
+    assert spool.stats['rejected'] == 50
+    assert not spool.pending
+    spool.close()
+
+def test_failed_write_keeps_batch(spool):
+    spool.append(readings(0, 3))
+
+    def fail(batch):
+        raise ConnectionError('MongoDB unavailable')
+
+    with pytest.raises(ConnectionError):
+        spool.replay(fail)
+    assert spool.pending
+
+    written = []
+    spool.replay(written.extend)
+    assert [r['seq'] for r in written] == [0, 1, 2]
+
+def test_cursor_recovery_after_crash(tmp_path):
+    spool = IngestSpool(str(tmp_path), fsync_interval=0)
+    spool.append(readings(0, 2))
+    spool.append(readings(2, 2))
+    spool.sync()
+
+    first = []
+
+    def crash_after_first_batch(batch):
+        if first:
+            raise SystemExit('process killed')
+        first.extend(batch)
+
+    with pytest.raises(SystemExit):
+        spool.replay(crash_after_first_batch, batch_size=2)
+    spool.close()
+    assert os.path.exists(os.path.join(str(tmp_path), CURSOR_FILE))
+
+    # A new process resumes after the committed batch
+    restarted = IngestSpool(str(tmp_path), fsync_interval=0)
+    assert restarted.pending
+    written = []
+    restarted.replay(written.extend)
+    assert [r['seq'] for r in first] == [0, 1]
+    assert [r['seq'] for r in written] == [2, 3]
+    assert not os.path.exists(os.path.join(str(tmp_path), CURSOR_FILE))
+
+    # New appends after recovery get a fresh segment number
+    restarted.append(readings(4, 1))
+    assert segments(str(tmp_path)) == [f'{SEGMENT_PREFIX}000000000002.seg']
+    restarted.close()
+
+def test_stale_cursor_ignored(tmp_path):
+    with open(os.path.join(str(tmp_path), CURSOR_FILE), 'w') as f:
+        f.write('7 123\n')
+    spool = IngestSpool(str(tmp_path), fsync_interval=0)
+    assert not spool.pending
+    assert not os.path.exists(os.path.join(str(tmp_path), CURSOR_FILE))
+    spool.append(readings(0, 1))
+    assert segments(str(tmp_path)) == [f'{SEGMENT_PREFIX}000000000008.seg']
+    spool.close()
+
+def test_corrupt_record_skipped(spool):
+    spool.append(readings(0, 1))
+    spool.append(readings(1, 1))
+    spool.sync()
+    path = os.path.join(spool.directory, segments(spool.directory)[0])
+    with open(path, 'r+b') as f:
+        f.seek(30)
+        f.write(b'\xff\xff')
+
+    written = []
+    spool.replay(written.extend)
+    assert [r['seq'] for r in written] == [1]
+    assert spool.stats['corrupt'] == 1
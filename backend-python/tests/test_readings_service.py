@@ -0,0 +1,173 @@
+from array import array
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from bson import ObjectId
+from app.services.readings_service import (
+    ReadingsService, EPOCH, ENVELOPE_RATIO, lttb_indices, encode_cursor, decode_cursor, _merge_columns
+)
+
+T0 = datetime(2026, 1, 1)
+
+def ms(ts):
+    return (ts - EPOCH) // timedelta(milliseconds=1)
+
+# LTTB
+
+def test_lttb_short_series_kept_whole():
+    assert lttb_indices(np.arange(5), np.arange(5), 10).tolist() == [0, 1, 2, 3, 4]
+    assert lttb_indices(np.arange(5), np.arange(5), 2).tolist() == [0, 1, 2, 3, 4]
+
+def test_lttb_keeps_ends_and_threshold():
+    x = np.arange(1000, dtype=np.int64)
+    keep = lttb_indices(x, np.sin(x / 50.0), 100)
+    assert len(keep) == 100
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(1000)
+    y[123], y[777] = 500.0, -500.0
+    keep = lttb_indices(np.arange(1000), y, 50)
+    assert 123 in keep and 777 in keep
+
+def test_lttb_tolerates_nan():
+    y = np.ones(100)
+    y[10] = np.nan
+    assert len(lttb_indices(np.arange(100), y, 20)) == 20
+
+# Rollup envelope
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[key], reverse=direction < 0))
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        bounds = query['bucket']
+        return FakeCursor(
+            doc for doc in self.docs
+            if doc['device_id'] == query['device_id'] and bounds['$gte'] <= doc['bucket'] <= bounds['$lte']
+        )
+
+class FakeRollups:
+    def reads_enabled(self):
+        return True
+
+    def truncate(self, ts, unit):
+        if unit == 'hour':
+            return ts.replace(minute=0, second=0, microsecond=0)
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def hourly_bucket(hour, low, high, samples=360):
+    bucket = T0 + timedelta(hours=hour)
+    doc = {'device_id': 'meter-001', 'bucket': bucket, 'samples': samples,
+           'ts_min': bucket, 'ts_max': bucket + timedelta(minutes=59, seconds=50)}
+    for field in ('voltage', 'current', 'power_w', 'energy_kwh'):
+        doc[f'{field}_min'], doc[f'{field}_max'] = low, high
+    return doc
+
+def service(hourly, daily=()):
+    svc = ReadingsService.__new__(ReadingsService)
+    svc.db = {'readings_hourly': FakeCollection(list(hourly)), 'readings_daily': FakeCollection(list(daily))}
+    svc.rollups = FakeRollups()
+    return svc
+
+def test_envelope_skipped_for_small_ranges():
+    svc = service([hourly_bucket(h, 0, 1, samples=10) for h in range(24)])
+    assert svc.rollup_envelope('meter-001', T0, T0 + timedelta(days=1), 1000) is None
+
+def test_envelope_min_and_max_share_a_position():
+    svc = service([hourly_bucket(h, h, 100 + h) for h in range(48)])
+    columns, total = svc.rollup_envelope('meter-001', T0, T0 + timedelta(days=2), 200)
+    assert total == 48 * 360
+    assert len(columns['timestamp']) == 96
+    ts = list(columns['timestamp'])
+    assert ts[0::2] == ts[1::2]
+    # Middle of the first bucket's readings
+    assert ts[0] == ms(T0 + timedelta(minutes=29, seconds=55))
+    assert list(columns['power_w'][:4]) == [0.0, 100.0, 1.0, 101.0]
+
+def test_envelope_merges_buckets_to_fit_max_points():
+    svc = service([hourly_bucket(h, h, 100 + h) for h in range(48)])
+    columns, _ = svc.rollup_envelope('meter-001', T0, T0 + timedelta(days=2), 20)
+    assert len(columns['timestamp']) == 20
+    power = list(columns['power_w'])
+    # Each pair spans its merged buckets: min of the minima, max of the maxima
+    assert power[0] == 0.0 and power[1] > 100.0
+    assert min(power[0::2]) == 0.0 and max(power[1::2]) == 147.0
+
+def test_envelope_positions_clipped_to_range():
+    svc = service([hourly_bucket(h, 0, 1) for h in range(48)])
+    start = T0 + timedelta(minutes=45)
+    columns, _ = svc.rollup_envelope('meter-001', start, T0 + timedelta(days=2), 200)
+    assert columns['timestamp'][0] == ms(start)
+
+def test_downsample_uses_envelope():
+    svc = service([hourly_bucket(h, 0, 1) for h in range(48)])
+    columns, total = svc.downsample('meter-001', T0, T0 + timedelta(days=2), 200)
+    assert total == 48 * 360 > ENVELOPE_RATIO * 200
+    assert len(columns['timestamp']) == 96
+
+# Cursors
+
+def test_cursor_roundtrip():
+    oid = ObjectId()
+    token = encode_cursor({'timestamp': T0, '_id': oid})
+    assert decode_cursor(token) == (T0, oid)
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', 'bm9waXBl'])
+def test_invalid_cursor(token):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(token)
+
+# Archive/Mongo column merge
+
+def live_columns(rows):
+    return {
+        'timestamp': array('q', [ms(ts) for ts, _ in rows]),
+        'power_w': array('d', [value for _, value in rows]),
+    }
+
+def archived_columns(rows, ids):
+    return {
+        'timestamp': np.array([ms(ts) for ts, _ in rows], dtype=np.int64),
+        'power_w': np.array([value for _, value in rows], dtype=np.float64),
+        '_id': np.array([str(oid) for oid in ids], dtype=object),
+    }
+
+def test_merge_drops_rows_in_both_stores():
+    ids = [ObjectId() for _ in range(3)]
+    rows = [(T0 + timedelta(seconds=10 * i), float(i)) for i in range(3)]
+    late = (T0 + timedelta(seconds=5), 9.0)
+    late_id = ObjectId()
+    merged = _merge_columns(
+        archived_columns(rows, ids),
+        live_columns([rows[1], late, rows[2]]),
+        live_ids=[ids[1], late_id, ids[2]]
+    )
+    assert list(merged['timestamp']) == [ms(rows[0][0]), ms(late[0]), ms(rows[1][0]), ms(rows[2][0])]
+    assert list(merged['power_w']) == [0.0, 9.0, 1.0, 2.0]
+
+def test_merge_keeps_distinct_readings_sharing_a_timestamp():
+    archived_id, live_id = ObjectId(), ObjectId()
+    merged = _merge_columns(
+        archived_columns([(T0, 1.0)], [archived_id]),
+        live_columns([(T0, 2.0)]),
+        live_ids=[live_id]
+    )
+    assert sorted(merged['power_w']) == [1.0, 2.0]
+
+def test_merge_with_ids_orders_by_timestamp_and_id():
+    ids = sorted(ObjectId() for _ in range(3))
+    merged = _merge_columns(
+        archived_columns([(T0, 1.0), (T0 + timedelta(seconds=1), 3.0)], [ids[1], ids[2]]),
+        live_columns([(T0, 0.0), (T0 + timedelta(seconds=1), 3.0)]),
+        live_ids=[ids[0], ids[2]],
+        with_ids=True
+    )
+    assert merged['_id'] == ids
+    assert list(merged['power_w']) == [0.0, 1.0, 3.0]
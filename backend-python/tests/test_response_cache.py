@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta, timezone
+from app.services.response_cache import make_etag, late_readings_keys, readings_key
+
+NOW = datetime(2026, 3, 1, 12, 0)
+
+def test_etag_is_stable():
+    assert make_etag('readings:meter-001', 3) == make_etag('readings:meter-001', 3)
+    assert len(make_etag('x')) == 40
+
+def test_etag_changes_with_every_part():
+    base = make_etag('readings:meter-001', 3, NOW)
+    assert make_etag('readings:meter-002', 3, NOW) != base
+    assert make_etag('readings:meter-001', 4, NOW) != base
+    assert make_etag('readings:meter-001', 3, NOW + timedelta(seconds=1)) != base
+
+def test_etag_formats_datetimes_as_iso():
+    assert make_etag(NOW) == make_etag(NOW.isoformat())
+
+def test_late_readings_keys():
+    readings = [
+        {'device_id': 'fresh', 'timestamp': NOW - timedelta(seconds=30)},
+        {'device_id': 'late', 'timestamp': NOW - timedelta(hours=2)},
+        {'device_id': 'late', 'timestamp': NOW - timedelta(hours=3)},
+        {'device_id': 'edge', 'timestamp': NOW - timedelta(seconds=3600)},
+    ]
+    assert late_readings_keys(readings, 3600, now=NOW) == {readings_key('late'), readings_key('edge')}
+
+def test_late_readings_keys_aware_timestamps():
+    aware = (NOW - timedelta(hours=2)).replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=5, minutes=30)))
+    assert late_readings_keys([{'device_id': 'd', 'timestamp': aware}], 3600, now=NOW) == {'readings:d'}
+    fresh = NOW.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=-5)))
+    assert late_readings_keys([{'device_id': 'd', 'timestamp': fresh}], 3600, now=NOW) == set()
+
+def test_late_readings_keys_skips_missing_timestamps():
+    assert late_readings_keys([{'device_id': 'd'}, {'device_id': 'e', 'timestamp': 'bad'}], 60, now=NOW) == set()
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from app.services.tariff_engine import CompiledTariff
+
+TARIFF = {
+    'name': 'default',
+    'slabs': [
+        {'range': '0-100', 'rate': 3.50},
+        {'range': '101-300', 'rate': 4.50},
+        {'range': '301+', 'rate': 6.00}
+    ],
+    'fixed_charge': 50,
+    'tax_rate': 0.18,
+    'currency': 'INR',
+    'version': 1
+}
+
+def slab_bill(tariff, total_energy):
+    """compute_bill's original per-slab loop, which CompiledTariff must reproduce"""
+    remaining_units = total_energy
+    subtotal = 0
+    units = []
+    for slab in tariff['slabs']:
+        slab_range = slab['range']
+        if '+' in slab_range:
+            slab_start = int(slab_range.replace('+', ''))
+            slab_end = float('inf')
+        else:
+            slab_start, slab_end = map(int, slab_range.split('-'))
+        units_in_slab = 0
+        if remaining_units > 0:
+            slab_size = slab_end - slab_start if slab_end != float('inf') else remaining_units
+            units_in_slab = min(remaining_units, slab_size)
+            subtotal += units_in_slab * slab['rate']
+            remaining_units -= units_in_slab
+        units.append(units_in_slab)
+
+    fixed_charge = tariff.get('fixed_charge', 0)
+    tax = (subtotal + fixed_charge) * tariff.get('tax_rate', 0)
+    total = max(subtotal + fixed_charge + tax, tariff.get('minimum_bill', fixed_charge))
+    return units, subtotal, tax, total
+
+ENERGY = [0, 0.5, 99, 99.99, 100, 100.01, 150, 199, 200, 200.5, 250, 299, 300, 301, 450.75, 1234.5, 1e6]
+
+@pytest.mark.parametrize('tariff', [
+    TARIFF,
+    dict(TARIFF, minimum_bill=500),
+    dict(TARIFF, fixed_charge=0, tax_rate=0),
+    dict(TARIFF, slabs=[{'range': '0-50', 'rate': 2}, {'range': '51+', 'rate': 5}, {'range': '500-900', 'rate': 9}]),
+    dict(TARIFF, slabs=[{'range': '0-100', 'rate': 1}, {'range': '100-200', 'rate': 2}]),
+])
+def test_price_matches_slab_rule(tariff):
+    compiled = CompiledTariff(tariff)
+    units, subtotal, tax, total = compiled.price(np.array(ENERGY))
+    for i, energy in enumerate(ENERGY):
+        expected_units, expected_subtotal, expected_tax, expected_total = slab_bill(tariff, energy)
+        assert units[i] == pytest.approx(expected_units)
+        assert subtotal[i] == pytest.approx(expected_subtotal)
+        assert tax[i] == pytest.approx(expected_tax)
+        assert total[i] == pytest.approx(expected_total)
+
+def test_negative_energy_prices_as_zero():
+    _, subtotal, _, total = CompiledTariff(TARIFF).price(np.array([-5.0]))
+    assert subtotal[0] == 0
+    assert total[0] == pytest.approx(50 * 1.18)
+
+def test_breakdown_lists_used_slabs():
+    compiled = CompiledTariff(TARIFF)
+    units, _, _, _ = compiled.price(np.array([150.0]))
+    breakdown = compiled.breakdown(units[0])
+    assert [row['slab'] for row in breakdown] == ['0-100', '101-300']
+    assert [row['units'] for row in breakdown] == [100.0, 50.0]
+    assert breakdown[1]['charge'] == 225.0
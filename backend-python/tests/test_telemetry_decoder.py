@@ -0,0 +1,162 @@
+import json
+from datetime import datetime, timezone
+import pytest
+from app.services.telemetry_decoder import (
+    DecodeError, MAX_BATCH_READINGS, COMPACT_FORMAT, COMPACT_BATCH_HEADER, COMPACT_BATCH_VERSION,
+    decode_payload, decode_readings, encode_compact, encode_compact_batch
+)
+
+TOPIC = 'smartmeter/meter-001/telemetry'
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def reading(**overrides):
+    doc = {
+        'device_id': 'meter-001', 'timestamp': int(T0.timestamp()),
+        'voltage': 230.0, 'current': 1.5, 'power_w': 345.0, 'energy_kwh': 12.5
+    }
+    doc.update(overrides)
+    return doc
+
+def as_json(payload):
+    return json.dumps(payload).encode()
+
+def test_json_reading():
+    decoded = decode_payload(TOPIC, as_json(reading(power_factor=0.9, rssi='-60', extra='dropped')))
+    assert decoded['timestamp'] == T0
+    assert decoded['voltage'] == 230.0
+    assert decoded['power_factor'] == 0.9
+    assert decoded['rssi'] == -60
+    assert 'extra' not in decoded
+    assert 'created_at' in decoded
+
+def test_json_timestamp_forms():
+    ms = decode_payload(TOPIC, as_json(reading(timestamp=int(T0.timestamp() * 1000))))
+    iso = decode_payload(TOPIC, as_json(reading(timestamp='2026-01-01T00:00:00Z')))
+    assert ms['timestamp'] == iso['timestamp'] == T0
+
+def test_leading_whitespace_json():
+    assert decode_payload(TOPIC, b'  ' + as_json(reading()))['device_id'] == 'meter-001'
+
+def test_json_array_batch():
+    readings = decode_readings(TOPIC, as_json([reading(), reading(timestamp=int(T0.timestamp()) + 10)]))
+    assert [r['timestamp'].second for r in readings] == [0, 10]
+
+def test_json_object_batch_takes_device_id():
+    item = reading()
+    del item['device_id']
+    readings = decode_readings(TOPIC, as_json({'device_id': 'meter-002', 'readings': [item]}))
+    assert readings[0]['device_id'] == 'meter-002'
+
+def test_json_batch_device_id_from_topic():
+    item = reading()
+    del item['device_id']
+    assert decode_readings(TOPIC, as_json([item]))[0]['device_id'] == 'meter-001'
+
+def test_columnar_batch():
+    payload = {
+        't0': int(T0.timestamp()), 'dt': [0, 10000, 10000],
+        'voltage': [230, 231, 232], 'current': [1, 1, 1], 'power_w': [230, 231, 232], 'energy_kwh': [1, 1.1, 1.2]
+    }
+    readings = decode_readings(TOPIC, as_json(payload))
+    assert [r['timestamp'].second for r in readings] == [0, 10, 20]
+    assert [r['voltage'] for r in readings] == [230.0, 231.0, 232.0]
+    assert all(r['device_id'] == 'meter-001' for r in readings)
+
+def test_compact_roundtrip():
+    decoded = decode_payload(TOPIC, encode_compact(dict(reading(), timestamp=T0, power_factor=0.5, rssi=-70)))
+    assert decoded['timestamp'] == T0
+    assert decoded['energy_kwh'] == 12.5
+    assert decoded['rssi'] == -70
+
+def test_compact_batch_roundtrip():
+    items = [dict(reading(), timestamp=T0.replace(second=s)) for s in (0, 10, 20)]
+    readings = decode_readings(TOPIC, encode_compact_batch(items))
+    assert [r['timestamp'] for r in readings] == [i['timestamp'] for i in items]
+
+@pytest.mark.parametrize('raw, message', [
+    (b'', 'empty payload'),
+    (b'\x7f123', 'unknown payload format'),
+    (b'{"device_id": ', 'invalid JSON'),
+    (b'"just a string"', 'unknown payload format'),
+])
+def test_undecodable_payloads(raw, message):
+    with pytest.raises(DecodeError, match=message):
+        decode_readings(TOPIC, raw)
+
+def test_missing_required_field():
+    payload = reading()
+    del payload['energy_kwh']
+    with pytest.raises(DecodeError, match='missing field energy_kwh'):
+        decode_payload(TOPIC, as_json(payload))
+
+@pytest.mark.parametrize('field, value', [
+    ('voltage', 'abc'),
+    ('voltage', 'nan'),
+    ('power_w', 'inf'),
+    ('current', True),
+    ('rssi', False),
+    ('timestamp', True),
+    ('timestamp', 'yesterday'),
+    ('timestamp', 1e20),
+])
+def test_bad_field_values(field, value):
+    with pytest.raises(DecodeError, match=f'bad field {field}'):
+        decode_payload(TOPIC, as_json(reading(**{field: value})))
+
+def test_json_nan_literal():
+    raw = as_json(reading()).replace(b'"voltage": 230.0', b'"voltage": NaN')
+    with pytest.raises(DecodeError):
+        decode_payload(TOPIC, raw)
+
+def test_batch_item_not_object():
+    with pytest.raises(DecodeError, match='batch item is not an object'):
+        decode_readings(TOPIC, as_json([reading(), 5]))
+
+def test_batch_readings_not_array():
+    with pytest.raises(DecodeError, match='must be an array'):
+        decode_readings(TOPIC, as_json({'readings': {}}))
+
+def test_batch_too_large():
+    with pytest.raises(DecodeError, match='exceeds'):
+        decode_readings(TOPIC, as_json([reading()] * (MAX_BATCH_READINGS + 1)))
+
+def test_batch_rejected_as_a_whole():
+    with pytest.raises(DecodeError):
+        decode_readings(TOPIC, as_json([reading(), reading(voltage='nan')]))
+
+@pytest.mark.parametrize('payload, message', [
+    ({'t0': 0, 'voltage': [1]}, 'needs a dt array'),
+    ({'t0': 0, 'dt': [0, 1], 'voltage': [1]}, 'column voltage must be an array of 2'),
+    ({'t0': 0, 'dt': [0, -5], 'voltage': [1, 1]}, 'dt offsets'),
+    ({'t0': 0, 'dt': [0, True], 'voltage': [1, 1]}, 'bad t0/dt'),
+    ({'t0': True, 'dt': [0]}, 'bad t0/dt'),
+])
+def test_bad_columnar_batches(payload, message):
+    with pytest.raises(DecodeError, match=message):
+        decode_readings(TOPIC, as_json(dict(payload, device_id='meter-001')))
+
+def test_columnar_batch_without_device():
+    with pytest.raises(DecodeError, match='no device_id'):
+        decode_readings('telemetry', as_json({'t0': 0, 'dt': [0]}))
+
+def test_compact_wrong_size():
+    with pytest.raises(DecodeError, match='compact payload must be'):
+        decode_payload(TOPIC, encode_compact(dict(reading(), timestamp=T0))[:-1])
+
+def test_compact_without_device():
+    with pytest.raises(DecodeError, match='no device_id'):
+        decode_payload('telemetry', encode_compact(dict(reading(), timestamp=T0)))
+
+def test_compact_non_finite():
+    raw = COMPACT_FORMAT.pack(1, int(T0.timestamp()), float('nan'), 1.0, 1.0, 1.0, 1.0, 0)
+    with pytest.raises(DecodeError, match='non-finite'):
+        decode_payload(TOPIC, raw)
+
+def test_compact_batch_short_header():
+    with pytest.raises(DecodeError, match='shorter than its header'):
+        decode_readings(TOPIC, bytes([COMPACT_BATCH_VERSION, 0]))
+
+def test_compact_batch_wrong_length():
+    raw = COMPACT_BATCH_HEADER.pack(COMPACT_BATCH_VERSION, int(T0.timestamp()), 2)
+    with pytest.raises(DecodeError, match='compact batch of 2'):
+        decode_readings(TOPIC, raw)
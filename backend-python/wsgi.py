@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+"""
+WSGI Entry Point for production servers
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import create_app
+
+app = create_app()
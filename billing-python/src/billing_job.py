@@ -3,7 +3,10 @@ Billing Job - Generate invoices monthly
 """
 import os
 import sys
+import argparse
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from pymongo import MongoClient
@@ -11,11 +14,17 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-# Add parent to path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# A one-off run writes --metrics-file, never into the web workers' multiprocess
+# directory: cleared before prometheus_client reads it and .env is loaded
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = ''
+from prometheus_client import REGISTRY, write_to_textfile
 
-from backend_python.app.config.config import Config
-from backend_python.app.services.billing_service import BillingService
+# The backend's `app` package lives in backend-python/ next to this project
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'backend-python')))
+
+from app.config.config import Config
+from app.services.billing_service import BillingService
+from app.services.metrics import billing_device_seconds, billing_stage_seconds, MongoCommandMetrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,56 +34,126 @@ class BillingJob:
     
     def __init__(self, config):
         self.config = config
-        self.mongo_client = MongoClient(config.MONGODB_URI)
+        self.mongo_client = MongoClient(config.MONGO_URI, event_listeners=[MongoCommandMetrics()])
         self.db = self.mongo_client[config.DB_NAME]
         self.billing_svc = BillingService(self.db, config)
     
-    def run(self):
-        """Execute billing job"""
+    def run(self, month=None, workers=None, resume=True):
+        """
+        Execute billing job
+        Args:
+            month: 'YYYY-MM' to bill (default: previous month)
+            workers: Devices billed concurrently (default: config BILLING_WORKERS)
+            resume: Skip devices already invoiced by an earlier run for this month
+        Returns:
+            {'generated', 'skipped', 'errors'} counts, or None if the job failed to start
+        """
         try:
             logger.info('Starting monthly billing job')
             
+            # Previous month
+            if not month:
+                today = datetime.utcnow()
+                first_day_this_month = today.replace(day=1)
+                last_day_prev_month = first_day_this_month - timedelta(days=1)
+                month = last_day_prev_month.strftime('%Y-%m')
+            
+            if workers is None:
+                workers = getattr(self.config, 'BILLING_WORKERS', 1)
+            
             # Get all active devices
-            devices = list(self.db.devices.find({'status': {'$in': ['online', 'offline']}}))
-            logger.info(f'Processing {len(devices)} devices')
+            devices = list(self.db.devices.find(
+                {'status': {'$in': ['online', 'offline']}},
+                {'_id': 0, 'device_id': 1}
+            ))
+            device_ids = [d['device_id'] for d in devices]
             
-            # Previous month
-            today = datetime.utcnow()
-            first_day_this_month = today.replace(day=1)
-            last_day_prev_month = first_day_this_month - timedelta(days=1)
-            prev_month = last_day_prev_month.strftime('%Y-%m')
+            if resume:
+                done = set(self.db.billing_checkpoints.distinct('device_id', {'month': month}))
+                if done:
+                    logger.info(f'Resuming {month}: {len(done)} devices already invoiced')
+                device_ids = [d for d in device_ids if d not in done]
+            
+            logger.info(f'Processing {len(device_ids)} devices for {month} with {workers} workers')
+            
+            # One bulk computation for the fleet; invoices are then written in parallel
+            try:
+                with billing_stage_seconds.labels('compute_bills').time():
+                    bills = self.billing_svc.compute_bills(month, device_ids)
+            except Exception as e:
+                # Nothing could be billed: every device is an error, not "skipped"
+                logger.error(f'Error computing bills for {month}: {e}')
+                logger.info(f'Billing job completed: 0 invoices generated, 0 skipped, {len(device_ids)} errors')
+                return {'generated': 0, 'skipped': 0, 'errors': len(device_ids)}
             
             generated = 0
+            skipped = len(device_ids) - len(bills)
             errors = 0
             
-            for device in devices:
-                try:
-                    device_id = device['device_id']
-                    logger.info(f'Processing device: {device_id}')
-                    
-                    # Compute bill
-                    bill = self.billing_svc.compute_bill(device_id, prev_month)
-                    if not bill:
-                        logger.warning(f'No bill generated for {device_id}')
-                        continue
-                    
-                    # Generate invoice
-                    invoice_id = self.billing_svc.generate_invoice(bill, {})
-                    
-                    # Send email (if user has email)
-                    # self.send_invoice_email(device_id, bill)
-                    
-                    generated += 1
-                    logger.info(f'Invoice generated for {device_id}')
-                
-                except Exception as e:
-                    errors += 1
-                    logger.error(f'Error processing {device["device_id"]}: {e}')
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                futures = {pool.submit(self.bill_device, device_id, month, bill): device_id for device_id, bill in bills.items()}
+                for future in as_completed(futures):
+                    device_id = futures[future]
+                    try:
+                        if future.result():
+                            generated += 1
+                        else:
+                            skipped += 1
+                    except Exception as e:
+                        errors += 1
+                        logger.error(f'Error processing {device_id}: {e}')
+            billing_stage_seconds.labels('invoices').observe(time.perf_counter() - started)
             
-            logger.info(f'Billing job completed: {generated} invoices generated, {errors} errors')
+            logger.info(f'Billing job completed: {generated} invoices generated, {skipped} skipped, {errors} errors')
+            return {'generated': generated, 'skipped': skipped, 'errors': errors}
         
         except Exception as e:
             logger.error(f'Billing job failed: {e}')
+            return None
+    
+    def bill_device(self, device_id, month, bill=None):
+        """
+        Bill one device and checkpoint it once invoiced
+        Args:
+            bill: Precomputed bill from compute_bills(), computed here if omitted
+        Returns:
+            True if an invoice was generated (or already existed)
+        """
+        logger.info(f'Processing device: {device_id}')
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            outcome = self._bill_device(device_id, month, bill)
+            return outcome == 'invoiced'
+        finally:
+            billing_device_seconds.labels(outcome).observe(time.perf_counter() - started)
+    
+    def _bill_device(self, device_id, month, bill):
+        """bill_device body; returns 'invoiced' or 'skipped'"""
+        # Compute bill
+        if bill is None:
+            bill = self.billing_svc.compute_bill(device_id, month)
+        if not bill:
+            # Not checkpointed: compute_bill also returns None on errors, so retry next run
+            logger.warning(f'No bill generated for {device_id}')
+            return 'skipped'
+        
+        # Generate invoice (idempotent on device_id + month)
+        invoice_id = self.billing_svc.generate_invoice(bill, {})
+        if not invoice_id:
+            raise RuntimeError('invoice not saved')
+        
+        # Send email (if user has email)
+        # self.send_invoice_email(device_id, bill)
+        
+        self.db.billing_checkpoints.update_one(
+            {'month': month, 'device_id': device_id},
+            {'$set': {'invoice_id': invoice_id, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+        logger.info(f'Invoice generated for {device_id}')
+        return 'invoiced'
     
     def send_invoice_email(self, device_id, bill):
         """Send invoice email"""
@@ -112,6 +191,20 @@ Total: ₹{bill["total"]}
             logger.error(f'Error sending email: {e}')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monthly billing job')
+    parser.add_argument('--month', help='Month to bill, YYYY-MM (default: previous month)')
+    parser.add_argument('--workers', type=int, help='Devices billed concurrently')
+    parser.add_argument('--no-resume', action='store_true', help='Ignore checkpoints from earlier runs')
+    parser.add_argument('--metrics-file', help='Write Prometheus metrics here when done (node_exporter textfile collector)')
+    args = parser.parse_args()
+    
     config = Config()
     job = BillingJob(config)
-    job.run()
+    summary = job.run(month=args.month, workers=args.workers, resume=not args.no_resume)
+    
+    if args.metrics_file:
+        # Written to a temp file and renamed, so the collector never reads a partial file
+        write_to_textfile(args.metrics_file, REGISTRY)
+    
+    # Non-zero exit so cron/systemd notice a failed or partial run
+    sys.exit(0 if summary and not summary['errors'] else 1)
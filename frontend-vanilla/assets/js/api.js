@@ -42,13 +42,27 @@ async function createDevice(deviceData) {
     return await apiCall('/devices', 'POST', deviceData);
 }
 
+async function fetchLatest(deviceId) {
+    // 404 just means no telemetry yet, so don't raise a notification for it
+    try {
+        const response = await fetch(`${API_URL}/devices/${deviceId}/latest`);
+        return response.ok ? await response.json() : null;
+    } catch (error) {
+        console.error('API Error:', error);
+        return null;
+    }
+}
+
 // READINGS
-async function fetchReadings(deviceId, fromDate = null, toDate = null) {
+async function fetchReadings(deviceId, fromDate = null, toDate = null, agg = null, maxPoints = null) {
     let endpoint = `/devices/${deviceId}/readings`;
     const params = [];
     
     if (fromDate) params.push(`from=${fromDate}`);
     if (toDate) params.push(`to=${toDate}`);
+    if (agg) params.push(`agg=${agg}`);
+    // Server-side downsampling (LTTB) for charts: about maxPoints readings for any range
+    if (maxPoints) params.push(`max_points=${maxPoints}`);
     
     if (params.length > 0) {
         endpoint += '?' + params.join('&');
@@ -19,12 +19,35 @@ async function initializeApp() {
     // Load initial data
     await loadDashboardData();
     
-    // Refresh data every 10 seconds
-    setInterval(async () => {
-        if (currentDevice) {
-            await updateTelemetry();
+    // Live telemetry push; fall back to polling every 10 seconds
+    if (window.EventSource) {
+        openLiveStream();
+    } else {
+        setInterval(async () => {
+            if (currentDevice) {
+                await updateTelemetry();
+            }
+        }, 10000);
+    }
+}
+
+// Live telemetry (Server-Sent Events for the selected device)
+let liveStream = null;
+
+function openLiveStream() {
+    if (liveStream) {
+        liveStream.close();
+        liveStream = null;
+    }
+    if (!currentDevice) return;
+
+    liveStream = new EventSource(`${API_URL}/live?devices=${encodeURIComponent(currentDevice)}`);
+    liveStream.addEventListener('reading', (e) => {
+        const latest = JSON.parse(e.data);
+        if (latest.device_id === currentDevice) {
+            renderTelemetry(latest);
         }
-    }, 10000);
+    });
 }
 
 // Setup all event listeners
@@ -129,6 +152,7 @@ async function loadDevices() {
 // Select device
 async function selectDevice(e) {
     currentDevice = e.target.value;
+    if (window.EventSource) openLiveStream();
     if (currentDevice) {
         await updateTelemetry();
         await updateCharts(currentDevice);
@@ -155,14 +179,16 @@ async function loadDashboardData() {
 async function updateTelemetry() {
     if (!currentDevice) return;
 
-    const readingsData = await fetchReadings(currentDevice);
+    const latest = await fetchLatest(currentDevice);
     
-    if (!readingsData || !readingsData.readings || readingsData.readings.length === 0) {
+    if (!latest) {
         return;
     }
 
-    const latest = readingsData.readings[readingsData.readings.length - 1];
-    
+    renderTelemetry(latest);
+}
+
+function renderTelemetry(latest) {
     document.getElementById('voltageValue').textContent = (latest.voltage || 0).toFixed(1);
     document.getElementById('currentValue').textContent = (latest.current || 0).toFixed(2);
     document.getElementById('powerValue').textContent = Math.round(latest.power_w || 0);
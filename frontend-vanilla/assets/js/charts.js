@@ -29,7 +29,8 @@ function initPowerChart(data = []) {
                 borderWidth: 2,
                 fill: true,
                 tension: 0.4,
-                pointRadius: 4,
+                // Markers only help on short series
+                pointRadius: data.length > 200 ? 0 : 4,
                 pointBackgroundColor: '#2563eb'
             }]
         },
@@ -114,34 +115,21 @@ async function updateCharts(deviceId) {
         const toDate = new Date().toISOString();
         const fromDate = new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString();
         
-        const readingsData = await fetchReadings(deviceId, fromDate, toDate);
+        const readingsData = await fetchReadings(deviceId, fromDate, toDate, null, CHART_MAX_POINTS);
         
         if (readingsData && readingsData.readings) {
             initPowerChart(readingsData.readings);
         }
 
-        // Last 30 days consumption
+        // Last 30 days consumption (bucketed by day on the server)
         const thirtyDaysAgo = new Date(Date.now() - 30 * 24 * 60 * 60 * 1000).toISOString();
-        const pastReadings = await fetchReadings(deviceId, thirtyDaysAgo, toDate);
+        const dailyReadings = await fetchReadings(deviceId, thirtyDaysAgo, toDate, 'day');
         
-        if (pastReadings && pastReadings.readings) {
-            // Group by day
-            const dailyData = {};
-            pastReadings.readings.forEach(r => {
-                const date = new Date(r.timestamp).toLocaleDateString();
-                if (!dailyData[date]) {
-                    dailyData[date] = [];
-                }
-                dailyData[date].push(r);
-            });
-
-            // Calculate daily consumption
-            const consumptionData = Object.entries(dailyData).map(([date, readings]) => {
-                const consumption = readings.length > 0 
-                    ? readings[readings.length - 1].energy_kwh - readings[0].energy_kwh
-                    : 0;
-                return { date, consumption: Math.max(consumption, 0) };
-            });
+        if (dailyReadings && dailyReadings.readings) {
+            const consumptionData = dailyReadings.readings.map(d => ({
+                date: new Date(d.timestamp).toLocaleDateString(),
+                consumption: d.energy_kwh
+            }));
 
             initConsumptionChart(consumptionData);
         }
@@ -3,6 +3,9 @@ const API_URL = 'http://localhost:5000/api';
 const MQTT_HOST = 'localhost';
 const MQTT_PORT = 8083;
 
+// Readings per chart line; the server downsamples longer ranges to this
+const CHART_MAX_POINTS = 1500;
+
 // Chart instances
 let powerChart = null;
 let consumptionChart = null;